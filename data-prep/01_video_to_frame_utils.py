@@ -4,16 +4,16 @@ from __future__ import (absolute_import, division,
 import os
 import cv2
 import logging
-import skimage
-import skimage.io as io
-import skimage.transform
-import numpy as np
-import torchvision
-import torch
 import time
 import boto3
 import shutil
 import argparse
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from preview_utils import PreviewWriter, build_previews
+from s3_upload_utils import DEFAULT_WORKERS, S3Uploader, create_s3_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,6 +22,7 @@ s3 = session.resource('s3')
 
 IMG_DIM = 128  # the width and height to resize the frames for preview
 REPORT_STATUS = 500 # number of frames to report progress
+SCENE_CHANGE_WIDTH = 64  # width frames are shrunk to before comparing them for scene changes
 
 # construct the argument parser and parse the arguments
 ap = argparse.ArgumentParser()
@@ -37,52 +38,273 @@ ap.add_argument("-r", "--visualize_sample_rate", type=int, required=False, defau
                 help="For visualizing the video, how frequent (in seconds) to sample the frames. default to sample every second.")
 ap.add_argument("-u", "--upload_frames", action='store_true',
                 help="Whether to have the script upload the frames. If you choose not to, the frames will be stored" +
-                     " on local disk and you can use e.g. s3 sync command line tool to upload them into S3 in bulk."
+                     " on local disk and you can use e.g. s3 sync command line tool to upload them into S3 in bulk." +
+                     " Frames already in S3 with the same content are skipped."
                 )
+ap.add_argument("-s", "--stream_upload", action='store_true',
+                help="Upload every frame straight from memory while the rest of the video is decoded, instead of " +
+                     "writing all the frames to disk first. Requires --upload_frames, decodes in a single process")
+ap.add_argument("-kf", "--keep_frames", action='store_true',
+                help="With --stream_upload, also write the frames to the working directory. They are kept even " +
+                     "when --cleanup_files is set")
+ap.add_argument("-ut", "--upload_threads", type=int, required=False, default=DEFAULT_WORKERS,
+                help="number of frames uploaded to S3 at the same time. default is {}".format(DEFAULT_WORKERS))
 ap.add_argument("-p", "--frame_prefix", required=False, help="the S3 prefix to upload the extracted frames")
 ap.add_argument("-c", "--cleanup_files", required=False, default=True,
                 help="whether to automatically clean up the files in the end. If the frames were not uploaded to S3, they will be kept on local disk even if this is set to true ")
 
+ap.add_argument("-sr", "--sampling_rate", type=int, required=False, default=1,
+                help="Extract one out of how many frames. e.g. 30 means 1 out of every 30 frames. The other frames are " +
+                     "skipped without being decoded or written. Default to 1, every frame")
+ap.add_argument("-sc", "--scene_change_threshold", type=float, required=False, default=None,
+                help="Only keep a sampled frame if its mean absolute pixel difference (from 0 to 1) to the last kept " +
+                     "frame is at least this, e.g. 0.05. Default is to keep every sampled frame")
+ap.add_argument("-m", "--manifest", action='store_true',
+                help="Write the ground truth labeling manifest of the extracted frames, as 02_generate_gt_manifest.py " +
+                     "does, referencing them at s3://OUTPUT_S3_BUCKET/FRAME_PREFIX. Requires --frame_prefix")
+ap.add_argument("-w", "--workers", type=int, required=False, default=1,
+                help="number of processes extracting frames, each decoding its own range of the video. default is 1")
+ap.add_argument("-t", "--writer_threads", type=int, required=False, default=4,
+                help="number of threads encoding and writing frames in each process. default is 4")
+
 ap.add_argument("-pp", "--video_preview_prefix", required=False, default="previews/video/",
                 help="the S3 prefix to upload the video preview/visualization. default is previews/video/")
 
 
-def video_to_frames(video, output_base_dir):
+def write_frame(path, image):
+    if not cv2.imwrite(path, image):
+        raise IOError("could not write frame {}".format(path))
+
+
+def scene_thumbnail(image):
+    """
+    :return: a small grayscale copy of the frame to compare with other frames
+    """
+    height = max(1, image.shape[0] * SCENE_CHANGE_WIDTH // image.shape[1])
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (SCENE_CHANGE_WIDTH, height), interpolation=cv2.INTER_AREA)
+
+
+def scene_change(previous, current):
+    """
+    :return: mean absolute difference between two thumbnails, from 0 (identical) to 1
+    """
+    return cv2.absdiff(previous, current).mean() / 255.0
+
+
+class FrameReader(object):
+    """
+    Iterates over the (index, image) pairs of the frames [first_frame, last_frame) of a video that are kept by the
+    sampling rate and the scene change threshold
+    """
+
+    def __init__(self, video, first_frame=0, last_frame=None, sampling_rate=1, scene_change_threshold=None):
+        """
+        :param last_frame: index of the frame to stop at, or None to read until the end of the video
+        :param sampling_rate: only frames whose index is a multiple of this are decoded, the others are only grabbed
+        :param scene_change_threshold: skip a sampled frame when its scene_change from the last frame kept is below this
+        """
+        self.video = video
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+        self.sampling_rate = sampling_rate
+        self.scene_change_threshold = scene_change_threshold
+        self.count = first_frame  # index of the next frame to read
+
+    def __iter__(self):
+        vidcap = cv2.VideoCapture(self.video)
+        try:
+            if self.first_frame > 0:
+                vidcap.set(cv2.CAP_PROP_POS_FRAMES, self.first_frame)
+                if int(vidcap.get(cv2.CAP_PROP_POS_FRAMES)) != self.first_frame:
+                    # the container does not support seeking to a frame, skip to it by decoding from the start
+                    logger.warning("could not seek to frame {}, skipping frames from the start instead".format(
+                        self.first_frame))
+                    vidcap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    for _ in range(self.first_frame):
+                        vidcap.grab()
+            previous = None
+            while vidcap.isOpened() and (self.last_frame is None or self.count < self.last_frame):
+                index = self.count
+                if index % self.sampling_rate:
+                    # move past the frame without decoding it
+                    if not vidcap.grab():
+                        break
+                    self.count += 1
+                    continue
+                success, image = vidcap.read()
+                if not success:
+                    break
+                self.count += 1
+                if self.scene_change_threshold is not None:
+                    thumbnail = scene_thumbnail(image)
+                    if previous is not None and scene_change(previous, thumbnail) < self.scene_change_threshold:
+                        continue
+                    previous = thumbnail
+                yield index, image
+        finally:
+            vidcap.release()
+
+    @property
+    def read(self):
+        """
+        :return: number of frames read so far, decoded or not
+        """
+        return self.count - self.first_frame
+
+
+def frame_name(prefix, index):
+    # Add padding to the frame index. e.g. 1 -> 000001, 10 -> 000010 etc.
+    return prefix + '_{0:06d}.jpg'.format(index)
+
+
+def extract_frame_range(video, frame_sub_dir, prefix, first_frame, last_frame, writer_threads, sampling_rate=1,
+                        scene_change_threshold=None):
+    """
+    Decode frames [first_frame, last_frame) of the video and write them as 'prefix_000123.jpg' files. JPEG encoding
+    and writing happen on a pool of writer_threads threads while the next frames are decoded.
+    :param last_frame: index of the frame to stop at, or None to read until the end of the video
+    :param sampling_rate: only frames whose index is a multiple of this are decoded, the others are only grabbed
+    :param scene_change_threshold: skip a sampled frame when its scene_change from the last frame written is below this
+    :return: number of frames read and number of frames written
+    """
+    reader = FrameReader(video, first_frame, last_frame, sampling_rate, scene_change_threshold)
+    written = 0
+    start = time.time()
+    # bound the number of decoded frames waiting to be written so memory does not grow when writing falls behind
+    in_flight = threading.BoundedSemaphore(2 * writer_threads)
+    futures = []
+    with ThreadPoolExecutor(max_workers=writer_threads) as writers:
+        for index, image in reader:
+            in_flight.acquire()
+            future = writers.submit(write_frame, os.path.join(frame_sub_dir, frame_name(prefix, index)), image)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+            written += 1
+            if written % REPORT_STATUS == 0:
+                logger.info("extracted {} frames from frame {}. ".format(written, first_frame))
+                logger.info("took {:10.4f} seconds to extract {} frames".format(time.time() - start, REPORT_STATUS))
+                start = time.time()
+    for future in futures:
+        future.result()
+    return reader.read, written
+
+
+def _extract_frame_range(arguments):
+    return extract_frame_range(*arguments)
+
+
+def video_to_frames(video, output_base_dir, workers=1, writer_threads=4, sampling_rate=1, scene_change_threshold=None):
     """
     Convert the videos we took to images and generate the file names unique with frame indexes e.g. 'video_name_000001.jpg'
     :param video: path to the video file on local disk
     :param output_base_dir: the base directory the frames will be saved in
+    :param workers: number of processes decoding the video. With more than one, the video is split into frame ranges
+                    and every process seeks to the start of its range.
+    :param writer_threads: number of threads encoding and writing the frames in each process
+    :param sampling_rate: only extract one out of this many frames, without decoding the others
+    :param scene_change_threshold: also skip sampled frames that differ from the last extracted frame by less than
+                                   this mean absolute pixel difference, from 0 to 1. With several workers, the first
+                                   frame of every range is always kept.
     :return: the directory created that contains extracted frames
     """
     # extract frames from a video and save to directory with the name of the video and file name 'video_name_x.jpg' where
     # x is the frame index
-    vidcap = cv2.VideoCapture(video)
-    count = 0
     filename = os.path.split(video)[1]
     prefix = os.path.splitext(filename)[0]
     frame_sub_dir = os.path.join(output_base_dir, prefix)
     os.mkdir(frame_sub_dir)
     logger.info("created {} folder for frames".format(frame_sub_dir))
     start = time.time()
-    while vidcap.isOpened():
-        success, image = vidcap.read()
-        if success:
-            # Add padding to the frame index. e.g. 1 -> 000001, 10 -> 000010 etc.
-            image_name = prefix + '_{0:06d}.jpg'.format(count)
-            cv2.imwrite(os.path.join(frame_sub_dir, image_name), image)
-            count += 1
-            if count % REPORT_STATUS == 0:
-                logger.info("extracted {} frames. ".format(count))
-                logger.info("took {:10.4f} seconds to extract {} frames".format(time.time() - start, REPORT_STATUS))
-                start = time.time()
-        else:
-            break
-    cv2.destroyAllWindows()
+
+    vidcap = cv2.VideoCapture(video)
+    frame_count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
     vidcap.release()
-    logger.info("written {} frames for {}".format(count, filename))
+    workers = max(1, min(workers, frame_count))
+    if workers == 1:
+        counts = [extract_frame_range(video, frame_sub_dir, prefix, 0, None, writer_threads, sampling_rate,
+                                      scene_change_threshold)]
+    else:
+        # the frame count in the container header can be off, so the last range reads until the end of the video
+        bounds = [frame_count * i // workers for i in range(workers)] + [None]
+        ranges = [(video, frame_sub_dir, prefix, bounds[i], bounds[i + 1], writer_threads, sampling_rate,
+                   scene_change_threshold) for i in range(workers)]
+        logger.info("extracting {} frames with {} processes".format(frame_count, workers))
+        pool = multiprocessing.Pool(workers)
+        try:
+            counts = pool.map(_extract_frame_range, ranges)
+        finally:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - start
+    count = sum(read for read, _ in counts)
+    logger.info("written {} out of {} frames for {} in {:.2f} seconds ({:.1f} frames per second)".format(
+        sum(written for _, written in counts), count, filename, elapsed, count / elapsed if elapsed > 0 else 0))
     return frame_sub_dir
 
 
+def encode_and_upload(image, uploader, key, path=None):
+    """
+    JPEG encode a frame in memory and queue it for upload, also writing it to path if given
+    """
+    success, encoded = cv2.imencode('.jpg', image)
+    if not success:
+        raise IOError("could not encode frame {}".format(key))
+    data = encoded.tobytes()
+    if path is not None:
+        with open(path, 'wb') as f:
+            f.write(data)
+    uploader.submit(key, data=data)
+
+
+def stream_frames(video, uploader, frames_s3_prefix, frame_sub_dir=None, writer_threads=4, sampling_rate=1,
+                  scene_change_threshold=None, preview=None, visualize_every_x_frames=1):
+    """
+    Decode the video and upload every extracted frame to frames_s3_prefix/video_name_000123.jpg straight from memory,
+    while the next frames are decoded. Frames are JPEG encoded on writer_threads threads and uploaded on the threads
+    of the uploader, whose bounded queue holds back decoding when uploading is slower, so memory stays bounded and
+    nothing has to be written to disk.
+    :param uploader: S3Uploader to upload the frames with
+    :param frame_sub_dir: directory to also write the frames to, or None to keep no local copy
+    :param preview: PreviewWriter to add the first frame of every visualize_every_x_frames frames to, or None
+    :return: names of the frames extracted and the summary of the upload
+    """
+    prefix = os.path.splitext(os.path.split(video)[1])[0]
+    reader = FrameReader(video, 0, None, sampling_rate, scene_change_threshold)
+    frame_names = []
+    last_interval = -1
+    start = time.time()
+    in_flight = threading.BoundedSemaphore(2 * writer_threads)
+    futures = []
+    uploader.start()
+    try:
+        with ThreadPoolExecutor(max_workers=writer_threads) as encoders:
+            for index, image in reader:
+                if preview is not None and index // visualize_every_x_frames > last_interval:
+                    last_interval = index // visualize_every_x_frames
+                    preview.add(image)
+                name = frame_name(prefix, index)
+                path = os.path.join(frame_sub_dir, name) if frame_sub_dir is not None else None
+                in_flight.acquire()
+                future = encoders.submit(encode_and_upload, image, uploader, '{}/{}'.format(frames_s3_prefix, name),
+                                         path)
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append(future)
+                frame_names.append(name)
+                if len(frame_names) % REPORT_STATUS == 0:
+                    logger.info("extracted {} frames, {} uploaded".format(len(frame_names), uploader.uploaded))
+    finally:
+        summary = uploader.finish()
+    for future in futures:
+        future.result()
+
+    elapsed = time.time() - start
+    logger.info("streamed {} out of {} frames for {} in {:.2f} seconds ({:.1f} frames per second)".format(
+        len(frame_names), reader.read, video, elapsed, reader.read / elapsed if elapsed > 0 else 0))
+    return frame_names, summary
+
+
 def get_frame_rate(video):
     """ Get the frame rate for the video (frames per second) """
 
@@ -106,81 +328,117 @@ def get_frame_rate(video):
     return fps
 
 
+def frame_index(frame_name):
+    """
+    :return: the index of the frame in the video, e.g. 123 for 'video_name_000123.jpg'
+    """
+    return int(os.path.splitext(frame_name)[0].rsplit('_', 1)[1])
+
+
+def write_manifest(frame_dir, s3_bucket, frame_prefix, sampling_rate, working_dir, frame_names=None):
+    """
+    Write the ground truth labeling manifest for the extracted frames, in the same format and under the same name as
+    02_generate_gt_manifest.py, without listing S3
+    :param frame_prefix: s3 prefix the frames are (or will be) uploaded to
+    :param frame_names: names of the frames, listed from frame_dir by default
+    :return: path of the manifest
+    """
+    frames_s3_prefix = frame_prefix + frame_dir.split('/')[-1]
+    manifest_filename = '{}_sampling_every_{}_ground_truth_manifest.json'.format(frame_dir.split('/')[-1],
+                                                                                 sampling_rate)
+    manifest_filepath = os.path.join(working_dir, manifest_filename)
+    count = 0
+    with open(manifest_filepath, 'w') as outfile:
+        for frame in sorted(frame_names if frame_names is not None else os.listdir(frame_dir)):
+            json.dump({'source-ref': 's3://{}/{}/{}'.format(s3_bucket, frames_s3_prefix, frame)}, outfile)
+            outfile.write('\n')
+            count += 1
+    logger.info("wrote {} frames to manifest {}".format(count, manifest_filepath))
+    return manifest_filepath
+
+
+def visualize_interval(fps, visualize_sample_rate):
+    """
+    :return: number of frames between the frames sampled for the preview
+    """
+    return max(1, visualize_sample_rate * int(fps))
+
+
 def sample_frames(frame_dir, fps, visualize_sample_rate):
     """
-    Sample frames every X seconds, resize the frame and add it to an numpy array
+    Sample frames every X seconds
     :param frame_dir: directory path containing the frames
     :param fps: frame rate of the video
-    :return: numpy array of the sampled frames
+    :return: paths of the sampled frames
     """
-    visualize_every_x_frames = visualize_sample_rate * int(fps)
-    sampled_frames = np.empty((0, 3, IMG_DIM, IMG_DIM), dtype=np.float32)  # B, C, H, W
+    visualize_every_x_frames = visualize_interval(fps, visualize_sample_rate)
+    sampled_frames = []
     i = 0
+    last_interval = -1
     for file in sorted(os.listdir(frame_dir)):
-        if i % visualize_every_x_frames == 0:
-            img = skimage.img_as_float(skimage.io.imread(os.path.join(frame_dir, file))).astype(np.float32)
-            img = skimage.transform.resize(img, (IMG_DIM, IMG_DIM))  # H, W, C
-            img = img.swapaxes(1, 2).swapaxes(0, 1)  # C, H, W
-            sampled_frames = np.append(sampled_frames, np.array([img]), axis=0)
+        # use the first frame of every interval, going by the frame index as frames may have been skipped
+        interval = frame_index(file) // visualize_every_x_frames
+        if interval > last_interval:
+            last_interval = interval
+            sampled_frames.append(os.path.join(frame_dir, file))
         i += 1
     logger.debug("total number of frames: {}".format(i))
     return sampled_frames
 
 
+def preview_name(video_name):
+    return video_name.split('.')[0] + "-preview.png"
+
+
 def generate_preview_image(fps, frame_dir, video_name, visualize_sample_rate, working_dir):
     """
-    first sample frames every X seconds, resize them ,then
-    concatenate sampled images into one image using torchvision's util functions
+    first sample frames every X seconds, then resize them into a grid of thumbnails. Long videos get several
+    preview images.
     :param fps: frame rate of the video
     :param frame_dir: directory path containing the frames
     :param video_name: name of the video
     :param visualize_sample_rate how frequent (in seconds) to sample the frames for the preview
     :param working_dir directory to save the preview
-    :return: name of the preview image generated
+    :return: names of the preview images generated
     """
     sampled_frames = sample_frames(frame_dir, fps, visualize_sample_rate)
-    grid = (torchvision.utils.make_grid(torch.from_numpy(sampled_frames)))
-    preview_file_name = video_name.split('.')[0] + "-preview.png"
-    torchvision.utils.save_image(grid, os.path.join(working_dir, preview_file_name))
-    return preview_file_name
+    preview_file_name = preview_name(video_name)
+    frames = (cv2.imread(path, cv2.IMREAD_COLOR) for path in sampled_frames)
+    preview_paths = build_previews(frames, len(sampled_frames), os.path.join(working_dir, preview_file_name),
+                                   IMG_DIM)
+    return [os.path.basename(path) for path in preview_paths]
 
 
-def load_data_to_s3(frame_dir, preview_file_name, s3_bucket, frame_prefix, upload_frames, video_preview_prefix,
-                    working_dir):
+def load_data_to_s3(frame_dir, preview_file_names, s3_bucket, frame_prefix, upload_frames, video_preview_prefix,
+                    working_dir, upload_threads=DEFAULT_WORKERS):
     """
     Upload the extracted frames and the preview image to S3
     :param frame_dir: directory path containing the frames
-    :param preview_file_name: preview image generated
+    :param preview_file_names: preview images generated
     :param s3_bucket s3 bucket to upload to
     :param frame_prefix s3 prefix to upload frames to
     :param upload_frames whether to upload frames to S3
     :param video_preview_prefix s3 prefix to upload video preview to
+    :param upload_threads number of frames uploaded at the same time
     :return: None
     """
     if upload_frames:
-        count = 0
         frames_s3_prefix = frame_prefix + frame_dir.split('/')[-1]
-        start = time.time()
-        for frame in os.listdir(frame_dir):
-            # this will upload the frame in vid_a/vid_a_000001.jpg to s3://bucket/frame-prefix/vid_a/vid_a_000001.jpg
-            frame_local_path =  os.path.join(frame_dir, frame)
-            frame_s3_key = "{}/{}".format(frames_s3_prefix, frame)
-            s3.Bucket(s3_bucket).upload_file(frame_local_path, frame_s3_key)
-            count += 1
-            if count % REPORT_STATUS == 0:
-                logger.info("uploaded {} frames. ".format(count))
-                logger.info("took {:10.4f} seconds to upload {} frames".format(time.time() - start, REPORT_STATUS))
-                start = time.time()
-        logger.info("uploaded {} frames to s3://{}/{}".format(count, s3_bucket, frames_s3_prefix))
-
-    if preview_file_name is not None:
+        # this will upload the frame in vid_a/vid_a_000001.jpg to s3://bucket/frame-prefix/vid_a/vid_a_000001.jpg
+        uploader = S3Uploader(s3_bucket, client=create_s3_client(upload_threads, session), max_workers=upload_threads)
+        summary = uploader.upload_directory(frame_dir, frames_s3_prefix)
+        if summary['failed']:
+            raise IOError("could not upload {} frames to s3://{}/{}".format(summary['failed'], s3_bucket,
+                                                                             frames_s3_prefix))
+
+    for preview_file_name in preview_file_names:
         preview_file_s3_key = video_preview_prefix + preview_file_name
         s3.Bucket(s3_bucket).upload_file(os.path.join(working_dir, preview_file_name), preview_file_s3_key)
         logger.info("uploaded preview to s3://{}/{}".format(s3_bucket, preview_file_s3_key))
 
 
 def clean_up_local_files(frame_dir, video_name, upload_frames):
-    if upload_frames:
+    if upload_frames and os.path.isdir(frame_dir):
         shutil.rmtree(frame_dir)
         logger.info("deleted folder {}".format(frame_dir))
     # since the video was downloaded from s3, it's safe to delete it as the copy on S3 still exists.
@@ -189,24 +447,33 @@ def clean_up_local_files(frame_dir, video_name, upload_frames):
 
 
 def process_video(s3_bucket, s3_key, output_s3_bucket, working_dir, upload_frames, frame_prefix, visualize_frames, visualize_sample_rate,
-                  video_preview_prefix, clean_up_files):
+                  video_preview_prefix, clean_up_files, workers=1, writer_threads=4, sampling_rate=1,
+                  scene_change_threshold=None, manifest=False, upload_threads=DEFAULT_WORKERS, stream_upload=False,
+                  keep_frames=False):
     start = time.time()
     logger.info("Start processing {}".format(s3_key))
     video_name = s3_key.split('/')[-1]
     s3.Bucket(s3_bucket).download_file(s3_key, video_name)
     fps = get_frame_rate(video_name)
-    frame_dir = video_to_frames(video_name, working_dir)
+    if stream_upload:
+        stream_video(video_name, fps, output_s3_bucket, working_dir, frame_prefix, visualize_frames,
+                     visualize_sample_rate, video_preview_prefix, clean_up_files, writer_threads, sampling_rate,
+                     scene_change_threshold, manifest, upload_threads, keep_frames)
+        return
+    frame_dir = video_to_frames(video_name, working_dir, workers, writer_threads, sampling_rate, scene_change_threshold)
     logger.info("Finished converting video to frames. Took {:10.4f} seconds".format(time.time() - start))
+    if manifest:
+        write_manifest(frame_dir, output_s3_bucket, frame_prefix, sampling_rate, working_dir)
 
     start = time.time()
+    preview_file_names = []
     if visualize_frames:
-        preview_file_name = generate_preview_image(fps, frame_dir, video_name, visualize_sample_rate, working_dir)
-
-    logger.info("Stored preview at {}. took {:10.4f} seconds.".format(os.path.join(working_dir, preview_file_name),
-                                                                      time.time() - start))
+        preview_file_names = generate_preview_image(fps, frame_dir, video_name, visualize_sample_rate, working_dir)
+        logger.info("Stored preview at {}. took {:10.4f} seconds.".format(
+            ', '.join(os.path.join(working_dir, name) for name in preview_file_names), time.time() - start))
     start = time.time()
-    load_data_to_s3(frame_dir, preview_file_name, output_s3_bucket, frame_prefix, upload_frames, video_preview_prefix,
-                    working_dir)
+    load_data_to_s3(frame_dir, preview_file_names, output_s3_bucket, frame_prefix, upload_frames, video_preview_prefix,
+                    working_dir, upload_threads)
     logger.info("finished uploading. took {:10.4f} seconds.".format(time.time() - start))
 
     if clean_up_files:
@@ -216,6 +483,55 @@ def process_video(s3_bucket, s3_key, output_s3_bucket, working_dir, upload_frame
         print("The frames are stored at {}. You can use tools like s3 sync to upload them to S3. ".format(frame_dir))
 
 
+def stream_video(video_name, fps, output_s3_bucket, working_dir, frame_prefix, visualize_frames, visualize_sample_rate,
+                 video_preview_prefix, clean_up_files, writer_threads=4, sampling_rate=1, scene_change_threshold=None,
+                 manifest=False, upload_threads=DEFAULT_WORKERS, keep_frames=False):
+    """
+    process_video with the frames uploaded to S3 while the video is decoded, instead of after all of them are
+    written to disk. The preview is built from the decoded frames as they go by.
+    :param keep_frames: also write the frames to working_dir/video_name
+    """
+    start = time.time()
+    prefix = os.path.splitext(video_name)[0]
+    frame_dir = os.path.join(working_dir, prefix)
+    if keep_frames:
+        os.mkdir(frame_dir)
+        logger.info("created {} folder for frames".format(frame_dir))
+    frames_s3_prefix = frame_prefix + prefix
+    uploader = S3Uploader(output_s3_bucket, client=create_s3_client(upload_threads, session),
+                          max_workers=upload_threads)
+    uploader.list_existing(frames_s3_prefix + '/')
+
+    preview = None
+    visualize_every_x_frames = visualize_interval(fps, visualize_sample_rate)
+    if visualize_frames:
+        vidcap = cv2.VideoCapture(video_name)
+        frame_count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+        vidcap.release()
+        preview = PreviewWriter(os.path.join(working_dir, preview_name(video_name)),
+                                frame_count // visualize_every_x_frames + 1, IMG_DIM)
+    try:
+        frame_names, summary = stream_frames(video_name, uploader, frames_s3_prefix,
+                                             frame_dir if keep_frames else None, writer_threads, sampling_rate,
+                                             scene_change_threshold, preview, visualize_every_x_frames)
+    finally:
+        preview_paths = preview.close() if preview is not None else []
+    logger.info("Finished streaming video frames to S3. Took {:10.4f} seconds".format(time.time() - start))
+    if summary['failed']:
+        raise IOError("could not upload {} frames to s3://{}/{}".format(summary['failed'], output_s3_bucket,
+                                                                         frames_s3_prefix))
+    if manifest:
+        write_manifest(frame_dir, output_s3_bucket, frame_prefix, sampling_rate, working_dir, frame_names)
+
+    preview_file_names = [os.path.basename(path) for path in preview_paths]
+    load_data_to_s3(frame_dir, preview_file_names, output_s3_bucket, frame_prefix, False, video_preview_prefix,
+                    working_dir, upload_threads)
+
+    if clean_up_files:
+        # the copy written with --keep_frames is what the flag asked for, only the video is removed
+        clean_up_local_files(frame_dir, video_name, not keep_frames)
+
+
 def list_videos(s3_bucket, s3_prefix):
     object_iterator = s3.Bucket(s3_bucket).objects.filter(
         Prefix=s3_prefix
@@ -238,14 +554,16 @@ def main():
 
     upload_frames = args["upload_frames"]
     frame_prefix = args["frame_prefix"]
+    manifest = args["manifest"]
     logger.info("upload frames to S3: {}".format(upload_frames))
-    if upload_frames:
+    if upload_frames or manifest:
         if frame_prefix is None:
-            ap.error('--frame_prefix must be given if upload_frames is selected')
+            ap.error('--frame_prefix must be given if upload_frames or manifest is selected')
         else:
             if not frame_prefix.endswith("/"):
                 frame_prefix += "/"
-            logger.info("Will upload frames to s3://{}/{}".format(s3_bucket, frame_prefix))
+            if upload_frames:
+                logger.info("Will upload frames to s3://{}/{}".format(s3_bucket, frame_prefix))
 
     visualize_frames = args["visualize_video"]
     visualize_sample_rate = args["visualize_sample_rate"]
@@ -258,9 +576,30 @@ def main():
             visualize_sample_rate, s3_bucket, video_preview_prefix))
 
     cleanup_files = args["cleanup_files"]
+    workers = args["workers"]
+    writer_threads = args["writer_threads"]
+    if workers < 1 or writer_threads < 1:
+        ap.error('--workers and --writer_threads must be at least 1')
+    sampling_rate = args["sampling_rate"]
+    if sampling_rate < 1:
+        ap.error('--sampling_rate must be at least 1')
+    scene_change_threshold = args["scene_change_threshold"]
+    upload_threads = args["upload_threads"]
+    if upload_threads < 1:
+        ap.error('--upload_threads must be at least 1')
+    stream_upload = args["stream_upload"]
+    keep_frames = args["keep_frames"]
+    if stream_upload:
+        if not upload_frames:
+            ap.error('--stream_upload requires --upload_frames')
+        if workers > 1:
+            ap.error('--stream_upload decodes the video in a single process, --workers must be 1')
+    elif keep_frames:
+        ap.error('--keep_frames only applies to --stream_upload')
 
     process_video(s3_bucket, s3_key, output_s3_bucket, working_directory, upload_frames, frame_prefix, visualize_frames,
-                  visualize_sample_rate, video_preview_prefix, cleanup_files)
+                  visualize_sample_rate, video_preview_prefix, cleanup_files, workers, writer_threads, sampling_rate,
+                  scene_change_threshold, manifest, upload_threads, stream_upload, keep_frames)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,13 @@
 import json
 import os
-import skimage
-import skimage.io as io
-import skimage.transform
-import numpy as np
-import torchvision
-import torch
+import cv2
 import boto3
 import shutil
 import argparse
 import logging
 import time
 from urllib.parse import urlparse  # python 3
+from preview_utils import build_previews
 
 # from urlparse import urlparse  # python 2
 
@@ -46,33 +42,37 @@ def get_image_list_from_manifest(manifest_s3_bucket, manifest_s3_key):
 
 
 def sample_frames(tmp_folder, images, image_directory):
-    sampled_frames = np.empty((0, 3, IMG_DIM, IMG_DIM), dtype=np.float32)  # B, C, H, W
+    """
+    Read every VISUALIZE_EVERY_X_FRAMES-th image of the manifest, from image_directory if it is there, else from S3
+    :return: generator of the images
+    """
     i = 0
-
-    for s3_path in images:
-        if i % VISUALIZE_EVERY_X_FRAMES == 0:
-            o = urlparse(s3_path)
-            image_name = s3_path.split('/')[-1]
-
-            if image_directory is not None and os.path.exists(os.path.join(image_directory, image_name)):
-                image_path = os.path.join(image_directory, image_name)
-                logger.debug("{} already exists".format(image_name))
-            else:
-                image_path = tmp_folder + '/' + image_name
-                s3_key = o.path.lstrip('/')
-                s3.Bucket(o.netloc).download_file(s3_key, image_path)
-            img = skimage.img_as_float(skimage.io.imread(image_path)).astype(np.float32)
-            img = skimage.transform.resize(img, (IMG_DIM, IMG_DIM))  # H, W, C
-            img = img.swapaxes(1, 2).swapaxes(0, 1)  # C, H, W
-            sampled_frames = np.append(sampled_frames, np.array([img]), axis=0)
+    for s3_path in images[::VISUALIZE_EVERY_X_FRAMES]:
+        o = urlparse(s3_path)
+        image_name = s3_path.split('/')[-1]
+
+        if image_directory is not None and os.path.exists(os.path.join(image_directory, image_name)):
+            image_path = os.path.join(image_directory, image_name)
+            logger.debug("{} already exists".format(image_name))
+        else:
+            image_path = tmp_folder + '/' + image_name
+            s3_key = o.path.lstrip('/')
+            s3.Bucket(o.netloc).download_file(s3_key, image_path)
+        img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image_path.startswith(tmp_folder):
+            # the downloaded copy is no longer needed once it is in the grid
+            os.remove(image_path)
+        yield img
         i += 1
     logger.info("sampled {} frames".format(i))
-    return sampled_frames
 
 
-def generate_preview_image(sampled_frames, preview_name):
-    grid = (torchvision.utils.make_grid(torch.from_numpy(sampled_frames)))
-    torchvision.utils.save_image(grid, preview_name)
+def generate_preview_image(tmp_folder, images, image_directory, preview_name):
+    """
+    :return: paths of the preview images, several of them for long manifests
+    """
+    count = len(images[::VISUALIZE_EVERY_X_FRAMES])
+    return build_previews(sample_frames(tmp_folder, images, image_directory), count, preview_name, IMG_DIM)
 
 
 def create_tmp_dir(tmp_folder):
@@ -102,19 +102,19 @@ def main():
 
     images = get_image_list_from_manifest(manifest_s3_bucket, manifest_s3_key)
 
-    frames = sample_frames(tmp_folder, images, image_directory)
     preview_name = manifest_s3_key.split('/')[-1].split('.')[0] + "_preview.png"
     preview_name = os.path.join(working_directory, preview_name)
     logger.info("saving preview to {} ".format(preview_name))
 
-    generate_preview_image(frames, preview_name)
+    preview_names = generate_preview_image(tmp_folder, images, image_directory, preview_name)
 
     preview_prefix = args["preview_prefix"]
     if not preview_prefix.endswith("/"):
         preview_prefix += "/"
 
-    s3.Bucket(manifest_s3_bucket).upload_file(preview_name, preview_prefix + preview_name)
-    logger.info("uploaded preview image to {}".format(preview_prefix + preview_name))
+    for preview_name in preview_names:
+        s3.Bucket(manifest_s3_bucket).upload_file(preview_name, preview_prefix + preview_name)
+        logger.info("uploaded preview image to {}".format(preview_prefix + preview_name))
     # os.remove(preview_name)
     shutil.rmtree(tmp_folder)
     logger.info("processed {} for {:10.4f} seconds.".format(manifest_s3_key, time.time() - start))
@@ -0,0 +1,146 @@
+import logging
+import math
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMG_DIM = 128  # the width and height of every frame in the preview
+COLUMNS = 8  # frames per row, as torchvision's make_grid
+PADDING = 2  # black pixels around every frame
+MAX_FRAMES_PER_PREVIEW = 512  # longer videos are split into several preview images
+MEMMAP_BYTES = 256 * 1024 * 1024  # grids larger than this are built in a memory-mapped temporary file
+
+
+class PreviewGrid(object):
+    """
+    Grid of thumbnails allocated once for a known number of frames. Every frame is resized with OpenCV straight into
+    its cell, so nothing is copied as the grid fills up.
+    """
+
+    def __init__(self, capacity, img_dim=IMG_DIM, columns=COLUMNS, padding=PADDING, memmap_bytes=MEMMAP_BYTES):
+        """
+        :param capacity: number of frames the grid holds
+        :param memmap_bytes: build the grid in a memory-mapped temporary file when it is larger than this
+        """
+        self.img_dim = img_dim
+        self.padding = padding
+        self.columns = min(columns, capacity)
+        self.rows = int(math.ceil(capacity / float(self.columns)))
+        self.capacity = capacity
+        self.count = 0
+        shape = (self.rows * (img_dim + padding) + padding, self.columns * (img_dim + padding) + padding, 3)
+        self._memmap_file = None
+        if np.prod(shape) > memmap_bytes:
+            self._memmap_file = tempfile.NamedTemporaryFile(suffix='.grid')
+            self.grid = np.memmap(self._memmap_file, dtype=np.uint8, mode='w+', shape=shape)
+        else:
+            self.grid = np.zeros(shape, dtype=np.uint8)
+
+    def add(self, image):
+        """
+        Resize a BGR frame into the next cell of the grid
+        """
+        if self.count >= self.capacity:
+            raise ValueError("the grid is full with {} frames".format(self.capacity))
+        row, column = divmod(self.count, self.columns)
+        top = self.padding + row * (self.img_dim + self.padding)
+        left = self.padding + column * (self.img_dim + self.padding)
+        cell = self.grid[top:top + self.img_dim, left:left + self.img_dim]
+        resized = cv2.resize(image, (self.img_dim, self.img_dim), dst=cell, interpolation=cv2.INTER_AREA)
+        if resized is not cell:
+            cell[...] = resized
+        self.count += 1
+
+    def save(self, path):
+        """
+        Write the rows filled so far as an image
+        """
+        rows = int(math.ceil(self.count / float(self.columns)))
+        height = rows * (self.img_dim + self.padding) + self.padding
+        if not cv2.imwrite(path, self.grid[:height]):
+            raise IOError("could not write preview {}".format(path))
+
+    def close(self):
+        if self._memmap_file is not None:
+            del self.grid
+            self._memmap_file.close()
+            self._memmap_file = None
+
+
+def part_path(preview_path, part):
+    """
+    :return: preview_path with a part number before the extension, e.g. 'video-preview-002.png' for part 2
+    """
+    base, extension = os.path.splitext(preview_path)
+    return '{}-{:03d}{}'.format(base, part, extension)
+
+
+class PreviewWriter(object):
+    """
+    Fills PreviewGrids with frames as they come and saves every grid once it is full, so a long video gives several
+    preview images
+    """
+
+    def __init__(self, preview_path, count, img_dim=IMG_DIM, max_frames_per_preview=MAX_FRAMES_PER_PREVIEW):
+        """
+        :param preview_path: path of the preview image, or the base of the numbered paths of several previews
+        :param count: expected number of frames, to size the grids. More frames get more previews.
+        """
+        self.preview_path = preview_path
+        self.count = count
+        self.img_dim = img_dim
+        self.max_frames_per_preview = max_frames_per_preview
+        self.single = count <= max_frames_per_preview
+        self.paths = []
+        self.added = 0
+        self._grid = None
+
+    def add(self, image):
+        if self._grid is not None and self._grid.count == self._grid.capacity:
+            self._save()
+        if self._grid is None:
+            remaining = self.count - self.added
+            capacity = min(self.max_frames_per_preview, remaining) if remaining > 0 else self.max_frames_per_preview
+            self._grid = PreviewGrid(capacity, self.img_dim)
+        self._grid.add(image)
+        self.added += 1
+
+    def close(self):
+        """
+        :return: paths of the preview images written
+        """
+        if self._grid is not None and self._grid.count:
+            self._save()
+        logger.info("wrote {} preview images".format(len(self.paths)))
+        return self.paths
+
+    def _save(self):
+        if self.single and self.paths:
+            # more frames came than expected, number the first preview as well
+            os.rename(self.preview_path, part_path(self.preview_path, 1))
+            self.paths[0] = part_path(self.preview_path, 1)
+            self.single = False
+        path = self.preview_path if self.single else part_path(self.preview_path, len(self.paths) + 1)
+        self._grid.save(path)
+        self._grid.close()
+        self._grid = None
+        self.paths.append(path)
+
+
+def build_previews(frames, count, preview_path, img_dim=IMG_DIM, max_frames_per_preview=MAX_FRAMES_PER_PREVIEW):
+    """
+    Tile frames into one preview image, or several when there are more than max_frames_per_preview
+    :param frames: iterable of BGR images, e.g. a generator reading them one at a time. None entries are skipped.
+    :param count: number of frames, so the grids can be allocated up front
+    :param preview_path: path of the preview image to write
+    :return: paths of the preview images written
+    """
+    writer = PreviewWriter(preview_path, count, img_dim, max_frames_per_preview)
+    for image in frames:
+        if image is not None:
+            writer.add(image)
+    return writer.close()
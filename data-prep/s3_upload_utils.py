@@ -0,0 +1,266 @@
+import hashlib
+import io
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 16
+REPORT_STATUS = 500  # number of files to report progress
+MULTIPART_THRESHOLD = 8 * 1024 * 1024  # files larger than this are uploaded in parts
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+# S3 error codes worth retrying; anything else, e.g. AccessDenied or NoSuchBucket, fails right away
+RETRYABLE_ERRORS = {'RequestTimeout', 'RequestTimeTooSkewed', 'SlowDown', 'InternalError', 'ServiceUnavailable',
+                    'Throttling', 'ThrottlingException'}
+# upload_file wraps client errors in S3UploadFailedError, which only keeps the error code in its message
+FATAL_ERRORS = ['AccessDenied', 'NoSuchBucket', 'InvalidAccessKeyId', 'SignatureDoesNotMatch', 'InvalidBucketName']
+
+
+def create_s3_client(max_pool_connections=DEFAULT_WORKERS, session=None):
+    """
+    :return: an S3 client whose connection pool is large enough to be shared by max_pool_connections threads
+    """
+    session = session or boto3.session.Session()
+    return session.client('s3', config=Config(max_pool_connections=max_pool_connections))
+
+
+def md5_etag(path=None, data=None):
+    """
+    :return: the ETag S3 gives an object uploaded in a single part, the hex MD5 of the file at path or of data
+    """
+    if data is not None:
+        return hashlib.md5(data).hexdigest()
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return code in RETRYABLE_ERRORS or status >= 500
+    if isinstance(error, S3UploadFailedError):
+        return not any(code in str(error) for code in FATAL_ERRORS)
+    return isinstance(error, BotoCoreError)
+
+
+class S3Uploader(object):
+    """
+    Uploads files to one S3 bucket from a pool of threads sharing a single client. Failed uploads are retried with
+    exponential backoff, and files already in the bucket with the same content are skipped.
+
+    Besides whole batches with upload_files, uploads can be streamed: start(), then submit() every file or in-memory
+    object as it is produced, then finish(). submit() blocks while queue_size uploads are waiting, which holds back
+    the producer when S3 is the slower side.
+    """
+
+    def __init__(self, bucket, client=None, max_workers=DEFAULT_WORKERS, max_attempts=5, backoff_seconds=0.5,
+                 skip_existing=True, multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE,
+                 report_every=REPORT_STATUS, queue_size=None):
+        """
+        :param client: S3 client to use, e.g. one pointing at a local stand-in for S3 in tests. Defaults to
+                       create_s3_client(max_workers).
+        :param max_workers: number of files uploaded at the same time
+        :param max_attempts: number of times a file is tried before giving up on it
+        :param backoff_seconds: wait before the first retry, doubled for every later one
+        :param skip_existing: skip files whose key already exists with the same ETag, or the same size when the
+                              ETag is not a plain MD5 because the object was uploaded in parts
+        :param report_every: log progress and throughput every this many files
+        :param queue_size: number of uploads submitted but not done yet before submit() blocks, 2 * max_workers by
+                           default
+        """
+        self.bucket = bucket
+        self.client = client or create_s3_client(max_workers)
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.skip_existing = skip_existing
+        self.report_every = report_every
+        self.queue_size = queue_size or 2 * max_workers
+        # every file already gets its own thread, so parts of a large file are not uploaded on more threads
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=multipart_chunksize, use_threads=False)
+        self._existing = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._in_flight = None
+        self._reset()
+
+    def _reset(self):
+        self.uploaded = 0
+        self.skipped = 0
+        self.failed = []
+        self.bytes_uploaded = 0
+        self._total = None
+        self._started = time.time()
+
+    def list_existing(self, prefix):
+        """
+        Remember the size and ETag of every object under prefix, to skip files that are already uploaded
+        """
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                self._existing[obj['Key']] = (obj['Size'], obj['ETag'].strip('"'))
+
+    def is_uploaded(self, path, key, data=None):
+        """
+        :param data: content of the object, instead of a file at path
+        """
+        if key not in self._existing:
+            return False
+        size, etag = self._existing[key]
+        if size != (len(data) if data is not None else os.path.getsize(path)):
+            return False
+        return '-' in etag or etag == md5_etag(path, data)
+
+    def upload_file(self, path, key):
+        """
+        Upload one file, retrying with backoff
+        :return: True if the file was uploaded, False if it was skipped
+        """
+        if self.skip_existing and self.is_uploaded(path, key):
+            self._count(skipped=True)
+            return False
+        self._retry(key, lambda: self.client.upload_file(path, self.bucket, key, Config=self.transfer_config))
+        self._count(size=os.path.getsize(path))
+        return True
+
+    def upload_bytes(self, data, key):
+        """
+        Upload an object from memory, retrying with backoff, so nothing has to be written to disk first
+        :return: True if the object was uploaded, False if it was skipped
+        """
+        if self.skip_existing and self.is_uploaded(None, key, data):
+            self._count(skipped=True)
+            return False
+        self._retry(key, lambda: self.client.upload_fileobj(io.BytesIO(data), self.bucket, key,
+                                                            Config=self.transfer_config))
+        self._count(size=len(data))
+        return True
+
+    def _retry(self, key, upload):
+        for attempt in range(self.max_attempts):
+            try:
+                return upload()
+            except Exception as e:
+                if attempt == self.max_attempts - 1 or not is_retryable(e):
+                    raise
+                delay = self.backoff_seconds * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning("upload of {} failed ({}), retrying in {:.2f} seconds".format(key, e, delay))
+                time.sleep(delay)
+
+    def start(self, total=None):
+        """
+        Start the thread pool for submit()
+        :param total: number of files, if known, to report progress against
+        """
+        self._reset()
+        self._total = total
+        self._in_flight = threading.BoundedSemaphore(self.queue_size)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, key, path=None, data=None):
+        """
+        Queue the upload of the file at path, or of data from memory, to key. Blocks while the queue is full.
+        Failures are logged and counted in the summary instead of raised.
+        """
+        self._in_flight.acquire()
+        try:
+            self._pool.submit(self._upload, key, path, data)
+        except Exception:
+            self._in_flight.release()
+            raise
+
+    def _upload(self, key, path, data):
+        try:
+            if data is not None:
+                self.upload_bytes(data, key)
+            else:
+                self.upload_file(path, key)
+        except Exception as e:
+            logger.error("could not upload {} to s3://{}/{}: {}".format(path or 'object', self.bucket, key, e))
+            with self._lock:
+                self.failed.append(path or key)
+        finally:
+            self._in_flight.release()
+
+    def finish(self):
+        """
+        Wait for every submitted upload
+        :return: dict with the number of files uploaded, skipped and failed, the bytes uploaded and the seconds taken
+        """
+        self._pool.shutdown(wait=True)
+        self._pool = None
+        summary = self.summary()
+        logger.info("uploaded {} files ({:.1f} MB) to s3://{} in {:.2f} seconds, {:.1f} files per second. "
+                    "skipped {} already uploaded, {} failed".format(
+                        summary['uploaded'], summary['bytes'] / 1e6, self.bucket, summary['seconds'],
+                        summary['files_per_second'], summary['skipped'], summary['failed']))
+        if self._total is not None and summary['uploaded'] + summary['skipped'] + summary['failed'] != self._total:
+            logger.warning("expected {} files".format(self._total))
+        return summary
+
+    def upload_files(self, files, total=None):
+        """
+        Upload (local path, key) pairs on the thread pool
+        :param total: number of files, to report progress against
+        :return: dict with the number of files uploaded, skipped and failed, the bytes uploaded and the seconds taken
+        """
+        self.start(total)
+        try:
+            for path, key in files:
+                self.submit(key, path=path)
+        finally:
+            summary = self.finish()
+        return summary
+
+    def upload_directory(self, directory, prefix):
+        """
+        Upload every file of directory to prefix/file_name
+        """
+        prefix = prefix.rstrip('/')
+        if self.skip_existing:
+            self.list_existing(prefix + '/')
+        names = sorted(os.listdir(directory))
+        files = ((os.path.join(directory, name), '{}/{}'.format(prefix, name)) for name in names)
+        return self.upload_files(files, len(names))
+
+    def summary(self):
+        with self._lock:
+            seconds = time.time() - self._started
+            return {
+                'uploaded': self.uploaded,
+                'skipped': self.skipped,
+                'failed': len(self.failed),
+                'bytes': self.bytes_uploaded,
+                'seconds': seconds,
+                'files_per_second': (self.uploaded + self.skipped) / seconds if seconds > 0 else 0
+            }
+
+    def _count(self, size=0, skipped=False):
+        with self._lock:
+            if skipped:
+                self.skipped += 1
+            else:
+                self.uploaded += 1
+                self.bytes_uploaded += size
+            done = self.uploaded + self.skipped
+            if done % self.report_every == 0:
+                seconds = time.time() - self._started
+                logger.info("done with {} of {} files ({} skipped). {:.1f} files per second, {:.2f} MB/s".format(
+                    done, self._total if self._total is not None else '?', self.skipped, done / seconds,
+                    self.bytes_uploaded / 1e6 / seconds))
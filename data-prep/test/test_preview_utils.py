@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from preview_utils import PreviewGrid, PreviewWriter, build_previews, part_path
+
+IMG_DIM = 8
+CELL = IMG_DIM + 2  # a frame and the padding before it
+
+
+def frame(i):
+    """
+    :return: a flat frame whose gray level tells its number
+    """
+    return np.full((24, 32, 3), 10 * (i + 1), dtype=np.uint8)
+
+
+def cell_levels(image, count):
+    """
+    :return: the gray level at the center of the first count cells, row by row
+    """
+    columns = (image.shape[1] - 2) // CELL
+    return [int(image[2 + row * CELL + IMG_DIM // 2, 2 + column * CELL + IMG_DIM // 2, 0])
+            for row, column in (divmod(i, columns) for i in range(count))]
+
+
+class TestPreviewGrid(unittest.TestCase):
+
+    def test_layout(self):
+        grid = PreviewGrid(10, img_dim=IMG_DIM)
+        for i in range(10):
+            grid.add(frame(i))
+        self.assertEqual(grid.grid.shape, (2 * CELL + 2, 8 * CELL + 2, 3))
+        self.assertEqual(cell_levels(grid.grid, 10), [10 * (i + 1) for i in range(10)])
+        # padding around the cells stays black
+        self.assertEqual(grid.grid[:2].max(), 0)
+        self.assertEqual(grid.grid[:, CELL:CELL + 2].max(), 0)
+        self.assertRaises(ValueError, grid.add, frame(10))
+        grid.close()
+
+    def test_fewer_frames_than_columns(self):
+        grid = PreviewGrid(3, img_dim=IMG_DIM)
+        self.assertEqual(grid.grid.shape, (CELL + 2, 3 * CELL + 2, 3))
+        grid.close()
+
+    def test_memory_mapped_grid(self):
+        grid = PreviewGrid(4, img_dim=IMG_DIM, memmap_bytes=0)
+        self.assertIsInstance(grid.grid, np.memmap)
+        for i in range(4):
+            grid.add(frame(i))
+        self.assertEqual(cell_levels(grid.grid, 4), [10, 20, 30, 40])
+        grid.close()
+
+    def test_save_writes_the_rows_filled(self):
+        directory = tempfile.mkdtemp()
+        try:
+            grid = PreviewGrid(20, img_dim=IMG_DIM)
+            for i in range(3):
+                grid.add(frame(i))
+            path = os.path.join(directory, 'preview.png')
+            grid.save(path)
+            grid.close()
+            image = cv2.imread(path)
+            self.assertEqual(image.shape, (CELL + 2, 8 * CELL + 2, 3))
+            self.assertEqual(cell_levels(image, 3), [10, 20, 30])
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestPreviewWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.preview_path = os.path.join(self.directory, 'clip-preview.png')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, count, frames, max_frames_per_preview=8):
+        writer = PreviewWriter(self.preview_path, count, IMG_DIM, max_frames_per_preview)
+        for i in range(frames):
+            writer.add(frame(i))
+        return writer.close()
+
+    def test_part_path(self):
+        self.assertEqual(part_path('previews/clip-preview.png', 2), 'previews/clip-preview-002.png')
+
+    def test_single_preview(self):
+        self.assertEqual(self.write(5, 5), [self.preview_path])
+        self.assertEqual(cell_levels(cv2.imread(self.preview_path), 5), [10, 20, 30, 40, 50])
+
+    def test_long_video_is_split(self):
+        paths = self.write(20, 20)
+        self.assertEqual(paths, [part_path(self.preview_path, part) for part in [1, 2, 3]])
+        self.assertFalse(os.path.exists(self.preview_path))
+        images = [cv2.imread(path) for path in paths]
+        self.assertEqual([image.shape[:2] for image in images],
+                         [(CELL + 2, 8 * CELL + 2), (CELL + 2, 8 * CELL + 2), (CELL + 2, 4 * CELL + 2)])
+        self.assertEqual(cell_levels(images[1], 8), [10 * (i + 1) for i in range(8, 16)])
+        self.assertEqual(cell_levels(images[2], 4), [10 * (i + 1) for i in range(16, 20)])
+
+    def test_first_preview_is_renumbered_when_more_frames_come(self):
+        paths = self.write(5, 12)
+        self.assertEqual(paths, [part_path(self.preview_path, 1), part_path(self.preview_path, 2)])
+        self.assertEqual(sorted(os.listdir(self.directory)), ['clip-preview-001.png', 'clip-preview-002.png'])
+        self.assertEqual(cell_levels(cv2.imread(paths[0]), 5), [10, 20, 30, 40, 50])
+        self.assertEqual(cell_levels(cv2.imread(paths[1]), 7), [10 * (i + 1) for i in range(5, 12)])
+
+    def test_build_previews_skips_missing_frames(self):
+        frames = [frame(0), None, frame(2)]
+        self.assertEqual(build_previews(frames, 3, self.preview_path, IMG_DIM), [self.preview_path])
+        image = cv2.imread(self.preview_path)
+        self.assertEqual(image.shape[:2], (CELL + 2, 3 * CELL + 2))
+        self.assertEqual(cell_levels(image, 2), [10, 30])
+
+
+if __name__ == '__main__':
+    unittest.main()
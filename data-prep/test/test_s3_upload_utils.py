@@ -0,0 +1,163 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from s3_upload_utils import S3Uploader, is_retryable
+
+
+def client_error(code, status=400):
+    return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+                       'PutObject')
+
+
+class FakeS3Client(object):
+    """
+    Stands in for an S3 client: keeps uploaded objects in memory and raises the errors queued for a key
+    """
+    def __init__(self):
+        self.objects = {}
+        self.etags = {}
+        self.errors = {}
+        self.attempts = {}
+        self.started = threading.Semaphore(0)
+        self.release = None
+        self._lock = threading.Lock()
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None):
+        self.started.release()
+        if self.release is not None:
+            self.release.wait()
+        with self._lock:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            errors = self.errors.get(key)
+            if errors:
+                raise errors.pop(0)
+            self.objects[key] = fileobj.read()
+
+    def upload_file(self, path, bucket, key, Config=None):
+        with open(path, 'rb') as f:
+            self.upload_fileobj(f, bucket, key, Config)
+
+    def put(self, key, data, etag=None):
+        self.objects[key] = data
+        if etag is not None:
+            self.etags[key] = etag
+
+    def get_paginator(self, name):
+        client = self
+
+        class Paginator(object):
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': key, 'Size': len(data),
+                                     'ETag': '"{}"'.format(client.etags.get(key, hashlib.md5(data).hexdigest()))}
+                                    for key, data in sorted(client.objects.items()) if key.startswith(Prefix)]}
+        return Paginator()
+
+
+class TestIsRetryable(unittest.TestCase):
+
+    def test_throttling_and_server_errors_are_retried(self):
+        self.assertTrue(is_retryable(client_error('SlowDown', 503)))
+        self.assertTrue(is_retryable(client_error('Unknown', 500)))
+        self.assertTrue(is_retryable(BotoCoreError()))
+        self.assertTrue(is_retryable(S3UploadFailedError('Failed to upload: RequestTimeout')))
+
+    def test_permanent_errors_are_not_retried(self):
+        self.assertFalse(is_retryable(client_error('AccessDenied', 403)))
+        self.assertFalse(is_retryable(S3UploadFailedError('Failed to upload: An error occurred (NoSuchBucket)')))
+        self.assertFalse(is_retryable(ValueError('not an S3 error')))
+
+
+class TestS3Uploader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.client = FakeS3Client()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def uploader(self, **kwargs):
+        kwargs.setdefault('backoff_seconds', 0)
+        return S3Uploader('bucket', client=self.client, **kwargs)
+
+    def test_transient_errors_are_retried(self):
+        path = self.write('frame.jpg', b'frame')
+        self.client.errors['frames/frame.jpg'] = [client_error('SlowDown', 503), BotoCoreError()]
+        self.assertTrue(self.uploader().upload_file(path, 'frames/frame.jpg'))
+        self.assertEqual(self.client.attempts['frames/frame.jpg'], 3)
+        self.assertEqual(self.client.objects['frames/frame.jpg'], b'frame')
+
+    def test_permanent_errors_are_raised_right_away(self):
+        path = self.write('frame.jpg', b'frame')
+        self.client.errors['frames/frame.jpg'] = [client_error('AccessDenied', 403)]
+        self.assertRaises(ClientError, self.uploader().upload_file, path, 'frames/frame.jpg')
+        self.assertEqual(self.client.attempts['frames/frame.jpg'], 1)
+
+    def test_gives_up_after_max_attempts(self):
+        self.client.errors['frames/frame.jpg'] = [client_error('SlowDown', 503) for _ in range(5)]
+        self.assertRaises(ClientError, self.uploader(max_attempts=3).upload_bytes, b'frame', 'frames/frame.jpg')
+        self.assertEqual(self.client.attempts['frames/frame.jpg'], 3)
+
+    def test_objects_with_the_same_content_are_skipped(self):
+        for name in ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']:
+            self.write(name, b'content of ' + name.encode('ascii'))
+        self.client.put('frames/a.jpg', b'content of a.jpg')
+        # Same size, different content
+        self.client.put('frames/b.jpg', b'content of x.jpg')
+        # Uploaded in parts, so only the size can be compared
+        self.client.put('frames/c.jpg', b'content of c.jpg', etag='0123456789abcdef-2')
+
+        summary = self.uploader(max_workers=2).upload_directory(self.directory, 'frames/')
+        self.assertEqual((summary['uploaded'], summary['skipped'], summary['failed']), (2, 2, 0))
+        self.assertEqual(sorted(self.client.attempts), ['frames/b.jpg', 'frames/d.jpg'])
+        self.assertEqual(self.client.objects['frames/b.jpg'], b'content of b.jpg')
+
+    def test_failures_are_counted_not_raised(self):
+        for name in ['a.jpg', 'b.jpg']:
+            self.write(name, b'frame')
+        self.client.errors['frames/b.jpg'] = [client_error('AccessDenied', 403)]
+        uploader = self.uploader(skip_existing=False)
+        summary = uploader.upload_directory(self.directory, 'frames')
+        self.assertEqual((summary['uploaded'], summary['failed']), (1, 1))
+        self.assertEqual(uploader.failed, [os.path.join(self.directory, 'b.jpg')])
+
+    def test_submit_blocks_while_the_queue_is_full(self):
+        self.client.release = threading.Event()
+        uploader = self.uploader(max_workers=1, queue_size=2)
+        uploader.start()
+        submitted = []
+
+        def submit():
+            for i in range(3):
+                uploader.submit('frames/{}.jpg'.format(i), data=b'frame')
+                submitted.append(i)
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        self.assertTrue(self.client.started.acquire(timeout=5))
+        thread.join(0.2)
+        self.assertEqual(submitted, [0, 1], 'the third upload should wait for room in the queue')
+
+        self.client.release.set()
+        thread.join(5)
+        summary = uploader.finish()
+        self.assertEqual(submitted, [0, 1, 2])
+        self.assertEqual(summary['uploaded'], 3)
+        self.assertEqual(sorted(self.client.objects), ['frames/0.jpg', 'frames/1.jpg', 'frames/2.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
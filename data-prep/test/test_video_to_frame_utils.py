@@ -0,0 +1,288 @@
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from s3_upload_utils import S3Uploader
+from .test_s3_upload_utils import FakeS3Client, client_error
+
+# The script name starts with a digit, so it can only be imported by name
+video_to_frame_utils = importlib.import_module('01_video_to_frame_utils')
+generate_gt_manifest = importlib.import_module('02_generate_gt_manifest')
+
+FRAME_COUNT = 40
+
+
+def write_video(path, frame_count=FRAME_COUNT, size=(64, 48)):
+    """
+    Write a small MJPG video whose frame i is a flat gray image of level 5 * i, so a decoded frame tells its index
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, size)
+    for i in range(frame_count):
+        writer.write(np.full((size[1], size[0], 3), 5 * i, dtype=np.uint8))
+    writer.release()
+
+
+S3Object = namedtuple('S3Object', ['bucket_name', 'key'])
+
+
+class FakeS3Resource(object):
+    """
+    Stands in for the S3 resource 02_generate_gt_manifest.py lists the frames with
+    """
+    def __init__(self, keys):
+        self.keys = keys
+
+    def Bucket(self, name):
+        resource = self
+
+        class Objects(object):
+            def filter(self, Prefix):
+                return [S3Object(name, key) for key in sorted(resource.keys) if key.startswith(Prefix)]
+
+        class Bucket(object):
+            objects = Objects()
+        return Bucket()
+
+
+def level(image):
+    return int(round(image.mean() / 5.0))
+
+
+class VideoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'clip.avi')
+        write_video(self.video)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class TestFrameReader(VideoTestCase):
+
+    def read(self, *args, **kwargs):
+        reader = video_to_frame_utils.FrameReader(self.video, *args, **kwargs)
+        frames = [(index, level(image)) for index, image in reader]
+        return frames, reader.read
+
+    def test_reads_the_frames_of_its_range(self):
+        frames, read = self.read(10, 20)
+        self.assertEqual(frames, [(i, i) for i in range(10, 20)], 'should seek to the first frame of the range')
+        self.assertEqual(read, 10)
+
+    def test_last_range_reads_until_the_end(self):
+        frames, read = self.read(35, None)
+        self.assertEqual(frames, [(i, i) for i in range(35, FRAME_COUNT)])
+        self.assertEqual(read, 5)
+
+    def test_range_past_the_end_reads_nothing(self):
+        self.assertEqual(self.read(FRAME_COUNT, FRAME_COUNT + 10), ([], 0))
+
+    def test_sampling_keeps_the_same_frames_across_ranges(self):
+        whole, _ = self.read(0, None, sampling_rate=4)
+        self.assertEqual([index for index, _ in whole], list(range(0, FRAME_COUNT, 4)))
+        # Ranges that do not start on a multiple of the sampling rate still sample frames 0, 4, 8...
+        chunks = []
+        for first, last in [(0, 13), (13, 27), (27, None)]:
+            chunks += self.read(first, last, sampling_rate=4)[0]
+        self.assertEqual(chunks, whole)
+
+    def test_scene_change_threshold_skips_similar_frames(self):
+        frames, read = self.read(0, 10, scene_change_threshold=0.05)
+        # Frames step by 5 gray levels, about 0.02 of the range, so every third frame is far enough from the last kept
+        self.assertEqual([index for index, _ in frames], [0, 3, 6, 9])
+        self.assertEqual(read, 10)
+
+
+class TestVideoToFrames(VideoTestCase):
+
+    def extract(self, name, **kwargs):
+        output_dir = os.path.join(self.directory, name)
+        os.mkdir(output_dir)
+        frame_dir = video_to_frame_utils.video_to_frames(self.video, output_dir, **kwargs)
+        frames = {}
+        for frame in sorted(os.listdir(frame_dir)):
+            with open(os.path.join(frame_dir, frame), 'rb') as f:
+                frames[frame] = f.read()
+        return frames
+
+    def test_extract_frame_range_counts(self):
+        frame_dir = os.path.join(self.directory, 'frames')
+        os.mkdir(frame_dir)
+        read, written = video_to_frame_utils.extract_frame_range(self.video, frame_dir, 'clip', 5, 15, 2,
+                                                                 sampling_rate=3)
+        self.assertEqual((read, written), (10, 3))
+        self.assertEqual(sorted(os.listdir(frame_dir)), ['clip_000006.jpg', 'clip_000009.jpg', 'clip_000012.jpg'])
+
+    def test_workers_write_the_same_frames(self):
+        single = self.extract('single', workers=1, sampling_rate=3)
+        parallel = self.extract('parallel', workers=3, sampling_rate=3)
+        self.assertEqual(sorted(single), [video_to_frame_utils.frame_name('clip', i) for i in range(0, FRAME_COUNT, 3)])
+        self.assertEqual(sorted(parallel), sorted(single))
+        for name in single:
+            self.assertEqual(parallel[name], single[name], '{} should be the same with 3 workers'.format(name))
+
+
+class RecordingPreview(object):
+
+    def __init__(self):
+        self.levels = []
+
+    def add(self, image):
+        self.levels.append(level(image))
+
+
+class TestStreamFrames(VideoTestCase):
+
+    def setUp(self):
+        super(TestStreamFrames, self).setUp()
+        self.client = FakeS3Client()
+        self.uploader = S3Uploader('bucket', client=self.client, max_workers=2, backoff_seconds=0)
+
+    def test_uploads_every_sampled_frame(self):
+        frame_names, summary = video_to_frame_utils.stream_frames(self.video, self.uploader, 'frames/clip',
+                                                                  writer_threads=2, sampling_rate=4)
+        expected = [video_to_frame_utils.frame_name('clip', i) for i in range(0, FRAME_COUNT, 4)]
+        self.assertEqual(frame_names, expected)
+        self.assertEqual(sorted(self.client.objects), ['frames/clip/{}'.format(name) for name in expected])
+        self.assertEqual((summary['uploaded'], summary['failed']), (len(expected), 0))
+        data = self.client.objects['frames/clip/clip_000012.jpg']
+        self.assertEqual(level(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)), 12)
+
+    def test_local_copy_is_what_was_uploaded(self):
+        frame_dir = os.path.join(self.directory, 'clip')
+        os.mkdir(frame_dir)
+        frame_names, _ = video_to_frame_utils.stream_frames(self.video, self.uploader, 'frames/clip', frame_dir,
+                                                            sampling_rate=10)
+        self.assertEqual(sorted(os.listdir(frame_dir)), frame_names)
+        for name in frame_names:
+            with open(os.path.join(frame_dir, name), 'rb') as f:
+                self.assertEqual(f.read(), self.client.objects['frames/clip/{}'.format(name)])
+
+    def test_preview_gets_the_first_frame_of_every_interval(self):
+        preview = RecordingPreview()
+        video_to_frame_utils.stream_frames(self.video, self.uploader, 'frames/clip', sampling_rate=3, preview=preview,
+                                           visualize_every_x_frames=10)
+        self.assertEqual(preview.levels, [0, 12, 21, 30])
+
+    def test_failed_uploads_are_counted(self):
+        self.client.errors['frames/clip/clip_000020.jpg'] = [client_error('AccessDenied', 403)]
+        frame_names, summary = video_to_frame_utils.stream_frames(self.video, self.uploader, 'frames/clip',
+                                                                  sampling_rate=10)
+        self.assertEqual(len(frame_names), 4)
+        self.assertEqual((summary['uploaded'], summary['failed']), (3, 1))
+
+
+class FakeBucketResource(object):
+    """
+    Stands in for the S3 resource the previews are uploaded with
+    """
+    def __init__(self):
+        self.uploaded = {}
+
+    def Bucket(self, name):
+        uploaded = self.uploaded
+
+        class Bucket(object):
+            def upload_file(self, path, key):
+                uploaded[key] = os.path.getsize(path)
+        return Bucket()
+
+
+class TestStreamVideo(VideoTestCase):
+
+    def setUp(self):
+        super(TestStreamVideo, self).setUp()
+        self.client = FakeS3Client()
+        self.resource = FakeBucketResource()
+        self.create_s3_client, self.s3 = video_to_frame_utils.create_s3_client, video_to_frame_utils.s3
+        video_to_frame_utils.create_s3_client = lambda *args: self.client
+        video_to_frame_utils.s3 = self.resource
+        # the video is named relative to the working directory, as process_video downloads it
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.working_dir = os.path.join(self.directory, 'work')
+        os.mkdir(self.working_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        video_to_frame_utils.create_s3_client, video_to_frame_utils.s3 = self.create_s3_client, self.s3
+        super(TestStreamVideo, self).tearDown()
+
+    def stream(self, **kwargs):
+        video_to_frame_utils.stream_video('clip.avi', 10, 'bucket', self.working_dir, 'frames/', True, 1,
+                                          'previews/video/', True, writer_threads=2, sampling_rate=5, **kwargs)
+
+    def test_frames_and_preview_are_uploaded(self):
+        self.stream(manifest=True)
+        expected = ['frames/clip/{}'.format(video_to_frame_utils.frame_name('clip', i))
+                    for i in range(0, FRAME_COUNT, 5)]
+        self.assertEqual(sorted(self.client.objects), expected)
+        self.assertEqual(list(self.resource.uploaded), ['previews/video/clip-preview.png'])
+        with open(os.path.join(self.working_dir, 'clip_sampling_every_5_ground_truth_manifest.json')) as f:
+            self.assertEqual(len(f.read().splitlines()), len(expected))
+        self.assertFalse(os.path.exists(os.path.join(self.working_dir, 'clip')), 'no local copy was asked for')
+        self.assertFalse(os.path.exists(self.video), 'the downloaded video should be cleaned up')
+
+    def test_keep_frames_survives_clean_up(self):
+        self.stream(keep_frames=True)
+        frame_dir = os.path.join(self.working_dir, 'clip')
+        self.assertEqual(['frames/clip/{}'.format(name) for name in sorted(os.listdir(frame_dir))],
+                         sorted(self.client.objects))
+        self.assertFalse(os.path.exists(self.video))
+
+
+class TestWriteManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.frame_dir = os.path.join(self.directory, 'clip')
+        os.mkdir(self.frame_dir)
+        self.frames = [video_to_frame_utils.frame_name('clip', i) for i in [0, 30, 60]]
+        for frame in self.frames:
+            open(os.path.join(self.frame_dir, frame), 'wb').close()
+        self.working_dir = os.path.join(self.directory, 'manifests')
+        os.mkdir(self.working_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_same_manifest_as_listing_the_uploaded_frames(self):
+        path = video_to_frame_utils.write_manifest(self.frame_dir, 'bucket', 'frames/', 1, self.working_dir)
+
+        # what 02_generate_gt_manifest.py writes once the frames are uploaded under frames/clip/
+        uploaded = ['frames/clip/{}'.format(frame) for frame in self.frames] + ['frames/clip-other/a.jpg']
+        s3 = generate_gt_manifest.s3
+        generate_gt_manifest.s3 = FakeS3Resource(uploaded)
+        try:
+            expected_path = generate_gt_manifest.generate_ground_truth_manifest('bucket', 'frames/clip/', 1,
+                                                                                self.directory)
+        finally:
+            generate_gt_manifest.s3 = s3
+
+        self.assertEqual(os.path.basename(path), os.path.basename(expected_path))
+        self.assertEqual(self.read(path), self.read(expected_path))
+        self.assertEqual(self.read(path).splitlines()[0], '{"source-ref": "s3://bucket/frames/clip/clip_000000.jpg"}')
+
+    def test_named_after_the_sampling_rate_with_the_frames_given(self):
+        # frame_names are the frames already sampled while streaming, in the order they were extracted
+        path = video_to_frame_utils.write_manifest(self.frame_dir, 'bucket', 'videos/frames/', 30, self.working_dir,
+                                                   list(reversed(self.frames)))
+        self.assertEqual(os.path.basename(path), 'clip_sampling_every_30_ground_truth_manifest.json')
+        expected = ['{{"source-ref": "s3://bucket/videos/frames/clip/{}"}}'.format(frame) for frame in self.frames]
+        self.assertEqual(self.read(path).splitlines(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Benchmarks import the lambda modules the same way the deployment package does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
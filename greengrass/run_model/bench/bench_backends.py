@@ -0,0 +1,90 @@
+"""
+Benchmark of the inference backends on the same hardware. Loads the checkpoint on every available backend and
+reports its throughput at each batch size, the resident memory it added to the process and the largest difference
+between its raw output and the Module backend's on the sample images. Backends whose dependencies are missing, or
+whose model cannot be exported, are reported and skipped.
+
+Run from greengrass/run_model:
+
+    python -m bench.bench_backends --batch_sizes 1,4 --iterations 20
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from backends import BACKENDS
+from bench.bench_quantization import resident_bytes
+from model_loader import MLModel
+from quantization import list_images
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-m", "--model", required=False, default='./resources/ml/od/deploy_model_algo_1',
+                help="checkpoint prefix")
+ap.add_argument("-d", "--images", required=False, default='./resources/img', help="directory of sample images")
+ap.add_argument("-k", "--backends", required=False, default='module,gluon,onnx',
+                help="comma separated backends to compare")
+ap.add_argument("-b", "--batch_sizes", required=False, default='1,4', help="comma separated batch sizes")
+ap.add_argument("-n", "--iterations", type=int, required=False, default=20, help="forward passes per batch size")
+
+
+def raw_output(model, images):
+    host = model.get_input_buffer(len(images), model.resolution)
+    for i, img in enumerate(images):
+        host.fill(i, img)
+    return model.backend.fetch(model.backend.forward(host.data))
+
+
+def throughput(model, images, batch_size, iterations):
+    host = model.get_input_buffer(batch_size, model.resolution)
+    for i in range(batch_size):
+        host.fill(i, images[i % len(images)])
+    model.backend.fetch(model.backend.forward(host.data))
+    start = time.time()
+    for _ in range(iterations):
+        model.backend.fetch(model.backend.forward(host.data))
+    return batch_size * iterations / (time.time() - start)
+
+
+def main():
+    args = vars(ap.parse_args())
+    names = args['backends'].split(',')
+    batch_sizes = [int(size) for size in args['batch_sizes'].split(',')]
+    images = [cv2.imread(filepath) for filepath in list_images(args['images'])]
+
+    reference_model = MLModel(args['model'], batch_sizes=[len(images)])
+    try:
+        reference = raw_output(reference_model, images)
+    finally:
+        reference_model.close()
+    print('{} sample images, {} forward passes per batch size'.format(len(images), args['iterations']))
+    print('{:<8} {:>6} {:>12} {:>16} {:>16}'.format('backend', 'batch', 'images/s', 'resident bytes',
+                                                    'max abs diff'))
+    for name in names:
+        if name not in BACKENDS:
+            print('{:<8} unknown backend'.format(name))
+            continue
+        before = resident_bytes()
+        try:
+            model = MLModel(args['model'], batch_sizes=batch_sizes + [len(images)], backend=name)
+        except Exception as e:
+            print('{:<8} skipped: {}'.format(name, e))
+            continue
+        try:
+            try:
+                diff = np.abs(raw_output(model, images) - reference).max()
+            except Exception as e:
+                print('{:<8} skipped: {}'.format(name, e))
+                continue
+            for batch_size in batch_sizes:
+                images_per_second = throughput(model, images, batch_size, args['iterations'])
+                print('{:<8} {:>6} {:>12.2f} {:>16,} {:>16.3g}'.format(name, batch_size, images_per_second,
+                                                                     resident_bytes() - before, diff))
+        finally:
+            # Frees the backend's resources, e.g. the models the onnx backend exported to a temporary directory
+            model.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark of the binary result encoding against JSON. Encodes responses with a growing number of detections
+and reports the encode time and payload size of each format.
+
+Run from greengrass/run_model:
+
+    python -m bench.bench_encoding --iterations 1000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from encoding import decode_response, encode_response
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-n", "--iterations", type=int, required=False, default=1000, help="encodes to time per response")
+ap.add_argument("-d", "--detections", required=False, default='1,10,100',
+                help="comma separated numbers of detections per response")
+
+
+def sample_response(num_detections):
+    rng = np.random.RandomState(0)
+    boxes = np.sort(rng.rand(num_detections, 4), axis=1)
+    prediction = np.column_stack([rng.randint(0, 2, num_detections), rng.rand(num_detections), boxes])
+    return {
+        'prediction': prediction.astype(np.float32).tolist(),
+        'timestamp': time.time(),
+        'filepath': '/tmp/frames/frame_000133.jpg',
+        'model_version': '1569500000-24012345'
+    }
+
+
+def measure(encode, response, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        payload = encode(response)
+    return 1e6 * (time.time() - start) / iterations, len(payload)
+
+
+def main():
+    args = vars(ap.parse_args())
+    print('{:>10} {:<7} {:>14} {:>14}'.format('detections', 'format', 'encode us', 'payload bytes'))
+    for num_detections in [int(n) for n in args['detections'].split(',')]:
+        response = sample_response(num_detections)
+        for name, encode in [('json', json.dumps), ('binary', encode_response)]:
+            micros, size = measure(encode, response, args['iterations'])
+            print('{:>10} {:<7} {:>14.1f} {:>14,}'.format(num_detections, name, micros, size))
+        decoded = decode_response(encode_response(response))
+        error = np.abs(np.array(decoded['prediction']) - np.array(response['prediction'])).max()
+        print('{:>10} max absolute error of the binary round trip: {:.2g}'.format('', error))
+
+
+if __name__ == "__main__":
+    main()
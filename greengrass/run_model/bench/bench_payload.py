@@ -0,0 +1,88 @@
+"""
+Micro-benchmark for getting an image from an event into a decoded array. Compares the producer writing the frame to
+disk and the lambda checking and reading the file, with the frame sent base64 encoded in the event and with the raw
+encoded bytes handed over as a memoryview.
+
+Run from greengrass/run_model:
+
+    python -m bench.bench_payload --iterations 200
+"""
+import argparse
+import base64
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-i", "--image", required=False, default='./resources/img/blue_box_1_000133.jpg',
+                help="encoded image to hand over")
+ap.add_argument("-n", "--iterations", type=int, required=False, default=100, help="number of frames to time")
+
+
+def decode(data):
+    # Same decoding as model_loader.decode_image, without importing mxnet
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def file_round_trip(data, directory):
+    filepath = os.path.join(directory, 'frame.jpg')
+
+    def handle():
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        if not os.path.exists(filepath):
+            raise IOError(filepath)
+        return cv2.imread(filepath)
+    return handle
+
+
+def base64_payload(data):
+    event = {'image': base64.b64encode(data).decode('ascii')}
+
+    def handle():
+        return decode(base64.b64decode(event['image']))
+    return handle
+
+
+def raw_payload(data):
+    def handle():
+        return decode(memoryview(data))
+    return handle
+
+
+def measure(handle, iterations):
+    handle()
+    latencies = []
+    for _ in range(iterations):
+        start = time.time()
+        img = handle()
+        latencies.append(time.time() - start)
+        if img is None:
+            raise ValueError('could not decode image')
+    return 1000 * np.mean(latencies), 1000 * np.percentile(latencies, 95)
+
+
+def main():
+    args = vars(ap.parse_args())
+    with open(args['image'], 'rb') as f:
+        data = f.read()
+
+    print('{} frames of {} encoded bytes'.format(args['iterations'], len(data)))
+    print('{:<10} {:>14} {:>14}'.format('payload', 'mean ms/frame', 'p95 ms/frame'))
+    directory = tempfile.mkdtemp()
+    try:
+        for name, handle in [('file', file_round_trip(data, directory)), ('base64', base64_payload(data)),
+                             ('raw', raw_payload(data))]:
+            mean_ms, p95_ms = measure(handle, args['iterations'])
+            print('{:<10} {:>14.3f} {:>14.3f}'.format(name, mean_ms, p95_ms))
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Micro-benchmark for the MLModel input preprocessing. Compares the original per-request preprocessing with the
+preallocated InputBuffer and reports latency and peak bytes allocated per frame. The MXNet hand-off is included
+when mxnet is installed.
+
+Run from greengrass/run_model:
+
+    python -m bench.bench_preprocess --iterations 200
+"""
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from preprocess import InputBuffer
+
+try:
+    import mxnet as mx
+except ImportError:
+    mx = None
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-i", "--image", required=False, default='./resources/img/blue_box_1_000133.jpg',
+                help="image to preprocess")
+ap.add_argument("-n", "--iterations", type=int, required=False, default=100, help="number of frames to time")
+ap.add_argument("-s", "--input_shape", type=int, required=False, default=512, help="network input width and height")
+
+
+def original_preprocess(img, reshape):
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = cv2.resize(img, reshape)
+    img = np.swapaxes(img, 0, 2)
+    img = np.swapaxes(img, 1, 2)
+    img = img[np.newaxis, :]
+    if mx is not None:
+        return mx.nd.array(img)
+    return img.astype(np.float32)
+
+
+def buffered_preprocess(input_shape):
+    host = InputBuffer(1, input_shape, input_shape)
+    device = mx.nd.zeros(host.data.shape) if mx is not None else None
+
+    def preprocess(img, reshape):
+        host.fill(0, img)
+        if device is not None:
+            device[:] = host.data
+            return device
+        return host.data
+    return preprocess
+
+
+def measure(preprocess, img, reshape, iterations):
+    # Warm up once so one-off allocations of the buffered path are not attributed to every frame
+    preprocess(img, reshape)
+    latencies = []
+    allocated = []
+    tracemalloc.start()
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.time()
+        out = preprocess(img, reshape)
+        if mx is not None:
+            out.wait_to_read()
+        latencies.append(time.time() - start)
+        allocated.append(tracemalloc.get_traced_memory()[1] - baseline)
+        del out
+    tracemalloc.stop()
+    return 1000 * np.mean(latencies), 1000 * np.percentile(latencies, 95), np.mean(allocated)
+
+
+def main():
+    args = vars(ap.parse_args())
+    img = cv2.imread(args['image'])
+    if img is None:
+        ap.error('could not read image {}'.format(args['image']))
+    input_shape = args['input_shape']
+    reshape = (input_shape, input_shape)
+
+    print('{} frames of {}x{} resized to {}x{} (mxnet hand-off {})'.format(
+        args['iterations'], img.shape[1], img.shape[0], input_shape, input_shape,
+        'included' if mx is not None else 'skipped, mxnet not installed'))
+    print('{:<10} {:>14} {:>14} {:>22}'.format('pipeline', 'mean ms/frame', 'p95 ms/frame', 'peak bytes alloc/frame'))
+    for name, preprocess in [('original', original_preprocess), ('buffered', buffered_preprocess(input_shape))]:
+        mean_ms, p95_ms, allocated = measure(preprocess, img, reshape, args['iterations'])
+        print('{:<10} {:>14.3f} {:>14.3f} {:>22,.0f}'.format(name, mean_ms, p95_ms, allocated))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark for the INT8 inference mode. Loads the fp32 checkpoint and its INT8 version calibrated on the sample
+images, then reports the latency per image, the size of the parameters, the resident memory each model added to
+the process and the accuracy drift of the INT8 model against the fp32 one.
+
+Run from greengrass/run_model:
+
+    python -m bench.bench_quantization --iterations 20
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from model_loader import MLModel, load_checkpoint, shared_checkpoints
+from quantization import Int8Quantizer, accuracy_drift, list_images, params_bytes
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-m", "--model", required=False, default='./resources/ml/od/deploy_model_algo_1',
+                help="checkpoint prefix")
+ap.add_argument("-d", "--images", required=False, default='./resources/img',
+                help="directory of sample images, used both to calibrate and to measure drift")
+ap.add_argument("-c", "--calib_images", type=int, required=False, default=10, help="number of calibration images")
+ap.add_argument("--calib_mode", required=False, default='naive', help="naive, entropy or none")
+ap.add_argument("-n", "--iterations", type=int, required=False, default=10, help="passes over the sample images")
+
+
+def resident_bytes():
+    """
+    :return: the resident set size of this process, read from /proc on Linux
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(model, filepaths, iterations):
+    model.predict_from_file(filepaths[0])
+    latencies = []
+    for _ in range(iterations):
+        for filepath in filepaths:
+            start = time.time()
+            model.predict_from_file(filepath)
+            latencies.append(time.time() - start)
+    return 1000 * np.mean(latencies), 1000 * np.percentile(latencies, 95)
+
+
+def main():
+    args = vars(ap.parse_args())
+    filepaths = list_images(args['images'])
+    quantizer = Int8Quantizer(args['images'] if args['calib_mode'] != 'none' else None,
+                              num_calib_images=args['calib_images'], calib_mode=args['calib_mode'])
+    # Both models and the parameter sizes below use the same parsed checkpoint, so asking the quantizer for the
+    # INT8 parameters again returns the ones it calibrated for the model instead of calibrating a second time
+    with shared_checkpoints():
+        before = resident_bytes()
+        fp32 = MLModel(args['model'], batch_sizes=[1])
+        fp32_resident = resident_bytes() - before
+
+        before = resident_bytes()
+        int8 = MLModel(args['model'], batch_sizes=[1], quantizer=quantizer)
+        int8_resident = resident_bytes() - before
+
+        sym, arg_params, aux_params = load_checkpoint(args['model'])
+        _, int8_args, int8_aux = quantizer(sym, arg_params, aux_params, int8.data_name, int8.input_shape)
+
+    print('{} sample images, {} passes'.format(len(filepaths), args['iterations']))
+    print('{:<6} {:>14} {:>14} {:>14} {:>16}'.format('model', 'mean ms/image', 'p95 ms/image', 'param bytes',
+                                                     'resident bytes'))
+    rows = [('fp32', fp32, params_bytes(arg_params, aux_params), fp32_resident),
+            ('int8', int8, params_bytes(int8_args, int8_aux), int8_resident)]
+    for name, model, param_size, resident in rows:
+        mean_ms, p95_ms = measure(model, filepaths, args['iterations'])
+        print('{:<6} {:>14.3f} {:>14.3f} {:>14,} {:>16,}'.format(name, mean_ms, p95_ms, param_size, resident))
+
+    drift = accuracy_drift(fp32, int8, filepaths)
+    print('Accuracy drift of int8 against fp32:')
+    print(json.dumps(dict((k, v) for k, v in drift.items() if k != 'images'), indent=2))
+    for image in drift['images']:
+        if not image['agree']:
+            print('disagree: {}'.format(json.dumps(image)))
+
+
+if __name__ == "__main__":
+    main()
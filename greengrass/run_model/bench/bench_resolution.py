@@ -0,0 +1,62 @@
+"""
+Benchmark of latency against input resolution. Runs the sample images through the model at every resolution, with
+images stretched or letterboxed to the input size, and reports the latency per image along with the top detection
+so the accuracy cost of a lower resolution can be judged on the same table.
+
+Run from greengrass/run_model:
+
+    python -m bench.bench_resolution --resolutions 300,384,512 --iterations 10
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from model_loader import MLModel
+from quantization import list_images
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-m", "--model", required=False, default='./resources/ml/od/deploy_model_algo_1',
+                help="checkpoint prefix")
+ap.add_argument("-d", "--images", required=False, default='./resources/img', help="directory of sample images")
+ap.add_argument("-r", "--resolutions", required=False, default='300,384,512',
+                help="comma separated square input sizes")
+ap.add_argument("-b", "--batch_size", type=int, required=False, default=1, help="images per forward pass")
+ap.add_argument("-n", "--iterations", type=int, required=False, default=10, help="passes over the sample images")
+
+
+def measure(model, images, resolution, batch_size, iterations):
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    model.predict_batch(batches[0], resolution)
+    latencies = []
+    for _ in range(iterations):
+        for batch in batches:
+            start = time.time()
+            model.predict_batch(batch, resolution)
+            latencies.append((time.time() - start) / len(batch))
+    return 1000 * np.mean(latencies), 1000 * np.percentile(latencies, 95)
+
+
+def main():
+    args = vars(ap.parse_args())
+    resolutions = [int(size) for size in args['resolutions'].split(',')]
+    filepaths = list_images(args['images'])
+    images = [cv2.imread(filepath) for filepath in filepaths]
+
+    print('{} sample images, batch size {}, {} passes'.format(len(images), args['batch_size'], args['iterations']))
+    print('{:<10} {:>10} {:>14} {:>14}  {}'.format('resize', 'resolution', 'mean ms/image', 'p95 ms/image',
+                                                   'top detection of the first image'))
+    for letterbox in [False, True]:
+        model = MLModel(args['model'], input_shapes=[('data', (1, 3, max(resolutions), max(resolutions)))],
+                        resolutions=resolutions, batch_sizes=[args['batch_size']], letterbox=letterbox)
+        for resolution in resolutions:
+            mean_ms, p95_ms = measure(model, images, resolution, args['batch_size'], args['iterations'])
+            top = model.predict_batch(images[:1], resolution)[0]
+            print('{:<10} {:>10} {:>14.3f} {:>14.3f}  {}'.format(
+                'letterbox' if letterbox else 'stretch', resolution, mean_ms, p95_ms,
+                ' '.join('{:.3f}'.format(value) for value in top[0]) if top else 'none'))
+
+
+if __name__ == "__main__":
+    main()
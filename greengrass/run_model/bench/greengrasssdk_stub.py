@@ -0,0 +1,45 @@
+"""
+Local stand-in for the greengrasssdk package, so the lambda can run off a Greengrass core. install() must be called
+before main is imported.
+"""
+import sys
+import threading
+import time
+import types
+
+
+class StubClient(object):
+    """
+    iot-data client that keeps what is published instead of sending it to the core
+    """
+    def __init__(self, on_publish=None, keep=False):
+        """
+        :param on_publish: function called with (topic, payload, publish time) for every message
+        :param keep: also keep the messages in self.messages, as (topic, payload) pairs
+        """
+        self.on_publish = on_publish
+        self.keep = keep
+        self.messages = []
+        self.published = 0
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, **kwargs):
+        now = time.time()
+        with self._lock:
+            self.published += 1
+            if self.keep:
+                self.messages.append((topic, payload))
+        if self.on_publish is not None:
+            self.on_publish(topic, payload, now)
+
+
+def install(on_publish=None, keep=False):
+    """
+    Register a stub greengrasssdk module whose clients all are the same StubClient
+    :return: the StubClient
+    """
+    stub = StubClient(on_publish, keep)
+    module = types.ModuleType('greengrasssdk')
+    module.client = lambda name, *args, **kwargs: stub
+    sys.modules['greengrasssdk'] = module
+    return stub
@@ -0,0 +1,326 @@
+"""
+Load test of the inference lambda. Runs main.lambda_handler off the core, with greengrasssdk replaced by a local stub,
+and replays a directory of frames as blog/infer/input events at a fixed rate from several threads. Every interval it
+prints the throughput, the latency percentiles of the results published in that interval, the CPU used by the
+process and its resident memory, and at the end a summary of the whole run.
+
+Events are sent open loop: each one is due at a fixed time and its latency is counted from that time, so a lambda
+that falls behind shows it in the latency instead of slowing the load down. --rate 0 sends closed loop instead, each
+thread sending its next event as soon as lambda_handler returns. Lambda settings are passed as environment
+variables with --env.
+
+Run from greengrass/run_model:
+
+    python -m bench.run_load --rate 20 --concurrency 4 --duration 60 --env INFERENCE_MODE=batch
+
+Save the summary of a known good run with --save and check later runs against it with --baseline. The run then exits
+with status 1 when the throughput dropped or the p99 latency grew by more than --tolerance.
+"""
+import argparse
+import base64
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from bench import greengrasssdk_stub
+from bench.bench_quantization import resident_bytes
+from encoding import decode_responses
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-m", "--model", required=False, default='./resources/ml/od/deploy_model_algo_1',
+                help="checkpoint prefix")
+ap.add_argument("-d", "--frames", required=False, default='./resources/img', help="directory of frames to replay")
+ap.add_argument("-r", "--rate", type=float, required=False, default=10,
+                help="events per second over all threads. 0 sends the next event as soon as the previous returned")
+ap.add_argument("-c", "--concurrency", type=int, required=False, default=1, help="threads invoking the lambda")
+ap.add_argument("-t", "--duration", type=float, required=False, default=60, help="seconds to send events for")
+ap.add_argument("-i", "--interval", type=float, required=False, default=5, help="seconds between report lines")
+ap.add_argument("-p", "--payload", required=False, default='filepath', choices=['filepath', 'image'],
+                help="send frames as file paths or base64 encoded images")
+ap.add_argument("-e", "--env", action='append', default=[], help="KEY=VALUE lambda setting, may be repeated")
+ap.add_argument("--drain", type=float, required=False, default=10,
+                help="seconds to wait for outstanding results after the last event")
+ap.add_argument("-o", "--output", required=False, help="file to write every report line to, as JSON lines")
+ap.add_argument("--save", required=False, help="file to write the summary to, as JSON")
+ap.add_argument("--baseline", required=False, help="summary of an earlier run to compare against")
+ap.add_argument("--tolerance", type=float, required=False, default=0.1,
+                help="fraction the throughput or p99 latency may get worse than the baseline by")
+
+
+class LatencyTracker(object):
+    """
+    Matches the results the lambda publishes to the events sent, by id
+    """
+    def __init__(self, topics):
+        """
+        :param topics: topics the results are published on. Anything else, such as metrics, is ignored.
+        """
+        self.topics = set(topics)
+        self.sent = 0
+        self.completed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latencies = []
+        self.last_completed = None
+        self._interval_latencies = []
+        self._due = {}
+        self._lock = threading.Lock()
+
+    def send(self, event_id, due):
+        with self._lock:
+            self.sent += 1
+            self._due[event_id] = due
+
+    def error(self, event_id):
+        with self._lock:
+            self.errors += 1
+            self._due.pop(event_id, None)
+
+    def pending(self):
+        with self._lock:
+            return len(self._due)
+
+    def on_publish(self, topic, payload, now):
+        if topic not in self.topics:
+            return
+        results = parse_results(payload)
+        with self._lock:
+            if results is None:
+                # Requests that are dropped are answered with a plain text message
+                self.dropped += 1
+                return
+            for result in results:
+                due = self._due.pop(result.get('id'), None)
+                if due is not None:
+                    self.completed += 1
+                    self.last_completed = now
+                    self.latencies.append(now - due)
+                    self._interval_latencies.append(now - due)
+
+    def take_interval(self):
+        """
+        :return: the latencies of the results published since the last call
+        """
+        with self._lock:
+            latencies, self._interval_latencies = self._interval_latencies, []
+        return latencies
+
+
+def parse_results(payload):
+    """
+    :return: the responses in a JSON or binary result message, or None if it is not one
+    """
+    try:
+        message = json.loads(payload)
+        if isinstance(message, dict):
+            return message.get('results', [message])
+    except ValueError:
+        pass
+    try:
+        return decode_responses(payload)
+    except (ValueError, TypeError, struct.error):
+        return None
+
+
+def percentiles_ms(latencies):
+    if not latencies:
+        return dict((name, None) for name in ['p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+    values = 1000 * np.array(latencies)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(values.max())}
+
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Sampler(object):
+    """
+    Reports throughput, latency, CPU and memory every interval on its own thread
+    """
+    def __init__(self, tracker, interval, output=None):
+        self.tracker = tracker
+        self.interval = interval
+        self.output = output
+        self.samples = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='Sampler')
+        self._thread.daemon = True
+
+    def start(self):
+        self.started = self._last_time = time.time()
+        self._last_cpu = cpu_seconds()
+        self._last_completed = 0
+        print('{:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9} {:>7} {:>9} {:>8} {:>7}'.format(
+            'time_s', 'sent', 'results/s', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'cpu_%', 'rss_mb', 'dropped',
+            'errors'))
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.sample()
+
+    def sample(self):
+        now, cpu = time.time(), cpu_seconds()
+        elapsed = max(now - self._last_time, 1e-9)
+        completed = self.tracker.completed
+        sample = {
+            'time_s': now - self.started,
+            'sent': self.tracker.sent,
+            'results_per_s': (completed - self._last_completed) / elapsed,
+            'cpu_percent': 100 * (cpu - self._last_cpu) / elapsed,
+            'rss_bytes': resident_bytes(),
+            'dropped': self.tracker.dropped,
+            'errors': self.tracker.errors
+        }
+        sample.update(percentiles_ms(self.tracker.take_interval()))
+        self._last_time, self._last_cpu, self._last_completed = now, cpu, completed
+        self.samples.append(sample)
+        print('{:>8.1f} {:>7} {:>9.2f} {:>9} {:>9} {:>9} {:>9} {:>7.1f} {:>9.1f} {:>8} {:>7}'.format(
+            sample['time_s'], sample['sent'], sample['results_per_s'],
+            *[format_ms(sample[name]) for name in ['p50_ms', 'p95_ms', 'p99_ms', 'max_ms']] +
+            [sample['cpu_percent'], sample['rss_bytes'] / 1e6, sample['dropped'], sample['errors']]))
+        if self.output is not None:
+            self.output.write(json.dumps(sample) + '\n')
+            self.output.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+
+def format_ms(value):
+    return '-' if value is None else '{:.1f}'.format(value)
+
+
+def load_events(directory, payload):
+    """
+    :return: one event template per frame, without an id
+    """
+    from quantization import list_images
+    events = []
+    for filepath in list_images(directory):
+        if payload == 'image':
+            with open(filepath, 'rb') as f:
+                events.append({'image': base64.b64encode(f.read()).decode('ascii')})
+        else:
+            events.append({'filepath': os.path.abspath(filepath)})
+    if not events:
+        raise ValueError('no frames found in {}'.format(directory))
+    return events
+
+
+def send_events(handler, tracker, events, worker, concurrency, rate, started, deadline):
+    """
+    Send events worker, worker + concurrency, worker + 2 * concurrency... until the deadline
+    """
+    index = worker
+    while True:
+        due = started + index / rate if rate > 0 else time.time()
+        if due >= deadline:
+            return
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        event_id = 'load-{}'.format(index)
+        tracker.send(event_id, due)
+        try:
+            handler(dict(events[index % len(events)], id=event_id), None)
+        except Exception as e:
+            tracker.error(event_id)
+            print('event {} failed: {}'.format(event_id, e))
+        index += concurrency
+
+
+def summarize(tracker, sampler, duration):
+    """
+    :param duration: seconds from the first event sent to the last result published
+    """
+    summary = {
+        'sent': tracker.sent,
+        'completed': tracker.completed,
+        'dropped': tracker.dropped,
+        'errors': tracker.errors,
+        # Dropped requests are answered without their id, so they stay pending as well
+        'lost': max(tracker.pending() - tracker.dropped, 0),
+        'throughput_per_s': tracker.completed / duration,
+        'mean_cpu_percent': float(np.mean([sample['cpu_percent'] for sample in sampler.samples])),
+        'peak_rss_bytes': max(sample['rss_bytes'] for sample in sampler.samples)
+    }
+    summary.update(percentiles_ms(tracker.latencies))
+    return summary
+
+
+def regressions(summary, baseline, tolerance):
+    """
+    :return: a description of every way summary is worse than baseline by more than tolerance
+    """
+    found = []
+    if summary['throughput_per_s'] < baseline['throughput_per_s'] * (1 - tolerance):
+        found.append('throughput {:.2f}/s is below the baseline {:.2f}/s'.format(summary['throughput_per_s'],
+                                                                               baseline['throughput_per_s']))
+    if summary['p99_ms'] is not None and baseline.get('p99_ms') is not None and \
+            summary['p99_ms'] > baseline['p99_ms'] * (1 + tolerance):
+        found.append('p99 latency {:.1f} ms is above the baseline {:.1f} ms'.format(summary['p99_ms'],
+                                                                                  baseline['p99_ms']))
+    return found
+
+
+def main():
+    args = vars(ap.parse_args())
+    for setting in args['env']:
+        name, value = setting.split('=', 1)
+        os.environ[name] = value
+
+    tracker = LatencyTracker([])
+    greengrasssdk_stub.install(tracker.on_publish)
+    import main as lambda_main
+    tracker.topics.update([lambda_main.OUTPUT_TOPIC, lambda_main.BINARY_OUTPUT_TOPIC])
+    events = load_events(args['frames'], args['payload'])
+    lambda_main.initialize(args['model'])
+
+    print('{} frames, {} events/s over {} threads for {} s, settings: {}'.format(
+        len(events), args['rate'] or 'max', args['concurrency'], args['duration'], ' '.join(args['env']) or 'default'))
+    output = open(args['output'], 'w') if args['output'] else None
+    sampler = Sampler(tracker, args['interval'], output)
+    sampler.start()
+    started = time.time()
+    deadline = started + args['duration']
+    workers = [threading.Thread(target=send_events, args=(lambda_main.lambda_handler, tracker, events, worker,
+                                                          args['concurrency'], args['rate'], started, deadline))
+               for worker in range(args['concurrency'])]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    drain_deadline = time.time() + args['drain']
+    while tracker.pending() and time.time() < drain_deadline:
+        time.sleep(0.05)
+    sampler.stop()
+    if output is not None:
+        output.close()
+
+    # The drain wait is not part of the run, so throughput is measured up to the last result
+    summary = summarize(tracker, sampler, max((tracker.last_completed or time.time()) - started, 1e-9))
+    print('summary: ' + json.dumps(summary, sort_keys=True))
+    if args['save']:
+        with open(args['save'], 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    if args['baseline']:
+        with open(args['baseline']) as f:
+            found = regressions(summary, json.load(f), args['tolerance'])
+        for regression in found:
+            print('regression: ' + regression)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
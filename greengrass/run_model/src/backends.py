@@ -0,0 +1,216 @@
+import logging
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+import mxnet as mx
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+Batch = namedtuple('Batch', ['data'])
+
+
+def copy_to_device(inputs, data, context):
+    """
+    Copy a host batch into the device array kept in inputs for its shape, allocating it on first use
+    :return: the device array
+    """
+    device = inputs.get(data.shape)
+    if device is None:
+        device = inputs[data.shape] = mx.nd.zeros(data.shape, ctx=context)
+    device[:] = data
+    return device
+
+
+class ModuleBackend(object):
+    """
+    Runs the checkpoint with mx.mod.Module. One executor is bound per input shape, the first time the shape is
+    needed, and shares its parameters with the executor of the default shape.
+    """
+    name = 'module'
+
+    def __init__(self, sym, arg_params, aux_params, context, data_name, data_shape, label_names=()):
+        """
+        :param data_shape: default (batch size, channels, height, width) input shape, bound right away
+        """
+        self.sym = sym
+        self.context = context
+        self.data_name = data_name
+        self.label_names = list(label_names)
+        self.mod = mx.mod.Module(symbol=sym, label_names=self.label_names, context=context)
+        self.mod.bind(for_training=False, data_shapes=[(data_name, tuple(data_shape))])
+        self.mod.set_params(arg_params, aux_params)
+        self._modules = {tuple(data_shape): self.mod}
+        self._inputs = {}
+
+    def get_module(self, data_shape):
+        """
+        :return: the module bound for data_shape, binding it if it does not exist yet
+        """
+        data_shape = tuple(data_shape)
+        mod = self._modules.get(data_shape)
+        if mod is None:
+            logging.info('Binding executor for input shape {}'.format(data_shape))
+            mod = mx.mod.Module(symbol=self.sym, label_names=self.label_names, context=self.context)
+            mod.bind(for_training=False, data_shapes=[(self.data_name, data_shape)], shared_module=self.mod)
+            self._modules[data_shape] = mod
+        return mod
+
+    def forward(self, data):
+        """
+        :param data: (N, C, H, W) float32 array
+        :return: the first output, computed
+        """
+        mod = self.get_module(data.shape)
+        mod.forward(Batch([copy_to_device(self._inputs, data, self.context)]))
+        output = mod.get_outputs()[0]
+        # MXNet runs asynchronously, wait for the result so fetching it is timed on its own
+        output.wait_to_read()
+        return output
+
+    def fetch(self, output):
+        """
+        :return: the output of forward as a numpy array
+        """
+        return output.asnumpy()
+
+    def close(self):
+        pass
+
+
+class GluonBackend(object):
+    """
+    Runs the checkpoint as a hybridized Gluon SymbolBlock with static memory allocation and static shapes. As with
+    the Module backend, one block is built per input shape and all of them share the same parameters.
+    """
+    name = 'gluon'
+
+    def __init__(self, sym, arg_params, aux_params, context, data_name, data_shape, label_names=()):
+        self.sym = sym
+        self.context = context
+        self.data_name = data_name
+        self.label_names = list(label_names)
+        self.block = self._create_block()
+        params = self.block.collect_params()
+        values = dict(aux_params)
+        values.update(arg_params)
+        for name in params.keys():
+            if name not in values:
+                raise ValueError('checkpoint has no value for parameter {}'.format(name))
+        # The checkpoint also holds the parameters of the outputs the block leaves out, e.g. the loss
+        params.load_dict(values, ctx=context, ignore_extra=True)
+        self._blocks = {}
+        self._inputs = {}
+        self.get_module(data_shape)
+
+    def _create_block(self, params=None):
+        outputs = self.sym if len(self.sym.list_outputs()) == 1 else self.sym[0]
+        block = mx.gluon.SymbolBlock(outputs, mx.sym.var(self.data_name), params=params)
+        block.hybridize(static_alloc=True, static_shape=True)
+        return block
+
+    def get_module(self, data_shape):
+        """
+        :return: the block built for data_shape, building it if it does not exist yet
+        """
+        data_shape = tuple(data_shape)
+        block = self._blocks.get(data_shape)
+        if block is None:
+            logging.info('Building hybridized block for input shape {}'.format(data_shape))
+            block = self.block if not self._blocks else self._create_block(self.block.collect_params())
+            self._blocks[data_shape] = block
+        return block
+
+    def forward(self, data):
+        block = self.get_module(data.shape)
+        output = block(copy_to_device(self._inputs, data, self.context))
+        output.wait_to_read()
+        return output
+
+    def fetch(self, output):
+        return output.asnumpy()
+
+    def close(self):
+        pass
+
+
+class OnnxBackend(object):
+    """
+    Exports the checkpoint to ONNX with mx.contrib.onnx and runs it on the ONNX Runtime CPU execution provider. The
+    exporter needs fixed shapes, so a model is exported and a session created per input shape. Operators the MXNet
+    exporter does not support make the export fail; a model exported by other means can be passed as onnx_path.
+    """
+    name = 'onnx'
+
+    def __init__(self, sym, arg_params, aux_params, context, data_name, data_shape, label_names=(), onnx_dir=None,
+                 onnx_path=None):
+        """
+        :param onnx_dir: directory the exported models are written to. Defaults to a new temporary directory, removed
+                         by close.
+        :param onnx_path: already exported model to use for data_shape instead of exporting it
+        """
+        if onnxruntime is None:
+            raise ImportError('the onnx backend needs onnxruntime, install it with: pip install onnxruntime')
+        self.sym = sym
+        self.params = dict(arg_params)
+        self.params.update(aux_params)
+        self.data_name = data_name
+        self.onnx_dir = onnx_dir or tempfile.mkdtemp(prefix='onnx-')
+        self._temporary_dir = onnx_dir is None
+        self._sessions = {}
+        if onnx_path is not None:
+            self._sessions[tuple(data_shape)] = self._create_session(onnx_path)
+        self.get_module(data_shape)
+
+    def _create_session(self, onnx_path):
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def get_module(self, data_shape):
+        """
+        :return: the ONNX Runtime session for data_shape, exporting the model for it if needed
+        """
+        data_shape = tuple(data_shape)
+        session = self._sessions.get(data_shape)
+        if session is None:
+            onnx_path = os.path.join(self.onnx_dir, 'model-{}.onnx'.format('x'.join(str(d) for d in data_shape)))
+            if not os.path.exists(onnx_path):
+                logging.info('Exporting ONNX model for input shape {} to {}'.format(data_shape, onnx_path))
+                mx.contrib.onnx.export_model(self.sym, self.params, [data_shape], np.float32, onnx_path)
+            session = self._sessions[data_shape] = self._create_session(onnx_path)
+        return session
+
+    def forward(self, data):
+        session = self.get_module(data.shape)
+        return session.run(None, {session.get_inputs()[0].name: data})[0]
+
+    def fetch(self, output):
+        return output
+
+    def close(self):
+        """
+        Drop the sessions and remove the exported models if they were written to a temporary directory
+        """
+        self._sessions.clear()
+        if self._temporary_dir:
+            shutil.rmtree(self.onnx_dir, ignore_errors=True)
+            self._temporary_dir = False
+
+
+BACKENDS = dict((backend.name, backend) for backend in [ModuleBackend, GluonBackend, OnnxBackend])
+
+
+def create_backend(name, *args, **kwargs):
+    """
+    :param name: 'module', 'gluon' or 'onnx'
+    :return: the backend, constructed with the remaining arguments
+    """
+    if name not in BACKENDS:
+        raise ValueError('unknown inference backend {}. expected one of {}'.format(name, sorted(BACKENDS)))
+    return BACKENDS[name](*args, **kwargs)
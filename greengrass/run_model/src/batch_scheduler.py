@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+_STOP = object()
+
+
+class MicroBatchScheduler(object):
+    """
+    Collects submitted items into a bounded queue and hands them to process_batch in batches. A batch is flushed
+    as soon as max_batch_size items are waiting or the oldest waiting item has been queued for max_wait_ms.
+    """
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=20, max_queue_size=64, on_error=None):
+        """
+        :param process_batch: function called on the scheduler thread with the list of items in each batch
+        :param max_batch_size: maximum number of items handed to process_batch at once
+        :param max_wait_ms: maximum time the oldest queued item waits before its batch is flushed
+        :param max_queue_size: number of items that can be waiting before submit starts rejecting them
+        :param on_error: function called on the scheduler thread with the items of a batch process_batch raised on
+                         and the exception, so the items can still be answered
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.on_error = on_error
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._batches = 0
+        self._items = 0
+        self._dropped = 0
+        self._failed = 0
+        self._last_batch_size = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='MicroBatchScheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """
+        Flush what is already queued and stop the scheduler thread
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, item):
+        """
+        Queue an item for the next batch
+        :return: False if the queue is full and the item was dropped, True otherwise
+        """
+        try:
+            self._queue.put_nowait((time.time(), item))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+
+    def metrics(self):
+        """
+        :return: a dict with the current queue depth and the batch size and queueing time seen so far
+        """
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_size': self.max_queue_size,
+                'batches': self._batches,
+                'items': self._items,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'last_batch_size': self._last_batch_size,
+                'avg_batch_size': float(self._items) / self._batches if self._batches else 0.0,
+                'avg_wait_ms': 1000 * self._total_wait / self._items if self._items else 0.0,
+                'max_wait_ms': 1000 * self._max_wait
+            }
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = first[0] + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Exit once this batch has been processed
+                self._stopping = True
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            now = time.time()
+            waits = [now - queued_at for queued_at, _ in batch]
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._last_batch_size = len(batch)
+                self._total_wait += sum(waits)
+                self._max_wait = max(self._max_wait, max(waits))
+            items = [item for _, item in batch]
+            try:
+                self.process_batch(items)
+            except Exception as e:
+                logging.exception('Failed to process batch of {} items'.format(len(batch)))
+                with self._lock:
+                    self._failed += len(items)
+                if self.on_error is not None:
+                    try:
+                        self.on_error(items, e)
+                    except Exception:
+                        logging.exception('Failed to report the failure of a batch of {} items'.format(len(batch)))
+            if self._stopping:
+                return
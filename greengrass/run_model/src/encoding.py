@@ -0,0 +1,176 @@
+"""
+Compact binary encoding of prediction responses, an alternative to JSON for constrained links. Only needs numpy,
+so this file can be copied as is to whatever decodes the payloads on the cloud side. Decode payloads saved to files
+with:
+
+    python encoding.py payload.bin [payload.bin ...]
+
+Layout, little-endian:
+
+    header      magic 'GD', format version (uint8), number of detections N (uint16), timestamp (float64)
+    strings     filepath, model_version and a JSON object of any other response fields, each as a uint16 byte
+                length followed by UTF-8 bytes. A length of 0xFFFF stands for None.
+    classes     N int16, -1 for the empty detection MLModel returns when nothing was found
+    scores      N float16
+    boxes       N * 4 uint16, xmin ymin xmax ymax of each detection in units of 1/65535 of the image size
+
+Several responses published together are encoded as magic 'GB', format version (uint8) and the number of responses
+(uint16), followed by each encoded response prefixed with its uint32 byte length.
+
+Scores keep about 3 significant digits and box coordinates are accurate to about 1.5e-5. Coordinates are clipped
+to [0, 1], so the -1 coordinates of an empty detection come back as 0.
+"""
+import json
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'GD'
+VERSION = 1
+HEADER = struct.Struct('<2sBHd')
+BATCH_MAGIC = b'GB'
+BATCH_HEADER = struct.Struct('<2sBH')
+BATCH_LENGTH = struct.Struct('<I')
+LENGTH = struct.Struct('<H')
+NONE_LENGTH = 0xFFFF
+BOX_SCALE = 65535.0
+# Fields with a fixed place in the payload. Every other field of the response goes in the JSON extras.
+FIXED_FIELDS = ('prediction', 'timestamp', 'filepath', 'model_version')
+
+
+def _encode_string(value):
+    if value is None:
+        return LENGTH.pack(NONE_LENGTH)
+    data = value.encode('utf-8')
+    if len(data) >= NONE_LENGTH:
+        raise ValueError('string of {} bytes is too long to encode'.format(len(data)))
+    return LENGTH.pack(len(data)) + data
+
+
+def _decode_string(payload, offset):
+    length, = LENGTH.unpack_from(payload, offset)
+    offset += LENGTH.size
+    if length == NONE_LENGTH:
+        return None, offset
+    return payload[offset:offset + length].decode('utf-8'), offset + length
+
+
+def encode_detections(detections):
+    """
+    :param detections: (N, 6) array or list of [class, score, xmin, ymin, xmax, ymax] rows
+    :return: the packed classes, scores and boxes
+    """
+    detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+    classes = detections[:, 0].astype('<i2')
+    scores = detections[:, 1].astype('<f2')
+    boxes = np.round(np.clip(detections[:, 2:], 0.0, 1.0) * BOX_SCALE).astype('<u2')
+    return classes.tobytes() + scores.tobytes() + boxes.tobytes()
+
+
+def decode_detections(payload, offset, count):
+    """
+    :return: (count, 6) float32 array of [class, score, xmin, ymin, xmax, ymax] rows
+    """
+    classes = np.frombuffer(payload, dtype='<i2', count=count, offset=offset)
+    scores = np.frombuffer(payload, dtype='<f2', count=count, offset=offset + 2 * count)
+    boxes = np.frombuffer(payload, dtype='<u2', count=4 * count, offset=offset + 4 * count).reshape(count, 4)
+    detections = np.empty((count, 6), dtype=np.float32)
+    detections[:, 0] = classes
+    detections[:, 1] = scores
+    detections[:, 2:] = boxes / BOX_SCALE
+    return detections
+
+
+def encode_response(response):
+    """
+    :param response: a response dict as published in JSON, with the prediction as a list of detection rows
+    :return: the binary payload
+    """
+    prediction = response.get('prediction') or []
+    if len(prediction) > NONE_LENGTH:
+        raise ValueError('cannot encode more than {} detections'.format(NONE_LENGTH))
+    extras = dict((key, value) for key, value in response.items() if key not in FIXED_FIELDS)
+    return b''.join([
+        HEADER.pack(MAGIC, VERSION, len(prediction), response.get('timestamp') or 0.0),
+        _encode_string(response.get('filepath')),
+        _encode_string(response.get('model_version')),
+        _encode_string(json.dumps(extras, separators=(',', ':')) if extras else None),
+        encode_detections(prediction)
+    ])
+
+
+def decode_response(payload):
+    """
+    :param payload: bytes produced by encode_response
+    :return: the response dict, with the prediction as a list of detection rows
+    """
+    if len(payload) < HEADER.size:
+        raise ValueError('payload of {} bytes is too short'.format(len(payload)))
+    magic, version, count, timestamp = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC:
+        raise ValueError('not a binary prediction payload')
+    if version != VERSION:
+        raise ValueError('unsupported payload version {}'.format(version))
+    filepath, offset = _decode_string(payload, HEADER.size)
+    model_version, offset = _decode_string(payload, offset)
+    extras, offset = _decode_string(payload, offset)
+    if len(payload) - offset != 12 * count:
+        raise ValueError('payload should hold {} detections in {} bytes, found {}'.format(
+            count, 12 * count, len(payload) - offset))
+
+    response = json.loads(extras) if extras else {}
+    response.update({
+        'prediction': decode_detections(payload, offset, count).tolist(),
+        'timestamp': timestamp,
+        'filepath': filepath,
+        'model_version': model_version
+    })
+    return response
+
+
+def encode_responses(responses):
+    """
+    :return: one binary payload holding all the responses
+    """
+    if len(responses) > NONE_LENGTH:
+        raise ValueError('cannot encode more than {} responses'.format(NONE_LENGTH))
+    parts = [BATCH_HEADER.pack(BATCH_MAGIC, VERSION, len(responses))]
+    for response in responses:
+        payload = encode_response(response)
+        parts.append(BATCH_LENGTH.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_responses(payload):
+    """
+    :param payload: bytes produced by encode_responses, or by encode_response for a single response
+    :return: the list of response dicts
+    """
+    if payload[:2] == MAGIC:
+        return [decode_response(payload)]
+    if len(payload) < BATCH_HEADER.size or payload[:2] != BATCH_MAGIC:
+        raise ValueError('not a binary prediction payload')
+    _, version, count = BATCH_HEADER.unpack_from(payload, 0)
+    if version != VERSION:
+        raise ValueError('unsupported payload version {}'.format(version))
+    responses = []
+    offset = BATCH_HEADER.size
+    for _ in range(count):
+        length, = BATCH_LENGTH.unpack_from(payload, offset)
+        offset += BATCH_LENGTH.size
+        responses.append(decode_response(payload[offset:offset + length]))
+        offset += length
+    return responses
+
+
+def main(filepaths):
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            for response in decode_responses(f.read()):
+                print(json.dumps(response))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
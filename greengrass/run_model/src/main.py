@@ -4,11 +4,29 @@
 
 # Lambda entry point
 import greengrasssdk
-from model_loader import MLModel
+from model_loader import BATCH_SIZES, EncodedImage, MLModel, decode_image, read_file
+from model_pool import MLModelPool
+from result_cache import ResultCache
+from postprocess import DetectionPostprocessor
+from batch_scheduler import MicroBatchScheduler
+from pipeline import InferencePipeline
+from model_watcher import ModelHolder, ModelWatcher, checkpoint_version
+from metrics import Metrics, MetricsPublisher
+from stream_runner import StreamRunner
+from motion_gate import MotionGate
+from quantization import Int8Quantizer
+from encoding import encode_response, encode_responses
+from output_aggregator import OutputAggregator
+from store_forward import StoreAndForward, tcp_probe
+import base64
+import functools
 import logging
+import mmap
 import os
+import threading
 import time
 import json
+from collections import OrderedDict, namedtuple
 
 ML_MODEL_BASE_PATH = '/ml/od/'
 ML_MODEL_PREFIX = 'deploy_model_algo_1'
@@ -16,51 +34,702 @@ ML_MODEL_PATH = os.path.join(ML_MODEL_BASE_PATH, ML_MODEL_PREFIX)
 # Creating a greengrass core sdk client
 client = greengrasssdk.client('iot-data')
 model = None
+scheduler = None
+watcher = None
+stream_runner = None
+output_aggregator = None
+store_forward = None
+# Every request takes the model it runs on from model_holder, so a reloaded model can be swapped in safely
+model_holder = ModelHolder()
+# Arguments of the last initialize call, reused when a new checkpoint is loaded
+model_settings = {}
+# Per-stage latencies and throughput counters shared by every model and the lambda itself
+metrics = Metrics()
+metrics_publisher = None
+lambda_started = time.time()
+first_prediction_logged = False
+# Set once the model is loaded and warmed up. Requests arriving before that are kept in pending_requests.
+model_ready = threading.Event()
+pending_requests = []
+pending_lock = threading.Lock()
+# Why the model could not be loaded in the background, answered to every request instead of queueing it
+model_error = None
+# One MotionGate per event source, holding the last frame and detections of that source
+motion_gates = {}
+motion_gates_lock = threading.Lock()
+
+# A request to run inference on. image is a filepath or an EncodedImage; filepath and id are echoed in the response.
+# source names the camera the image comes from, so each one gets its own motion gate. resolution is the input size
+# the request asked for, or None for the default.
+InferenceRequest = namedtuple('InferenceRequest', ['image', 'filepath', 'id', 'source', 'resolution'])
 
 OUTPUT_TOPIC = 'blog/infer/output'
+BINARY_OUTPUT_TOPIC = 'blog/infer/output/bin'
+METRICS_TOPIC = 'blog/infer/metrics'
+# Publish a metrics snapshot on METRICS_TOPIC every METRICS_INTERVAL_SECONDS. 0 only publishes on demand, when an
+# event with "command": "dump_metrics" is received.
+METRICS_INTERVAL_SECONDS = float(os.environ.get('METRICS_INTERVAL_SECONDS', 60))
+# Comma separated formats every prediction is published in: 'json' on OUTPUT_TOPIC and 'binary' (see encoding.py)
+# on BINARY_OUTPUT_TOPIC, so each subscription can pick the one it needs.
+OUTPUT_FORMATS = [name.strip() for name in os.environ.get('OUTPUT_FORMATS', 'json').split(',') if name.strip()]
+# Publish up to OUTPUT_BATCH_SIZE predictions together in one message, after at most OUTPUT_MAX_DELAY_MS. With
+# OUTPUT_CHANGES_ONLY a prediction is only published when its detections differ from the last published one of its
+# source.
+OUTPUT_BATCH_SIZE = int(os.environ.get('OUTPUT_BATCH_SIZE', 1))
+OUTPUT_MAX_DELAY_MS = int(os.environ.get('OUTPUT_MAX_DELAY_MS', 1000))
+OUTPUT_CHANGES_ONLY = os.environ.get('OUTPUT_CHANGES_ONLY', 'false').lower() == 'true'
+# Keep results in a memory-mapped ring buffer of STORE_FORWARD_BYTES at STORE_FORWARD_PATH while publishing fails,
+# evicting the oldest ones when it is full, and replay them in order at up to STORE_FORWARD_REPLAY_RATE messages per
+# second once it works again. STORE_FORWARD_PROBE is an optional host:port, e.g. the AWS IoT endpoint on port 8883,
+# checked every STORE_FORWARD_RETRY_SECONDS to notice the uplink is down when publishing itself does not fail.
+STORE_FORWARD_PATH = os.environ.get('STORE_FORWARD_PATH')
+STORE_FORWARD_BYTES = int(os.environ.get('STORE_FORWARD_BYTES', 16 * 1024 * 1024))
+STORE_FORWARD_REPLAY_RATE = float(os.environ.get('STORE_FORWARD_REPLAY_RATE', 20))
+STORE_FORWARD_RETRY_SECONDS = float(os.environ.get('STORE_FORWARD_RETRY_SECONDS', 5))
+STORE_FORWARD_PROBE = os.environ.get('STORE_FORWARD_PROBE')
 
-# Load the model at startup
-def initialize(param_path=ML_MODEL_PATH):
+# 'sync' runs every request on the invoking thread. 'batch' queues requests and runs them in micro-batches on a
+# long-lived scheduler thread. 'pipeline' overlaps decoding, inference and publishing on separate threads. Both
+# 'batch' and 'pipeline' need the lambda to be pinned.
+INFERENCE_MODE = os.environ.get('INFERENCE_MODE', 'sync')
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 8))
+MAX_WAIT_MS = int(os.environ.get('MAX_WAIT_MS', 20))
+MAX_QUEUE_SIZE = int(os.environ.get('MAX_QUEUE_SIZE', 64))
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', 2))
+SUBMIT_TIMEOUT_MS = int(os.environ.get('SUBMIT_TIMEOUT_MS', 1000))
+# 1 loads a single model. 0 loads one replica per GPU (or a single one on the CPU) and N > 1 runs N replicas on a
+# CPU-only device, each on its own thread.
+MODEL_REPLICAS = int(os.environ.get('MODEL_REPLICAS', 1))
+# Number of predictions cached by image content. 0 disables the cache.
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 0))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get('RESULT_CACHE_TTL_SECONDS', 0))
+RESULT_CACHE_PERCEPTUAL = os.environ.get('RESULT_CACHE_PERCEPTUAL', 'false').lower() == 'true'
+RESULT_CACHE_MAX_DISTANCE = int(os.environ.get('RESULT_CACHE_MAX_DISTANCE', 4))
+# When DETECTION_THRESHOLD is set every detection scoring above it is returned instead of only the top one.
+# CLASS_THRESHOLDS is a JSON object of class id to threshold, e.g. '{"1": 0.7}'.
+DETECTION_THRESHOLD = os.environ.get('DETECTION_THRESHOLD')
+CLASS_THRESHOLDS = os.environ.get('CLASS_THRESHOLDS')
+NMS_THRESHOLD = os.environ.get('NMS_THRESHOLD')
+DETECTION_TOP_K = os.environ.get('DETECTION_TOP_K')
+# 'eager' loads the model while the lambda is imported. 'background' loads it on a separate thread so the lambda can
+# start accepting requests right away; requests are queued until the model is ready.
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'eager')
+WARM_UP = os.environ.get('WARM_UP', 'true').lower() == 'true'
+# Watch ML_MODEL_BASE_PATH for a new checkpoint every MODEL_POLL_SECONDS and swap it in without a restart.
+# A reload waits up to MODEL_DRAIN_SECONDS for in-flight requests to finish on the previous model before moving on.
+HOT_RELOAD = os.environ.get('HOT_RELOAD', 'false').lower() == 'true'
+MODEL_POLL_SECONDS = float(os.environ.get('MODEL_POLL_SECONDS', 30))
+MODEL_DRAIN_SECONDS = float(os.environ.get('MODEL_DRAIN_SECONDS', 30))
+# Square input size images are resized to. INPUT_RESOLUTIONS lists other sizes to bind as well, e.g. '300,384', which
+# requests can ask for. When LOW_RESOLUTION_BATCH_SIZE is set, batches of at least that many images run at the
+# smallest size, trading accuracy for throughput under load. LETTERBOX pads images instead of stretching them.
+INPUT_RESOLUTION = int(os.environ.get('INPUT_RESOLUTION', 512))
+INPUT_RESOLUTIONS = [int(size) for size in os.environ.get('INPUT_RESOLUTIONS', '').split(',') if size.strip()]
+LOW_RESOLUTION_BATCH_SIZE = int(os.environ.get('LOW_RESOLUTION_BATCH_SIZE', 0))
+LETTERBOX = os.environ.get('LETTERBOX', 'false').lower() == 'true'
+# Engine running the network: 'module' (mx.mod.Module), 'gluon' (hybridized SymbolBlock) or 'onnx' (ONNX Runtime,
+# which must be installed in the deployment package).
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'module')
+# 'int8' converts the fp32 checkpoint to INT8 when it is loaded, calibrating it on up to CALIBRATION_IMAGES images
+# from CALIBRATION_DIR. Without CALIBRATION_DIR the ranges are computed on every forward pass, which is slower.
+# QUANTIZE_EXCLUDE is a comma separated list of layers to keep in fp32.
+MODEL_PRECISION = os.environ.get('MODEL_PRECISION', 'fp32')
+CALIBRATION_DIR = os.environ.get('CALIBRATION_DIR')
+CALIBRATION_IMAGES = int(os.environ.get('CALIBRATION_IMAGES', 10))
+CALIBRATION_MODE = os.environ.get('CALIBRATION_MODE', 'naive')
+QUANTIZE_EXCLUDE = os.environ.get('QUANTIZE_EXCLUDE')
+# Run inference on the frames of a camera index, RTSP URL or video file as they arrive, besides answering
+# messages. Frames are skipped while inference is busy; frames older than STREAM_MAX_LATENCY_MS are dropped, and at
+# most STREAM_PUBLISH_RATE results are published per second (0 publishes all of them).
+STREAM_SOURCE = os.environ.get('STREAM_SOURCE')
+STREAM_MAX_LATENCY_MS = int(os.environ.get('STREAM_MAX_LATENCY_MS', 500))
+STREAM_PUBLISH_RATE = float(os.environ.get('STREAM_PUBLISH_RATE', 0))
+# Skip inference on frames that barely changed since the last inferred frame of the same source and reuse its
+# detections. MOTION_GATE is 'diff' or 'mog2'; unset runs every frame. Applies to the stream and to 'sync' mode.
+MOTION_GATE = os.environ.get('MOTION_GATE')
+MOTION_THRESHOLD = float(os.environ.get('MOTION_THRESHOLD', 0.01))
+MOTION_PIXEL_THRESHOLD = float(os.environ.get('MOTION_PIXEL_THRESHOLD', 25))
+MOTION_MAX_SKIP_FRAMES = int(os.environ.get('MOTION_MAX_SKIP_FRAMES', 30))
+
+
+def create_cache(size=RESULT_CACHE_SIZE):
+    if size <= 0:
+        return None
+    return ResultCache(max_size=size, ttl_seconds=RESULT_CACHE_TTL_SECONDS, perceptual=RESULT_CACHE_PERCEPTUAL,
+                       max_distance=RESULT_CACHE_MAX_DISTANCE)
+
+
+def create_postprocessor(threshold=DETECTION_THRESHOLD):
+    if threshold is None:
+        return None
+    class_thresholds = None
+    if CLASS_THRESHOLDS:
+        class_thresholds = dict((int(k), float(v)) for k, v in json.loads(CLASS_THRESHOLDS).items())
+    return DetectionPostprocessor(threshold=float(threshold), class_thresholds=class_thresholds,
+                                  nms_threshold=float(NMS_THRESHOLD) if NMS_THRESHOLD else None,
+                                  top_k=int(DETECTION_TOP_K) if DETECTION_TOP_K else None)
+
+
+def create_motion_gate(method=None):
+    """
+    :param method: 'diff' or 'mog2'. Defaults to MOTION_GATE as it is when called.
+    """
+    method = method or MOTION_GATE
+    if not method:
+        return None
+    return MotionGate(method, threshold=MOTION_THRESHOLD, pixel_threshold=MOTION_PIXEL_THRESHOLD,
+                      max_skip_frames=MOTION_MAX_SKIP_FRAMES or None)
+
+
+def get_motion_gate(source):
+    with motion_gates_lock:
+        if source not in motion_gates:
+            motion_gates[source] = create_motion_gate()
+        return motion_gates[source]
+
+
+def create_store_forward(path=None):
+    """
+    :param path: file of the ring buffer. Defaults to STORE_FORWARD_PATH as it is when called.
+    """
+    path = path or STORE_FORWARD_PATH
+    if not path:
+        return None
+    probe = None
+    if STORE_FORWARD_PROBE:
+        host, port = STORE_FORWARD_PROBE.rsplit(':', 1)
+        probe = tcp_probe(host, int(port))
+    return StoreAndForward(send_message, path, capacity_bytes=STORE_FORWARD_BYTES,
+                           replay_rate=STORE_FORWARD_REPLAY_RATE, retry_seconds=STORE_FORWARD_RETRY_SECONDS,
+                           is_connected=probe)
+
+
+def create_quantizer(precision=MODEL_PRECISION):
+    if precision == 'fp32':
+        return None
+    if precision != 'int8':
+        raise ValueError('unsupported MODEL_PRECISION {}. expected fp32 or int8'.format(precision))
+    excluded = [name.strip() for name in QUANTIZE_EXCLUDE.split(',') if name.strip()] if QUANTIZE_EXCLUDE else None
+    return Int8Quantizer(CALIBRATION_DIR, num_calib_images=CALIBRATION_IMAGES, calib_mode=CALIBRATION_MODE,
+                         excluded_sym_names=excluded)
+
+
+def input_resolutions():
+    return sorted(set([INPUT_RESOLUTION] + INPUT_RESOLUTIONS))
+
+
+def select_resolution(num_images):
+    """
+    :return: the input size for a batch of num_images, the smallest one when the batch is large enough to show the
+             lambda is under load
+    """
+    if LOW_RESOLUTION_BATCH_SIZE and num_images >= LOW_RESOLUTION_BATCH_SIZE:
+        return input_resolutions()[0]
+    return INPUT_RESOLUTION
+
+
+def load_model(param_path, replicas=MODEL_REPLICAS, cache=None, postprocessor=None, quantizer=None):
+    model_kwargs = dict(cache=cache, postprocessor=postprocessor, metrics=metrics, quantizer=quantizer,
+                        input_shapes=[('data', (1, 3, INPUT_RESOLUTION, INPUT_RESOLUTION))],
+                        resolutions=INPUT_RESOLUTIONS, letterbox=LETTERBOX, backend=INFERENCE_BACKEND)
+    if replicas == 1:
+        return MLModel(param_path, **model_kwargs)
+    # All replicas share one cache, and one quantizer so the checkpoint is only calibrated once
+    return MLModelPool(param_path, num_cpu_replicas=replicas or None, **model_kwargs)
+
+
+def prepare_model(param_path, inference_mode, replicas, cache_size, warm_up):
+    """
+    Load a model and warm it up without making it serve requests yet
+    """
+    start = time.time()
+    new_model = load_model(param_path, replicas, create_cache(cache_size), create_postprocessor(), create_quantizer())
+    logging.info('Loaded model in {:.0f} ms'.format(1000 * (time.time() - start)))
+    if warm_up:
+        start = time.time()
+        # Bind and run every executor the inference mode can use before the first request needs it
+        max_batch_size = 1 if inference_mode == 'sync' else MAX_BATCH_SIZE
+        new_model.warm_up([size for size in BATCH_SIZES if size <= max_batch_size] or [1], input_resolutions())
+        logging.info('Warmed up model in {:.0f} ms'.format(1000 * (time.time() - start)))
+    return new_model
+
+
+def install_model(new_model, version):
+    """
+    Make new_model serve all new requests and release the previous model once its requests have finished
+    """
     global model
-    model = MLModel(param_path)
+    model = new_model
+    old_model, drained = model_holder.swap(new_model, version, drain_timeout=MODEL_DRAIN_SECONDS)
+    if old_model is not None and old_model is not new_model:
+        if drained:
+            old_model.close()
+        else:
+            # Closing it now would pull the model out from under the requests still running on it
+            model_holder.close_when_drained(old_model)
+    logging.info('Serving model version {}'.format(version))
+
+
+def reload_model(version):
+    """
+    Called on the watcher thread when a new checkpoint shows up. Loads and warms it up, then swaps it in.
+    """
+    settings = dict(model_settings)
+    param_path = settings.pop('param_path')
+    install_model(prepare_model(param_path, **settings), version)
+
+
+# Load the model at startup
+def initialize(param_path=ML_MODEL_PATH, inference_mode=INFERENCE_MODE, replicas=MODEL_REPLICAS,
+               cache_size=RESULT_CACHE_SIZE, warm_up=WARM_UP, hot_reload=HOT_RELOAD,
+               metrics_interval=METRICS_INTERVAL_SECONDS, stream_source=STREAM_SOURCE):
+    global scheduler, watcher, stream_runner, output_aggregator, store_forward, metrics_publisher, model_error
+    model_ready.clear()
+    model_error = None
+    if watcher is not None:
+        watcher.stop()
+        watcher = None
+    if stream_runner is not None:
+        stream_runner.stop()
+        stream_runner = None
+    with motion_gates_lock:
+        motion_gates.clear()
+
+    model_settings.clear()
+    model_settings.update(param_path=param_path, inference_mode=inference_mode, replicas=replicas,
+                          cache_size=cache_size, warm_up=warm_up)
+    version = checkpoint_version(param_path)
+    install_model(prepare_model(param_path, inference_mode, replicas, cache_size, warm_up), version)
+
+    if scheduler is not None:
+        scheduler.stop()
+        scheduler = None
+    if output_aggregator is not None:
+        output_aggregator.stop()
+        output_aggregator = None
+    if store_forward is not None:
+        store_forward.close()
+    store_forward = create_store_forward()
+    if store_forward is not None:
+        store_forward.start()
+    if OUTPUT_BATCH_SIZE > 1 or OUTPUT_CHANGES_ONLY:
+        output_aggregator = OutputAggregator(send_responses, max_count=max(OUTPUT_BATCH_SIZE, 1),
+                                             max_delay_ms=OUTPUT_MAX_DELAY_MS, changes_only=OUTPUT_CHANGES_ONLY)
+        output_aggregator.start()
+    if inference_mode == 'batch':
+        scheduler = MicroBatchScheduler(predict_and_publish, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                                        max_queue_size=MAX_QUEUE_SIZE, on_error=publish_batch_failure)
+    elif inference_mode == 'pipeline':
+        scheduler = InferencePipeline(decode_request, predict_images, publish_prediction, decode_workers=DECODE_WORKERS,
+                                      queue_size=MAX_QUEUE_SIZE, max_batch_size=MAX_BATCH_SIZE,
+                                      submit_timeout=SUBMIT_TIMEOUT_MS / 1000.0, on_error=publish_failure)
+    if scheduler is not None:
+        scheduler.start()
+
+    if hot_reload:
+        watcher = ModelWatcher(param_path, reload_model, interval=MODEL_POLL_SECONDS)
+        watcher.start()
+
+    if metrics_publisher is not None:
+        metrics_publisher.stop()
+    metrics_publisher = MetricsPublisher(collect_metrics, publish_metrics, interval=metrics_interval)
+    if metrics_interval > 0:
+        metrics_publisher.start()
+
+    if stream_source:
+        publish = functools.partial(publish_frame, str(stream_source))
+        stream_runner = StreamRunner(stream_source, predict_images, publish, max_latency_ms=STREAM_MAX_LATENCY_MS,
+                                     publish_rate=STREAM_PUBLISH_RATE, metrics=metrics, gate=create_motion_gate())
+        stream_runner.start()
+
+    logging.info('Model loaded {:.0f} ms after lambda start'.format(1000 * (time.time() - lambda_started)))
+    replay_pending_requests()
+
+
+def replay_pending_requests():
+    """
+    Answer the requests queued while the model was loading, in order, before letting new requests through. Requests
+    arriving during the replay are queued behind it, so the queue is not served from two threads at once.
+    """
+    while True:
+        with pending_lock:
+            requests = pending_requests[:]
+            del pending_requests[:]
+            if not requests:
+                model_ready.set()
+                logging.info('Model ready {:.0f} ms after lambda start'.format(1000 * (time.time() - lambda_started)))
+                return
+        for request in requests:
+            handle_request(request)
+
+
+def initialize_or_report(param_path=ML_MODEL_PATH):
+    """
+    initialize, publishing an error for the queued requests and every later one if it fails
+    """
+    global model_error
+    try:
+        initialize(param_path)
+    except Exception as e:
+        logging.exception('Failed to load the model from {}'.format(param_path))
+        with pending_lock:
+            model_error = 'model could not be loaded: {}'.format(e)
+            requests = pending_requests[:]
+            del pending_requests[:]
+        client.publish(topic=OUTPUT_TOPIC, payload=model_error)
+        for request in requests:
+            drop_request(request, model_error)
+
+
+def initialize_in_background(param_path=ML_MODEL_PATH):
+    """
+    Load and warm up the model on a separate thread
+    :return: the thread doing the initialization
+    """
+    thread = threading.Thread(target=initialize_or_report, args=(param_path,), name='ModelInitializer')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def collect_metrics():
+    """
+    :return: the stage latencies and counters along with the state of the scheduler, cache and model replicas
+    """
+    snapshot = metrics.snapshot()
+    snapshot['model_version'] = model_holder.version
+    if scheduler is not None:
+        snapshot['scheduler'] = scheduler.metrics()
+    if output_aggregator is not None:
+        snapshot['output'] = output_aggregator.metrics()
+    if store_forward is not None:
+        snapshot['store_forward'] = store_forward.metrics()
+    if stream_runner is not None:
+        snapshot['stream'] = stream_runner.metrics()
+        if stream_runner.gate is not None:
+            snapshot['stream']['gate'] = stream_runner.gate.stats()
+    with motion_gates_lock:
+        gates = dict((str(source), gate.stats()) for source, gate in motion_gates.items() if gate is not None)
+    if gates:
+        snapshot['motion_gates'] = gates
+    current_model = model_holder.model
+    if current_model is not None and current_model.cache is not None:
+        snapshot['cache'] = current_model.cache.stats()
+    if isinstance(current_model, MLModelPool):
+        snapshot['replicas'] = current_model.utilization()
+    return snapshot
+
+
+def publish_metrics(payload):
+    client.publish(topic=METRICS_TOPIC, payload=payload)
+
+
+def read_shared_memory(spec):
+    """
+    Map a region of a file in shared memory (e.g. under /dev/shm) written by a producer on the device
+    :param spec: dict with the 'path' of the file and optionally the 'offset' and 'length' of the encoded image in it
+    :return: a memoryview of the region. The producer must not overwrite it until the response is published.
+    """
+    with open(spec['path'], 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    offset = int(spec.get('offset', 0))
+    length = int(spec.get('length', len(mapped) - offset))
+    return memoryview(mapped)[offset:offset + length]
+
+
+def parse_request(event):
+    """
+    Turn an input event into an InferenceRequest. The image can be given as a 'filepath' on the device, as a base64
+    encoded 'image', as a region of a shared memory file in 'shm', or the event can be the raw encoded image bytes.
+    :return: an (InferenceRequest, error message) tuple, one of which is None
+    """
+    if isinstance(event, (bytes, bytearray, memoryview)):
+        return InferenceRequest(EncodedImage(memoryview(event)), None, None, None, None), None
+    if not isinstance(event, dict):
+        return None, 'input event is a {}, not an object or encoded image bytes. nothing to do. returning.'.format(
+            type(event).__name__)
+
+    request_id = event.get('id')
+    source = event.get('source')
+    resolution = event.get('resolution')
+    if resolution is not None and resolution not in input_resolutions():
+        return None, 'resolution {} is not one of {}. nothing to do. returning.'.format(resolution, input_resolutions())
+    if 'image' in event:
+        try:
+            data = base64.b64decode(event['image'])
+        except (TypeError, ValueError):
+            return None, 'image is not valid base64. nothing to do. returning.'
+        return InferenceRequest(EncodedImage(data), None, request_id, source, resolution), None
+
+    if 'shm' in event:
+        try:
+            data = read_shared_memory(event['shm'])
+        except (KeyError, TypeError, ValueError, EnvironmentError) as e:
+            return None, 'could not read image from shared memory: {}'.format(e)
+        return InferenceRequest(EncodedImage(data), None, request_id, source, resolution), None
+
+    if 'filepath' not in event:
+        return None, 'filepath is not in input event. nothing to do. returning.'
+
+    filepath = event['filepath']
+    if not os.path.exists(filepath):
+        return None, 'filepath does not exist. make sure \'{}\' exists on the device'.format(filepath)
+    return InferenceRequest(filepath, filepath, request_id, source, resolution), None
+
+
+def describe(request):
+    if request.filepath is not None:
+        return request.filepath
+    return 'in-memory image {}'.format(request.id) if request.id is not None else 'in-memory image'
+
+
+def decode_request(request):
+    if isinstance(request.image, EncodedImage):
+        data = request.image.data
+    else:
+        with metrics.time('read'):
+            data = read_file(request.image)
+    with metrics.time('decode'):
+        return decode_image(data)
+
+
+def log_first_prediction():
+    global first_prediction_logged
+    if not first_prediction_logged:
+        first_prediction_logged = True
+        logging.info('Time to first prediction: {:.0f} ms after lambda start'.format(
+            1000 * (time.time() - lambda_started)))
+
+
+def build_response(prediction, request, model_version):
+    response = {
+        'prediction': prediction,
+        'timestamp': time.time(),
+        'filepath': request.filepath,
+        'model_version': model_version
+    }
+    if request.id is not None:
+        response['id'] = request.id
+    if request.source is not None:
+        response['source'] = request.source
+    return response
+
+
+def publish_prediction(request, result):
+    """
+    Publish a (prediction, model version) result as returned by predict_images
+    """
+    log_first_prediction()
+    publish_response(build_response(result[0], request, result[1]))
+
+
+def publish_failure(request, error):
+    """
+    Answer a request whose inference failed, as requests that are dropped are
+    """
+    metrics.count('failed')
+    msg = 'inference failed for \'{}\': {}'.format(describe(request), error)
+    logging.warning(msg)
+    client.publish(topic=OUTPUT_TOPIC, payload=msg)
+
+
+def publish_batch_failure(requests, error):
+    """
+    Answer every request of a micro-batch whose inference failed
+    """
+    for request in requests:
+        publish_failure(request, error)
+
+
+def publish_frame(source, frame, result):
+    """
+    Publish the (prediction, model version) result of a frame read by the stream runner
+    :param source: name of the stream the frame was read from, bound when the runner is created
+    """
+    log_first_prediction()
+    request = InferenceRequest(frame.image, None, frame.index, source, None)
+    response = build_response(result[0], request, result[1])
+    response['latency_ms'] = 1000 * (response['timestamp'] - frame.timestamp)
+    publish_response(response)
+
+
+def publish_response(response):
+    if output_aggregator is not None:
+        output_aggregator.add(response)
+    else:
+        send_responses([response])
+
+
+def send_responses(responses):
+    """
+    Publish responses in every output format, as one message per response or, when output batching is enabled, as a
+    single message of the form {"timestamp": ..., "results": [response, ...]}
+    """
+    with metrics.time('publish'):
+        if OUTPUT_BATCH_SIZE <= 1:
+            for response in responses:
+                if 'json' in OUTPUT_FORMATS:
+                    publish_result(OUTPUT_TOPIC, json.dumps(response))
+                if 'binary' in OUTPUT_FORMATS:
+                    publish_result(BINARY_OUTPUT_TOPIC, encode_response(response))
+        else:
+            if 'json' in OUTPUT_FORMATS:
+                publish_result(OUTPUT_TOPIC, json.dumps({'timestamp': time.time(), 'results': responses}))
+            if 'binary' in OUTPUT_FORMATS:
+                publish_result(BINARY_OUTPUT_TOPIC, encode_responses(responses))
+    metrics.count('published', len(responses))
+
+
+def publish_result(topic, payload):
+    """
+    Publish a result message, through the store and forward buffer when STORE_FORWARD_PATH is set
+    """
+    if store_forward is not None:
+        store_forward.publish(topic, payload)
+    else:
+        send_message(topic, payload)
+
+
+def send_message(topic, payload):
+    client.publish(topic=topic, payload=payload)
+
+
+def predict_images(filepaths_or_images, resolution=None):
+    """
+    Runs one batched prediction for the given files, encoded or decoded images
+    :param resolution: input size to run at. Defaults to the one select_resolution picks for the batch size.
+    :return: a (prediction, model version) tuple per image
+    """
+    resolution = resolution or select_resolution(len(filepaths_or_images))
+    with model_holder.acquire() as (current_model, version):
+        start = int(round(time.time() * 1000))
+        predictions = current_model.predict_batch(filepaths_or_images, resolution)
+        end = int(round(time.time() * 1000))
+
+    logging.info('Predicted batch of {} images in: {}'.format(len(filepaths_or_images), end - start))
+    if scheduler is not None:
+        logging.info('Scheduler metrics: {}'.format(scheduler.metrics()))
+    if isinstance(current_model, MLModelPool):
+        logging.info('Replica utilization: {}'.format(current_model.utilization()))
+    return [(prediction, version) for prediction in predictions]
+
+
+def predict_request(request):
+    """
+    Runs the prediction of a single request, unless the motion gate of its source finds the image unchanged since
+    the last prediction, in which case that prediction is reused
+    :return: a (prediction, model version) tuple
+    """
+    gate = get_motion_gate(request.source)
+    image = request.image
+    if gate is not None:
+        # Decode once so the gate and the model share the image
+        image = decode_request(request)
+        if image is not None and not gate.should_infer(image):
+            metrics.count('gated')
+            return gate.last_result
+
+    with model_holder.acquire() as (current_model, version):
+        prediction = current_model.predict_batch([image], request.resolution or INPUT_RESOLUTION)[0]
+    if gate is not None and image is not None:
+        gate.remember((prediction, version))
+    return prediction, version
+
+
+def predict_and_publish(requests):
+    """
+    Runs a batched prediction for the given requests and publishes a response for each of them. Requests asking for
+    a resolution run in a batch of their own at it, the others at the size select_resolution picks for them.
+    """
+    groups = OrderedDict()
+    for request in requests:
+        groups.setdefault(request.resolution, []).append(request)
+    for resolution, group in groups.items():
+        try:
+            results = predict_images([request.image for request in group], resolution)
+        except Exception as e:
+            # Only answer this group, the others have been or will be answered with their predictions
+            logging.exception('Failed to predict batch of {} images'.format(len(group)))
+            publish_batch_failure(group, e)
+            continue
+        for request, result in zip(group, results):
+            publish_prediction(request, result)
 
 
 def lambda_handler(event, context):
     """
     Gets called each time the function gets invoked.
     """
-    if 'filepath' not in event:
-        msg = 'filepath is not in input event. nothing to do. returning.'
+    if isinstance(event, dict) and event.get('command') == 'dump_metrics':
+        snapshot = collect_metrics()
+        publish_metrics(json.dumps(snapshot))
+        return snapshot
+
+    request, msg = parse_request(event)
+    if request is None:
         logging.info(msg)
         client.publish(topic=OUTPUT_TOPIC, payload=msg)
         return None
 
-    filepath = event['filepath']
+    with pending_lock:
+        if model_error is not None:
+            drop_request(request, model_error)
+            return None
+        if not model_ready.is_set():
+            if len(pending_requests) < MAX_QUEUE_SIZE:
+                logging.info('model is still loading. queueing request for \'{}\''.format(describe(request)))
+                pending_requests.append(request)
+            else:
+                drop_request(request, 'model is still loading and too many requests are queued')
+            return None
+    return handle_request(request)
 
-    if not os.path.exists(filepath): 
-        msg = 'filepath does not exist. make sure \'{}\' exists on the device'.format(filepath)
-        logging.info(msg)
-        client.publish(topic=OUTPUT_TOPIC, payload=msg)
+
+def drop_request(request, reason):
+    msg = '{}. dropping request for \'{}\''.format(reason, describe(request))
+    logging.warning(msg)
+    client.publish(topic=OUTPUT_TOPIC, payload=msg)
+
+
+def handle_request(request):
+    """
+    Run the inference of a request, or queue it when a scheduler is running
+    """
+    metrics.count('requests')
+    if scheduler is not None:
+        if request.resolution is not None and isinstance(scheduler, InferencePipeline):
+            # The pipeline batches decoded images, which no longer know the resolution their request asked for
+            drop_request(request, 'resolution is not supported in pipeline mode')
+            return None
+        if not scheduler.submit(request):
+            metrics.count('dropped')
+            msg = 'inference queue is full. dropping request for \'{}\''.format(describe(request))
+            logging.warning(msg)
+            client.publish(topic=OUTPUT_TOPIC, payload=msg)
         return None
 
-    logging.info('predicting on image at filepath: {}'.format(filepath))
+    logging.info('predicting on image: {}'.format(describe(request)))
     start = int(round(time.time() * 1000))
-    prediction = model.predict_from_file(filepath)
+    prediction, version = predict_request(request)
     end = int(round(time.time() * 1000))
 
-    logging.info('Prediction: {} for file: {} in: {}'.format(prediction, filepath, end - start))
+    logging.info('Prediction: {} for file: {} in: {}'.format(prediction, describe(request), end - start))
+    current_model = model_holder.model
+    if current_model.cache is not None:
+        logging.info('Result cache: {}'.format(current_model.cache.stats()))
 
-    response = {
-        'prediction': prediction,
-        'timestamp': time.time(),
-        'filepath': filepath
-    }
-    client.publish(topic=OUTPUT_TOPIC, payload=json.dumps(response))
+    log_first_prediction()
+    response = build_response(prediction, request, version)
+    publish_response(response)
+    metrics.record('predict', (end - start) / 1000.0)
     return response
 
 
 # If this path exists then this code is running on the greengrass core and has the ML resources it needs to initialize.
 if os.path.exists(ML_MODEL_BASE_PATH):
-    initialize()
+    if STARTUP_MODE == 'background':
+        initialize_in_background()
+    else:
+        initialize()
 else:
     logging.info('{} does not exist and we cannot initialize this lambda function.'.format(ML_MODEL_BASE_PATH))
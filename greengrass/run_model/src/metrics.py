@@ -0,0 +1,136 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class LatencyHistogram(object):
+    """
+    Latency samples of one stage. Percentiles are computed over the most recent window samples, while the count
+    and mean cover every sample recorded.
+    """
+    def __init__(self, window=1024):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        p50, p95, p99 = np.percentile(self._samples, [50, 95, 99])
+        return {
+            'count': self.count,
+            'mean_ms': 1000 * self.total / self.count,
+            'p50_ms': 1000 * p50,
+            'p95_ms': 1000 * p95,
+            'p99_ms': 1000 * p99,
+            'max_ms': 1000 * max(self._samples)
+        }
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of per-stage latency histograms and throughput counters
+    """
+    def __init__(self, window=1024):
+        self.window = window
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._last_snapshot = (self._started, {})
+
+    @contextmanager
+    def time(self, stage):
+        """
+        Time the body of a with statement as one sample of stage
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.time() - start)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = LatencyHistogram(self.window)
+            histogram.record(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def snapshot(self):
+        """
+        :return: a dict with the latency percentiles of every stage, and for every counter its total, its average
+                 rate since the metrics were created and its rate since the previous snapshot
+        """
+        now = time.time()
+        with self._lock:
+            last_time, last_counts = self._last_snapshot
+            counters = {}
+            for name, total in self._counters.items():
+                counters[name] = {
+                    'total': total,
+                    'per_second': total / max(now - self._started, 1e-9),
+                    'recent_per_second': (total - last_counts.get(name, 0)) / max(now - last_time, 1e-9)
+                }
+            self._last_snapshot = (now, dict(self._counters))
+            return {
+                'timestamp': now,
+                'uptime_seconds': now - self._started,
+                'stages': dict((stage, histogram.summary()) for stage, histogram in self._stages.items()),
+                'counters': counters
+            }
+
+
+class MetricsPublisher(object):
+    """
+    Publishes a metrics snapshot every interval seconds on a background thread
+    """
+    def __init__(self, snapshot, publish, interval=60):
+        """
+        :param snapshot: function returning the dict to publish
+        :param publish: function called with the JSON encoded snapshot
+        """
+        self.snapshot = snapshot
+        self.publish = publish
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='MetricsPublisher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def publish_now(self):
+        snapshot = self.snapshot()
+        self.publish(json.dumps(snapshot))
+        return snapshot
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.publish_now()
+            except Exception:
+                logging.exception('Failed to publish metrics')
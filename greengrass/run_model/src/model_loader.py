@@ -2,10 +2,29 @@ import mxnet as mx
 import numpy as np
 import cv2
 import logging
+import threading
 from collections import namedtuple
-Batch = namedtuple('Batch', ['data'])
+from contextlib import contextmanager
+from preprocess import IDENTITY_TRANSFORM, InputBuffer
+from postprocess import map_boxes
+from result_cache import content_hash, perceptual_hash
+from model_watcher import checkpoint_signature
+from metrics import Metrics
+from backends import create_backend
+# An encoded image (e.g. JPEG bytes, or a memoryview of them) to run inference on without reading it from disk
+EncodedImage = namedtuple('EncodedImage', ['data'])
 
 DEFAULT_INPUT_SHAPE = 512
+# Batch sizes an executor can be bound for. Executors are bound lazily the first time a batch size is needed and
+# share their parameters with the batch size 1 module.
+BATCH_SIZES = [1, 2, 4, 8, 16]
+
+# Parsed checkpoints by (prefix, epoch), along with the modification time and size of the files they were read from.
+# Only kept while a shared_checkpoints block is open, so the parameters are not held twice once they are bound.
+_checkpoints = {}
+_checkpoints_lock = threading.Lock()
+_checkpoint_scopes = [0]
+
 
 def get_ctx():
     """
@@ -23,45 +42,286 @@ def get_ctx():
     return ctx
 
 
+@contextmanager
+def shared_checkpoints():
+    """
+    Keep the checkpoints parsed inside the block in memory, so the replicas of a model built in it parse the files
+    only once. They are released when the outermost block exits.
+    """
+    with _checkpoints_lock:
+        _checkpoint_scopes[0] += 1
+    try:
+        yield
+    finally:
+        with _checkpoints_lock:
+            _checkpoint_scopes[0] -= 1
+            if _checkpoint_scopes[0] == 0:
+                _checkpoints.clear()
+
+
+def load_checkpoint(param_path, epoch=0):
+    """
+    Load the symbol and parameters of a checkpoint. Inside a shared_checkpoints block the parsed checkpoint is reused
+    as long as the files do not change.
+    :return: a (symbol, arg_params, aux_params) tuple as returned by mx.model.load_checkpoint
+    """
+    signature = checkpoint_signature(param_path, epoch)
+    if signature is None or not _checkpoint_scopes[0]:
+        # Outside of a block, or to let MXNet report the missing file
+        return mx.model.load_checkpoint(param_path, epoch)
+
+    with _checkpoints_lock:
+        cached = _checkpoints.get((param_path, epoch))
+        if cached is not None and cached[0] == signature:
+            logging.info('Using already loaded checkpoint {}'.format(param_path))
+            return cached[1]
+        checkpoint = mx.model.load_checkpoint(param_path, epoch)
+        _checkpoints[(param_path, epoch)] = (signature, checkpoint)
+        return checkpoint
+
+
+def read_file(filepath):
+    """
+    :return: the raw bytes of the file, or None if it could not be read
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def decode_image(data):
+    """
+    Decode an encoded image (e.g. JPEG bytes) held in memory. The bytes are wrapped, not copied, so data can also be
+    a memoryview of a larger buffer such as a memory-mapped file.
+    :return: the decoded image in BGR channel order, or None if it could not be decoded
+    """
+    if data is None or len(data) == 0:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
 class MLModel(object):
     """
     Loads the pre-trained model which can be found in /ml/od when running on greengrass core or
     from a different path for testing locally.
     """
-    def __init__(self, param_path, label_names=[], input_shapes=[('data', (1, 3, DEFAULT_INPUT_SHAPE, DEFAULT_INPUT_SHAPE))]):
+    def __init__(self, param_path, label_names=[], input_shapes=[('data', (1, 3, DEFAULT_INPUT_SHAPE, DEFAULT_INPUT_SHAPE))],
+                 batch_sizes=BATCH_SIZES, context=None, cache=None, postprocessor=None, metrics=None, quantizer=None,
+                 resolutions=None, letterbox=False, backend='module', backend_options=None):
+        """
+        :param cache: optional ResultCache. Images whose content is already in the cache are answered from it
+                      without running the forward pass.
+        :param postprocessor: optional function turning the (N, 6) detections of one image into the list of
+                              detections to return, e.g. a DetectionPostprocessor. By default only the top
+                              detection is returned.
+        :param metrics: Metrics to record the time spent in each inference stage in
+        :param quantizer: optional function converting the checkpoint to reduced precision before it is bound,
+                          e.g. an Int8Quantizer. Called with the symbol, arg_params, aux_params, the input name,
+                          the (channels, height, width) input shape and the label names.
+        :param resolutions: other square input sizes requests may ask for besides the one in input_shapes, e.g.
+                            [300, 384] to trade accuracy for speed. Executors for them are bound lazily and share
+                            the parameters of the default one.
+        :param letterbox: keep the aspect ratio of images by padding them to the input size instead of stretching
+                          them. Boxes are still returned in normalized coordinates of the original image.
+        :param backend: engine running the network, 'module' (mx.mod.Module), 'gluon' (hybridized SymbolBlock) or
+                        'onnx' (ONNX Runtime). See backends.py.
+        :param backend_options: extra keyword arguments for the backend
+        """
 
-        context = get_ctx()[0]
+        if context is None:
+            context = get_ctx()[0]
         # Load the network parameters from default epoch 0
         logging.info('Load network parameters from default epoch 0 with prefix: {}'.format(param_path))
-        sym, arg_params, aux_params = mx.model.load_checkpoint(param_path, 0)
+        sym, arg_params, aux_params = load_checkpoint(param_path, 0)
+        if quantizer is not None:
+            data_name, data_shape = input_shapes[0]
+            sym, arg_params, aux_params = quantizer(sym, arg_params, aux_params, data_name, tuple(data_shape[1:]),
+                                                    label_names)
+
+        # Load the network into the backend and bind the corresponding parameters
+        logging.info('Loading network into {} backend and binding corresponding parameters: {}'.format(
+            backend, arg_params))
+        self.data_name, data_shape = input_shapes[0]
+        self.backend = create_backend(backend, sym, arg_params, aux_params, context, self.data_name, data_shape,
+                                      label_names, **(backend_options or {}))
+
+        self.sym = sym
+        self.label_names = label_names
+        self.context = context
+        self.input_shape = tuple(data_shape[1:])
+        self.batch_sizes = sorted(set(batch_sizes) | set([data_shape[0]]))
+        # Input sizes are (width, height) tuples, as cv2.resize takes them
+        self.resolution = (data_shape[3], data_shape[2])
+        self.resolutions = sorted(set([self.resolution] + [(size, size) for size in resolutions or []]))
+        self.letterbox = letterbox
+        self._buffers = {}
+        # The input buffers and executors are shared by every thread using the model: the stream runner, the
+        # scheduler and sync requests. Only one batch at a time may fill, run and read them.
+        self._lock = threading.Lock()
+        self.cache = cache
+        self.postprocessor = postprocessor
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def close(self):
+        """
+        Release what the backend holds outside of memory, e.g. the models exported by the ONNX backend
+        """
+        self.backend.close()
+
+    def get_module(self, batch_size, reshape=None):
+        """
+        Get what the backend runs for the given batch size and input size (a bound module for the Module backend),
+        binding a new executor that shares parameters with the default one if one does not exist yet
+        :param batch_size: number of images the executor takes in a single forward pass
+        :param reshape: (width, height) of the input. Defaults to the size in input_shapes.
+        :return: the bound module
+        """
+        reshape = reshape or self.resolution
+        return self.backend.get_module((batch_size, self.input_shape[0], reshape[1], reshape[0]))
+
+    def warm_up(self, batch_sizes=(1,), resolutions=None):
+        """
+        Run a forward pass on a blank batch for each batch size and resolution, so executors and input buffers are
+        allocated and MXNet has done its lazy initialization before the first real request
+        :param resolutions: input sizes to warm up. Defaults to the size in input_shapes.
+        """
+        for reshape in [self.get_resolution(size) for size in resolutions or [None]]:
+            blank = np.zeros((reshape[1], reshape[0], 3), dtype=np.uint8)
+            for batch_size in batch_sizes:
+                self._predict_images([blank] * batch_size, reshape)
+
+    def get_resolution(self, resolution=None):
+        """
+        :param resolution: a square input size, a (width, height) tuple or None for the default size
+        :return: the (width, height) of the input
+        """
+        if resolution is None:
+            return self.resolution
+        reshape = tuple(resolution) if isinstance(resolution, (tuple, list)) else (int(resolution), int(resolution))
+        if reshape not in self.resolutions:
+            raise ValueError('input resolution {} is not one of {}'.format(resolution, self.resolutions))
+        return reshape
 
-        # Load the network into an MXNet module and bind the corresponding parameters
-        logging.info('Loading network into mxnet module and binding corresponding parameters: {}'.format(arg_params))
-        self.mod = mx.mod.Module(symbol=sym, label_names=label_names, context=context)
-        self.mod.bind(for_training=False, data_shapes=input_shapes)
-        self.mod.set_params(arg_params, aux_params)
+    def choose_batch_size(self, num_images):
+        """
+        Pick the smallest bound batch size that fits all images, or the largest one if none does
+        """
+        for batch_size in self.batch_sizes:
+            if batch_size >= num_images:
+                return batch_size
+        return self.batch_sizes[-1]
 
     """
     Takes in an image, reshapes it, and runs it through the loaded MXNet graph for inference returning the top label from the softmax
     """
-    def predict_from_file(self, filepath, reshape=(DEFAULT_INPUT_SHAPE, DEFAULT_INPUT_SHAPE)):
-        # Switch RGB to BGR format (which ImageNet networks take)
-        img = cv2.cvtColor(cv2.imread(filepath), cv2.COLOR_BGR2RGB)
-        if img is None:
-            return []
-
-        # Resize image to fit network input
-        img = cv2.resize(img, reshape)
-        img = np.swapaxes(img, 0, 2)
-        img = np.swapaxes(img, 1, 2)
-        img = img[np.newaxis, :]
-
-        self.mod.forward(Batch([mx.nd.array(img)]))
-        prob = self.mod.get_outputs()[0].asnumpy()
-        prob = np.squeeze(prob)
-
-        # Grab top result, convert to python list of lists and return
-        results = [prob[0].tolist()]
+    def predict_from_file(self, filepath, reshape=None):
+        return self._predict([filepath], self.get_resolution(reshape))[0]
+
+    def predict_from_bytes(self, data, resolution=None):
+        """
+        Same as predict_from_file, for an encoded image held in memory
+        :param data: the encoded image as bytes, bytearray or memoryview
+        """
+        return self.predict_batch([EncodedImage(data)], resolution)[0]
+
+    def predict_batch(self, filepaths_or_arrays, resolution=None):
+        """
+        Run inference on several images, packing them into as few forward passes as the bound batch sizes allow
+        :param filepaths_or_arrays: list of image file paths, EncodedImage or already decoded BGR images (as returned
+                                    by cv2.imread, so None stands for an image that could not be decoded)
+        :param resolution: input size to run at, one of resolutions. Defaults to the size in input_shapes.
+        :return: a list with one result per input image, in the same format predict_from_file returns. Images that
+                 could not be read get an empty list.
+        """
+        return self._predict(filepaths_or_arrays, self.get_resolution(resolution))
+
+    def _load(self, item):
+        """
+        :return: the decoded image and, when caching, its content and perceptual hashes
+        """
+        if item is None or isinstance(item, np.ndarray):
+            image = data = item
+        elif isinstance(item, EncodedImage):
+            data = item.data
+            with self.metrics.time('decode'):
+                image = decode_image(data)
+        else:
+            # Read and decode separately so both can be timed. The cache hashes the encoded bytes, which is cheaper
+            # than hashing the decoded image.
+            with self.metrics.time('read'):
+                data = read_file(item)
+            with self.metrics.time('decode'):
+                image = decode_image(data)
+        if self.cache is None or image is None:
+            return image, None, None
+        phash = perceptual_hash(image) if self.cache.perceptual else None
+        return image, content_hash(data), phash
+
+    def _predict(self, items, reshape):
+        results = [[] for _ in items]
+        pending = []
+        for i, item in enumerate(items):
+            image, key, phash = self._load(item)
+            if image is None:
+                continue
+            if key is not None:
+                # The same image gives different results at different input sizes
+                key = (key, reshape)
+                cached = self.cache.get(key, phash)
+                if cached is not None:
+                    results[i] = cached
+                    continue
+            pending.append((i, image, key, phash))
+
+        if pending:
+            predictions = self._predict_images([image for _, image, _, _ in pending], reshape)
+            for (i, _, key, phash), prediction in zip(pending, predictions):
+                results[i] = prediction
+                if key is not None:
+                    self.cache.put(key, prediction, phash)
         return results
 
+    def get_input_buffer(self, batch_size, reshape):
+        """
+        Get the preallocated host input array for a batch shape, allocating it on first use. The backends keep the
+        matching device arrays.
+        :return: an InputBuffer
+        """
+        key = (batch_size, reshape)
+        host = self._buffers.get(key)
+        if host is None:
+            host = self._buffers[key] = InputBuffer(batch_size, reshape[1], reshape[0])
+        return host
+
+    def _predict_images(self, images, reshape):
+        results = []
+        start = 0
+        while start < len(images):
+            batch_size = self.choose_batch_size(len(images) - start)
+            chunk = images[start:start + batch_size]
+            with self._lock:
+                # Slots past the end of the last chunk keep whatever they held before; their outputs are ignored
+                host = self.get_input_buffer(batch_size, reshape)
+                with self.metrics.time('resize'):
+                    transforms = [host.fill(i, img, self.letterbox) for i, img in enumerate(chunk)]
 
+                with self.metrics.time('forward'):
+                    output = self.backend.forward(host.data)
+                with self.metrics.time('output_copy'):
+                    prob = self.backend.fetch(output)
+
+            with self.metrics.time('postprocess'):
+                for i, transform in enumerate(transforms):
+                    if transform != IDENTITY_TRANSFORM:
+                        map_boxes(prob[i], transform)
+                if self.postprocessor is not None:
+                    results.extend(self.postprocessor(prob[i]) for i in range(len(chunk)))
+                else:
+                    # Grab top result for each image, convert to python list of lists
+                    results.extend([prob[i][0].tolist()] for i in range(len(chunk)))
+            self.metrics.count('images', len(chunk))
+            self.metrics.count('forward_passes')
+            start += len(chunk)
+        return results
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mxnet as mx
+from model_loader import MLModel, get_ctx, shared_checkpoints
+
+
+class _Replica(object):
+    """
+    One MLModel bound to a single context, only ever used from its own single-threaded executor
+    """
+    def __init__(self, index, model, context, lock):
+        self.index = index
+        self.model = model
+        self.context = context
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.in_flight = 0
+        self.requests = 0
+        self.busy_seconds = 0.0
+        self._lock = lock
+
+    def run(self, method, args):
+        start = time.time()
+        try:
+            return getattr(self.model, method)(*args)
+        finally:
+            # Done before the result is set, so callers never see a finished request still in flight
+            with self._lock:
+                self.busy_seconds += time.time() - start
+                self.in_flight -= 1
+
+
+class MLModelPool(object):
+    """
+    Keeps one MLModel replica per inference context and dispatches every request to the replica with the fewest
+    requests in flight. Offers the same predict_from_file, predict_from_bytes and predict_batch methods as MLModel,
+    so it can be used in its place; with a single CPU context it behaves exactly like one MLModel.
+    """
+    def __init__(self, param_path, contexts=None, num_cpu_replicas=None, **model_kwargs):
+        """
+        :param param_path: checkpoint prefix passed to every MLModel replica
+        :param contexts: contexts to bind a replica on. Defaults to every context returned by get_ctx().
+        :param num_cpu_replicas: number of replicas to run when only the CPU is available. Each one runs on its own
+                                 thread, so it is worth limiting OMP_NUM_THREADS to the cores per replica.
+        :param model_kwargs: extra arguments for each MLModel
+        """
+        if contexts is None:
+            contexts = get_ctx()
+            if num_cpu_replicas and contexts[0].device_type == 'cpu':
+                contexts = [mx.cpu(i) for i in range(num_cpu_replicas)]
+        self.cache = model_kwargs.get('cache')
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.replicas = []
+        # Parse the checkpoint once for all replicas
+        with shared_checkpoints():
+            for i, context in enumerate(contexts):
+                logging.info('Loading model replica {} on {}'.format(i, context))
+                self.replicas.append(_Replica(i, MLModel(param_path, context=context, **model_kwargs), context,
+                                              self._lock))
+
+    def submit(self, method, *args):
+        """
+        Run an MLModel method on the least loaded replica
+        :param method: name of the MLModel method to call
+        :return: a future for the result of the call
+        """
+        with self._lock:
+            replica = min(self.replicas, key=lambda r: (r.in_flight, r.requests))
+            replica.in_flight += 1
+            replica.requests += 1
+        return replica.executor.submit(replica.run, method, args)
+
+    def predict_from_file(self, filepath, *args):
+        return self.submit('predict_from_file', filepath, *args).result()
+
+    def predict_from_bytes(self, data, *args):
+        return self.submit('predict_from_bytes', data, *args).result()
+
+    def predict_batch(self, filepaths_or_arrays, *args):
+        """
+        Split a batch across the replicas and run the shards in parallel
+        :return: one result per input image, in the same order as the input
+        """
+        items = list(filepaths_or_arrays)
+        num_shards = min(len(self.replicas), len(items))
+        if num_shards <= 1:
+            return self.submit('predict_batch', items, *args).result()
+        shard_size = (len(items) + num_shards - 1) // num_shards
+        futures = [self.submit('predict_batch', items[i:i + shard_size], *args)
+                   for i in range(0, len(items), shard_size)]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def warm_up(self, batch_sizes=(1,), resolutions=None):
+        """
+        Warm up every replica in parallel
+        """
+        futures = [replica.executor.submit(replica.model.warm_up, batch_sizes, resolutions)
+                   for replica in self.replicas]
+        for future in futures:
+            future.result()
+
+    def utilization(self):
+        """
+        :return: a list with a dict per replica containing its context, the requests it has in flight and served so
+                 far, and the fraction of time since the pool was created it has spent running inference
+        """
+        elapsed = max(time.time() - self._started, 1e-9)
+        with self._lock:
+            return [{
+                'replica': replica.index,
+                'context': str(replica.context),
+                'in_flight': replica.in_flight,
+                'requests': replica.requests,
+                'busy_seconds': replica.busy_seconds,
+                'utilization': replica.busy_seconds / elapsed
+            } for replica in self.replicas]
+
+    def close(self):
+        for replica in self.replicas:
+            replica.executor.shutdown(wait=True)
+            replica.model.close()
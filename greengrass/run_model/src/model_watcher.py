@@ -0,0 +1,174 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def checkpoint_files(param_path, epoch=0):
+    return ['{}-symbol.json'.format(param_path), '{}-{:04d}.params'.format(param_path, epoch)]
+
+
+def checkpoint_signature(param_path, epoch=0):
+    """
+    :return: the modification time and size of each checkpoint file, or None if any of them does not exist
+    """
+    try:
+        return tuple((os.path.getmtime(f), os.path.getsize(f)) for f in checkpoint_files(param_path, epoch))
+    except OSError:
+        return None
+
+
+def checkpoint_version(param_path, epoch=0):
+    """
+    :return: a string identifying the checkpoint currently on disk, or None if it does not exist
+    """
+    signature = checkpoint_signature(param_path, epoch)
+    if signature is None:
+        return None
+    mtime, size = signature[-1]
+    return '{}-{}'.format(int(mtime), size)
+
+
+class ModelHolder(object):
+    """
+    Holds the model serving requests and counts the requests in flight on each model, so a new model can be swapped
+    in while the requests already running on the old one finish
+    """
+    def __init__(self):
+        self.model = None
+        self.version = None
+        self._in_flight = {}
+        # Previous models to close once their last request finishes, by id
+        self._closing = {}
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Use the current model for the duration of a request
+        :return: a context manager yielding the model and its version
+        """
+        with self._condition:
+            model, version = self.model, self.version
+            self._in_flight[id(model)] = self._in_flight.get(id(model), 0) + 1
+        try:
+            yield model, version
+        finally:
+            with self._condition:
+                self._in_flight[id(model)] -= 1
+                closing = None
+                if not self._in_flight[id(model)]:
+                    del self._in_flight[id(model)]
+                    closing = self._closing.pop(id(model), None)
+                self._condition.notify_all()
+            if closing is not None:
+                self._close(closing)
+
+    def swap(self, model, version, drain_timeout=None):
+        """
+        Make model serve every new request, then wait for the requests in flight on the previous model to finish
+        :param drain_timeout: maximum seconds to wait for the previous model to drain. None waits until it does.
+        :return: the previous model, or None if there was none, and whether its requests have all finished
+        """
+        with self._condition:
+            old = self.model
+            self.model, self.version = model, version
+            drained = True
+            if old is not None and old is not model:
+                drained = self._wait_for(lambda: id(old) not in self._in_flight, drain_timeout)
+                if not drained:
+                    logging.warning('{} requests still running on the previous model after {} seconds'.format(
+                        self._in_flight.get(id(old)), drain_timeout))
+            return old, drained
+
+    def close_when_drained(self, model):
+        """
+        Close model now if no request is running on it, otherwise once the last of them finishes
+        """
+        with self._condition:
+            if id(model) in self._in_flight:
+                self._closing[id(model)] = model
+                return
+        self._close(model)
+
+    def in_flight(self):
+        with self._condition:
+            return sum(self._in_flight.values())
+
+    @staticmethod
+    def _close(model):
+        try:
+            model.close()
+        except Exception:
+            logging.exception('Failed to close the previous model')
+
+    def _wait_for(self, predicate, timeout):
+        # Condition.wait_for is not available on python 2
+        if timeout is None:
+            while not predicate():
+                self._condition.wait()
+            return True
+        deadline = time.time() + timeout
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._condition.wait(remaining)
+        return True
+
+
+class ModelWatcher(object):
+    """
+    Polls the checkpoint files and calls on_change with the new version when they change. A change is only
+    reported once the files look the same on two consecutive polls, so a model still being extracted is not loaded.
+    """
+    def __init__(self, param_path, on_change, interval=30, epoch=0):
+        self.param_path = param_path
+        self.on_change = on_change
+        self.interval = interval
+        self.epoch = epoch
+        self.version = checkpoint_version(param_path, epoch)
+        self._candidate = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='ModelWatcher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def check(self):
+        """
+        Poll the checkpoint once
+        :return: True if a new checkpoint was reported to on_change
+        """
+        version = checkpoint_version(self.param_path, self.epoch)
+        if version is None or version == self.version:
+            self._candidate = None
+            return False
+        if version != self._candidate:
+            self._candidate = version
+            return False
+
+        logging.info('Found new model version {} at {}'.format(version, self.param_path))
+        # Remember the version even if loading it fails, so a broken checkpoint is not retried on every poll
+        self.version = version
+        self._candidate = None
+        try:
+            self.on_change(version)
+        except Exception:
+            logging.exception('Failed to load model version {}'.format(version))
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
@@ -0,0 +1,100 @@
+import threading
+
+import cv2
+import numpy as np
+
+GATE_METHODS = ['diff', 'mog2']
+
+
+class MotionGate(object):
+    """
+    Cheap check run before inference on a downscaled grayscale copy of each frame, telling whether the scene changed
+    enough since the last inferred frame to be worth a forward pass. When it did not, the caller reuses the last
+    result it stored with remember(). The 'diff' method compares the frame with the last inferred one, so slow
+    changes still add up to a new inference; 'mog2' uses a background subtractor that adapts to lighting changes.
+    """
+    def __init__(self, method='diff', threshold=0.01, pixel_threshold=25, max_skip_frames=30, width=160,
+                 history=100):
+        """
+        :param method: 'diff' or 'mog2'
+        :param threshold: fraction of the pixels that must change for the frame to be inferred
+        :param pixel_threshold: difference in gray level (or MOG2 variance threshold) for a pixel to count as changed
+        :param max_skip_frames: run inference after this many skipped frames in a row even if nothing changed, so
+                                results never get too old. None never forces it.
+        :param width: width the frame is downscaled to before comparing, keeping the aspect ratio
+        :param history: number of frames the MOG2 background model is built from
+        """
+        if method not in GATE_METHODS:
+            raise ValueError('unknown motion gate method {}. expected one of {}'.format(method, GATE_METHODS))
+        self.method = method
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.max_skip_frames = max_skip_frames
+        self.width = width
+        self.last_result = None
+        self._reference = None
+        self._subtractor = None
+        if method == 'mog2':
+            self._subtractor = cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=pixel_threshold,
+                                                                  detectShadows=False)
+        self._lock = threading.Lock()
+        self._frames = 0
+        self._skipped = 0
+        self._skipped_in_a_row = 0
+        self._last_score = 0.0
+
+    def should_infer(self, image):
+        """
+        :param image: decoded BGR (or grayscale) frame
+        :return: True if the frame should go through the model, False if last_result still describes it
+        """
+        small = self._downscale(image)
+        with self._lock:
+            self._frames += 1
+            self._last_score = self._change_score(small)
+            forced = self.max_skip_frames is not None and self._skipped_in_a_row >= self.max_skip_frames
+            if self.last_result is None or forced or self._last_score >= self.threshold:
+                self._reference = small
+                self._skipped_in_a_row = 0
+                return True
+            self._skipped += 1
+            self._skipped_in_a_row += 1
+            return False
+
+    def remember(self, result):
+        """
+        Store the result of the frame should_infer last let through, to be reused for the unchanged frames after it
+        """
+        self.last_result = result
+
+    def stats(self):
+        """
+        :return: a dict with the number of frames checked and skipped, the skip rate and the change score of the last
+                 frame (the fraction of its pixels that changed)
+        """
+        with self._lock:
+            return {
+                'frames': self._frames,
+                'skipped': self._skipped,
+                'inferred': self._frames - self._skipped,
+                'skip_rate': float(self._skipped) / self._frames if self._frames else 0.0,
+                'last_change_score': self._last_score
+            }
+
+    def _downscale(self, image):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        height = max(1, int(round(image.shape[0] * self.width / float(image.shape[1]))))
+        small = cv2.resize(image, (self.width, height), interpolation=cv2.INTER_AREA)
+        # Blur away sensor noise and compression artifacts so they do not count as motion
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def _change_score(self, small):
+        if self._subtractor is not None:
+            # The background model has to see every frame, skipped or not
+            mask = self._subtractor.apply(small)
+            return np.count_nonzero(mask) / float(mask.size)
+        if self._reference is None or self._reference.shape != small.shape:
+            return 1.0
+        changed = cv2.absdiff(small, self._reference) > self.pixel_threshold
+        return np.count_nonzero(changed) / float(changed.size)
@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from postprocess import box_iou
+
+
+def detections_changed(previous, current, min_iou=0.8, max_score_delta=None):
+    """
+    Compare the detections of two frames of the same source
+    :param previous: list of [class, score, xmin, ymin, xmax, ymax] rows, or None if there is no previous frame
+    :param min_iou: a box that moved so that it overlaps its previous position by less than this counts as a change
+    :param max_score_delta: a score that moved by more than this counts as a change. None ignores scores.
+    :return: True if the number of detections, their classes or their boxes changed
+    """
+    if previous is None or len(previous) != len(current):
+        return True
+    if not current:
+        return False
+    previous = np.asarray(previous, dtype=np.float32).reshape(-1, 6)
+    current = np.asarray(current, dtype=np.float32).reshape(-1, 6)
+    for cls in np.unique(previous[:, 0]):
+        previous_boxes = previous[previous[:, 0] == cls]
+        current_boxes = current[current[:, 0] == cls]
+        if len(previous_boxes) != len(current_boxes):
+            return True
+        # Greedily match the pair of boxes of this class that overlap the most, until every box is matched
+        iou = box_iou(previous_boxes[:, 2:], current_boxes[:, 2:])
+        for _ in range(len(previous_boxes)):
+            i, j = np.unravel_index(np.argmax(iou), iou.shape)
+            if iou[i, j] < min_iou:
+                return True
+            if max_score_delta is not None and abs(previous_boxes[i, 1] - current_boxes[j, 1]) > max_score_delta:
+                return True
+            iou[i, :] = -1
+            iou[:, j] = -1
+    return False
+
+class OutputAggregator(object):
+    """
+    Coalesces responses into batches published together, once max_count responses are waiting or the oldest of them
+    has waited max_delay_ms. With changes_only, a response is dropped when its detections are the same as the last
+    response of the same source.
+    """
+    def __init__(self, publish, max_count=50, max_delay_ms=1000, changes_only=False, min_iou=0.8,
+                 max_score_delta=None):
+        """
+        :param publish: function called with a list of responses, on the thread adding the response that fills the
+                        batch or on the aggregator thread when the delay expires. Batches are published one at a
+                        time, in the order they were taken.
+        :param changes_only: only keep the responses whose detections changed since the last kept response of their
+                             source, as told by detections_changed with min_iou and max_score_delta
+        """
+        self.publish = publish
+        self.max_count = max_count
+        self.max_delay = max_delay_ms / 1000.0
+        self.changes_only = changes_only
+        self.min_iou = min_iou
+        self.max_score_delta = max_score_delta
+        self._pending = []
+        self._oldest = None
+        self._kept_detections = {}
+        self._condition = threading.Condition()
+        # Held from taking a batch until it is published, so batches taken on different threads stay in order
+        self._publish_lock = threading.Lock()
+        self._stopped = False
+        self._thread = None
+        self._added = 0
+        self._unchanged = 0
+        self._batches = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='OutputAggregator')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """
+        Publish the responses still waiting and stop the aggregator thread
+        """
+        if self._thread is not None:
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def add(self, response):
+        """
+        :return: False if the response was dropped because its detections did not change, True otherwise
+        """
+        with self._condition:
+            self._added += 1
+            if self.changes_only:
+                source = response.get('source')
+                # Compared with the last detections kept rather than the last seen, so slow drift still adds up
+                if not detections_changed(self._kept_detections.get(source), response['prediction'], self.min_iou,
+                                          self.max_score_delta):
+                    self._unchanged += 1
+                    return False
+                self._kept_detections[source] = response['prediction']
+            if not self._pending:
+                self._oldest = time.time()
+                self._condition.notify_all()
+            self._pending.append(response)
+            full = len(self._pending) >= self.max_count
+        if full:
+            self.flush()
+        return True
+
+    def flush(self):
+        with self._publish_lock:
+            with self._condition:
+                batch = self._take()
+            if batch:
+                self._publish(batch)
+
+    def metrics(self):
+        """
+        :return: a dict with the number of responses added, dropped as unchanged and waiting, and of batches published
+        """
+        with self._condition:
+            return {
+                'added': self._added,
+                'unchanged': self._unchanged,
+                'pending': len(self._pending),
+                'batches': self._batches
+            }
+
+    def _take(self):
+        batch, self._pending = self._pending, []
+        self._oldest = None
+        if batch:
+            self._batches += 1
+        return batch
+
+    def _publish(self, batch):
+        try:
+            self.publish(batch)
+        except Exception:
+            logging.exception('Failed to publish a batch of {} responses'.format(len(batch)))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (self._oldest is None or time.time() - self._oldest < self.max_delay):
+                    timeout = None if self._oldest is None else self._oldest + self.max_delay - time.time()
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+            self.flush()
@@ -0,0 +1,174 @@
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+_STOP = object()
+
+
+class InferencePipeline(object):
+    """
+    Runs requests through decode, inference and publish stages on separate threads joined by bounded queues, so
+    decoding the next frames overlaps with the forward pass of the current one. Every queue is bounded: when the
+    publisher falls behind, the inference worker blocks on its output queue, then the decoders block, and finally
+    submit blocks and rejects new requests after submit_timeout.
+    """
+    def __init__(self, decode, infer, publish, decode_workers=2, queue_size=8, max_batch_size=1, submit_timeout=None,
+                 on_error=None):
+        """
+        :param decode: function run on the decode thread pool, turning a request into the input of infer
+        :param infer: function run on the single inference thread with a list of decoded inputs, returning one
+                      result per input
+        :param publish: function run on the publish thread with each request and its result
+        :param decode_workers: number of decode threads
+        :param queue_size: capacity of each queue between the stages
+        :param max_batch_size: maximum number of decoded inputs handed to infer at once
+        :param submit_timeout: seconds submit waits for room in the input queue. None waits forever.
+        :param on_error: function run on the publish thread with each request of a batch infer failed on and the
+                         exception, so the request is still answered
+        """
+        self.decode = decode
+        self.infer = infer
+        self.publish = publish
+        self.decode_workers = decode_workers
+        self.max_batch_size = max_batch_size
+        self.submit_timeout = submit_timeout
+        self.on_error = on_error
+        self._input_queue = queue.Queue(maxsize=queue_size)
+        self._infer_queue = queue.Queue(maxsize=queue_size)
+        self._publish_queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running_decoders = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._published = 0
+        self._failed = 0
+
+    def start(self):
+        if self._threads:
+            return
+        self._running_decoders = self.decode_workers
+        for i in range(self.decode_workers):
+            self._threads.append(threading.Thread(target=self._decode_loop, name='PipelineDecode-{}'.format(i)))
+        self._threads.append(threading.Thread(target=self._infer_loop, name='PipelineInfer'))
+        self._threads.append(threading.Thread(target=self._publish_loop, name='PipelinePublish'))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """
+        Finish every request already submitted and stop all stage threads
+        """
+        if not self._threads:
+            return
+        for _ in range(self.decode_workers):
+            self._input_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, item):
+        """
+        Queue a request at the decode stage, waiting up to submit_timeout for room in the queue
+        :return: False if the pipeline is full and the request was rejected, True otherwise
+        """
+        try:
+            self._input_queue.put(item, timeout=self.submit_timeout)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+        with self._lock:
+            self._submitted += 1
+        return True
+
+    def metrics(self):
+        """
+        :return: a dict with the depth of each queue and the number of requests submitted, rejected, published and
+                 failed in inference
+        """
+        with self._lock:
+            return {
+                'decode_queue_depth': self._input_queue.qsize(),
+                'infer_queue_depth': self._infer_queue.qsize(),
+                'publish_queue_depth': self._publish_queue.qsize(),
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'published': self._published,
+                'failed': self._failed
+            }
+
+    def _decode_loop(self):
+        while True:
+            item = self._input_queue.get()
+            if item is _STOP:
+                break
+            try:
+                decoded = self.decode(item)
+            except Exception:
+                logging.exception('Failed to decode {}'.format(item))
+                decoded = None
+            self._infer_queue.put((item, decoded))
+
+        # The last decoder to exit passes the stop signal on once everything it decoded is queued
+        with self._lock:
+            self._running_decoders -= 1
+            last = self._running_decoders == 0
+        if last:
+            self._infer_queue.put(_STOP)
+
+    def _infer_loop(self):
+        stopping = False
+        while not stopping:
+            first = self._infer_queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._infer_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                results = self.infer([decoded for _, decoded in batch])
+            except Exception as e:
+                logging.exception('Failed to run inference on a batch of {}'.format(len(batch)))
+                for item, _ in batch:
+                    self._publish_queue.put((item, None, e))
+                continue
+            for (item, _), result in zip(batch, results):
+                self._publish_queue.put((item, result, None))
+        self._publish_queue.put(_STOP)
+
+    def _publish_loop(self):
+        while True:
+            entry = self._publish_queue.get()
+            if entry is _STOP:
+                return
+            item, result, error = entry
+            if error is not None:
+                with self._lock:
+                    self._failed += 1
+                if self.on_error is None:
+                    continue
+                try:
+                    self.on_error(item, error)
+                except Exception:
+                    logging.exception('Failed to report inference failure for {}'.format(item))
+                continue
+            try:
+                self.publish(item, result)
+            except Exception:
+                logging.exception('Failed to publish result for {}'.format(item))
+            with self._lock:
+                self._published += 1
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Pairwise intersection over union of two sets of [xmin, ymin, xmax, ymax] boxes
+    :return: (len(boxes_a), len(boxes_b)) array
+    """
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-12), 0.0)
+
+
+def nms_keep(detections, nms_threshold):
+    """
+    Class-aware non-maximum suppression computed in one pass over the IoU matrix ("Fast NMS"): a detection is dropped
+    when it overlaps a higher scoring detection of the same class by more than nms_threshold. Unlike greedy NMS a
+    detection can be suppressed by one that was itself suppressed, which may drop a few more boxes in dense scenes.
+    :param detections: (N, 6) array sorted by descending score
+    :return: boolean mask of the detections to keep
+    """
+    if len(detections) == 0:
+        return np.zeros(0, dtype=bool)
+    iou = box_iou(detections[:, 2:], detections[:, 2:])
+    same_class = detections[:, 0][:, None] == detections[:, 0][None, :]
+    # Row i holds the overlap of detection i with every lower scoring detection after it
+    overlap = np.triu(np.where(same_class, iou, 0.0), k=1)
+    return overlap.max(axis=0) <= nms_threshold
+
+
+def map_boxes(detections, transform):
+    """
+    Map the boxes of detections made on a letterboxed input back to normalized coordinates of the original image, in
+    place. Boxes reaching into the padding are clipped to the image.
+    :param detections: (N, 6) array of [class, score, xmin, ymin, xmax, ymax] rows. Padding rows (class -1) are left
+                       untouched.
+    :param transform: (offset_x, offset_y, scale_x, scale_y) as returned by InputBuffer.fill
+    :return: detections
+    """
+    offset_x, offset_y, scale_x, scale_y = transform
+    valid = detections[:, 0] >= 0
+    boxes = detections[valid, 2:]
+    boxes -= (offset_x, offset_y, offset_x, offset_y)
+    boxes *= (scale_x, scale_y, scale_x, scale_y)
+    detections[valid, 2:] = np.clip(boxes, 0.0, 1.0)
+    return detections
+
+
+def filter_detections(detections, threshold=0.5, class_thresholds=None, nms_threshold=None, top_k=None):
+    """
+    Turn the raw SSD output of one image into the detections worth reporting
+    :param detections: (N, 6) array of [class, score, xmin, ymin, xmax, ymax] rows, padded with class -1 rows
+    :param threshold: minimum score for a detection to be kept
+    :param class_thresholds: optional dict of class id to minimum score, overriding threshold for those classes
+    :param nms_threshold: IoU above which the lower scoring of two detections of the same class is dropped.
+                          None skips NMS.
+    :param top_k: maximum number of detections to return. None returns all of them.
+    :return: (M, 6) array of the kept detections sorted by descending score
+    """
+    detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+    detections = detections[detections[:, 0] >= 0]
+    class_ids = detections[:, 0].astype(np.int64)
+
+    min_scores = np.full(len(detections), threshold, dtype=np.float32)
+    if class_thresholds and len(detections):
+        lookup = np.full(class_ids.max() + 1, threshold, dtype=np.float32)
+        for class_id, class_threshold in class_thresholds.items():
+            if int(class_id) < len(lookup):
+                lookup[int(class_id)] = class_threshold
+        min_scores = lookup[class_ids]
+    detections = detections[detections[:, 1] >= min_scores]
+
+    detections = detections[np.argsort(-detections[:, 1], kind='mergesort')]
+    if nms_threshold is not None:
+        detections = detections[nms_keep(detections, nms_threshold)]
+    if top_k is not None:
+        detections = detections[:top_k]
+    return detections
+
+
+class DetectionPostprocessor(object):
+    """
+    Callable that keeps every detection passing filter_detections with a fixed configuration, returning them as
+    python lists of lists in the same row format MLModel returns
+    """
+    def __init__(self, threshold=0.5, class_thresholds=None, nms_threshold=None, top_k=None):
+        self.threshold = threshold
+        self.class_thresholds = class_thresholds
+        self.nms_threshold = nms_threshold
+        self.top_k = top_k
+
+    def __call__(self, detections):
+        return filter_detections(detections, self.threshold, self.class_thresholds, self.nms_threshold,
+                                 self.top_k).tolist()
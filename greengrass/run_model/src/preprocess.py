@@ -0,0 +1,58 @@
+import numpy as np
+import cv2
+
+# Gray level of the padding around letterboxed images
+LETTERBOX_FILL = 127
+# Transform of an image that fills the whole network input, see InputBuffer.fill
+IDENTITY_TRANSFORM = (0.0, 0.0, 1.0, 1.0)
+
+
+class InputBuffer(object):
+    """
+    Preallocated, contiguous NCHW float32 buffer for one bound batch shape. Decoded images are resized into a reused
+    scratch image and written into their slot of the buffer in a single pass, so filling a batch does not allocate.
+    """
+    def __init__(self, batch_size, height, width):
+        self.data = np.zeros((batch_size, 3, height, width), dtype=np.float32)
+        # Letterboxed images are resized into the first new_height * new_width pixels of the same scratch memory,
+        # which keeps the resize destination contiguous whatever its shape
+        self._scratch = np.empty(height * width * 3, dtype=np.uint8)
+        self._resized = self._scratch.reshape(height, width, 3)
+
+    @property
+    def batch_size(self):
+        return self.data.shape[0]
+
+    def fill(self, index, img, letterbox=False):
+        """
+        Resize a decoded BGR image into slot index of the buffer as an RGB CHW image
+        :param index: position of the image in the batch
+        :param img: HxWx3 uint8 image as returned by cv2.imread
+        :param letterbox: keep the aspect ratio of the image, centering it and padding the rest of the input with
+                          LETTERBOX_FILL, instead of stretching it to the input size
+        :return: the (offset_x, offset_y, scale_x, scale_y) transform mapping normalized coordinates on the network
+                 input back to the original image: x = (x_input - offset_x) * scale_x. See postprocess.map_boxes.
+        """
+        height, width = self.data.shape[2:]
+        img_height, img_width = img.shape[:2]
+        if not letterbox or img_height * width == img_width * height:
+            if (img_height, img_width) == (height, width):
+                resized = img
+            else:
+                resized = cv2.resize(img, (width, height), dst=self._resized)
+            # Reversing the channel axis switches BGR to RGB (which ImageNet networks take) and transposing HWC to
+            # CHW is only a view, so the conversion to float32 below is the one and only copy
+            np.copyto(self.data[index], resized.transpose(2, 0, 1)[::-1])
+            return IDENTITY_TRANSFORM
+
+        scale = min(float(width) / img_width, float(height) / img_height)
+        new_width = min(width, max(1, int(round(img_width * scale))))
+        new_height = min(height, max(1, int(round(img_height * scale))))
+        left = (width - new_width) // 2
+        top = (height - new_height) // 2
+        resized = cv2.resize(img, (new_width, new_height),
+                             dst=self._scratch[:new_height * new_width * 3].reshape(new_height, new_width, 3))
+        slot = self.data[index]
+        slot.fill(LETTERBOX_FILL)
+        np.copyto(slot[:, top:top + new_height, left:left + new_width], resized.transpose(2, 0, 1)[::-1])
+        return (float(left) / width, float(top) / height, float(width) / new_width, float(height) / new_height)
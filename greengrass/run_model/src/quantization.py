@@ -0,0 +1,165 @@
+import logging
+import os
+
+import cv2
+import mxnet as mx
+import numpy as np
+from mxnet.contrib import quantization
+
+from postprocess import box_iou
+from preprocess import InputBuffer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+CALIBRATION_MODES = ['none', 'naive', 'entropy']
+
+
+def list_images(directory, limit=None):
+    """
+    :return: the sorted paths of the images in directory, at most limit of them
+    """
+    filepaths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+    return filepaths[:limit] if limit else filepaths
+
+
+def calibration_batch(filepaths, input_shape):
+    """
+    Preprocess images exactly as MLModel does before inference
+    :param input_shape: (channels, height, width) of the network input
+    :return: (N, channels, height, width) float32 array
+    """
+    images = [img for img in (cv2.imread(filepath) for filepath in filepaths) if img is not None]
+    buffer = InputBuffer(len(images), input_shape[1], input_shape[2])
+    for i, img in enumerate(images):
+        buffer.fill(i, img)
+    return buffer.data
+
+
+def mkldnn_enabled():
+    try:
+        return mx.runtime.Features().is_enabled('MKLDNN')
+    except AttributeError:
+        # mx.runtime only exists from MXNet 1.5
+        return False
+
+
+def quantize_checkpoint(sym, arg_params, aux_params, calib_data=None, calib_mode='naive', excluded_sym_names=None,
+                        quantized_dtype='auto', data_name='data', label_names=(), ctx=None):
+    """
+    Convert an fp32 checkpoint to INT8 with mx.contrib.quantization. Operators without an INT8 implementation and
+    the ones in excluded_sym_names stay in fp32.
+    :param calib_data: preprocessed (N, C, H, W) images used to find the range of every quantized layer's output.
+                       None quantizes without calibration, which makes MXNet compute the ranges on every forward
+                       pass and is noticeably slower.
+    :param calib_mode: 'naive' uses the min and max seen on calib_data, 'entropy' picks the ranges minimizing the
+                       KL divergence with the fp32 outputs
+    :param quantized_dtype: 'int8', 'uint8' or 'auto', which lets MXNet pick per layer
+    :return: a (symbol, arg_params, aux_params) tuple of the quantized model
+    """
+    if calib_mode not in CALIBRATION_MODES:
+        raise ValueError('unknown calibration mode {}. expected one of {}'.format(calib_mode, CALIBRATION_MODES))
+    if calib_data is None or not len(calib_data):
+        calib_mode = 'none'
+    ctx = ctx if ctx is not None else mx.cpu()
+
+    fuse = mkldnn_enabled() and ctx.device_type == 'cpu'
+    if fuse:
+        # Fuse convolutions with their batch norm and activation first, so they get quantized as one operator
+        sym = sym.get_backend_symbol('MKLDNN_QUANTIZE')
+
+    calib_iter = None
+    if calib_mode != 'none':
+        calib_iter = mx.io.NDArrayIter(data={data_name: calib_data}, batch_size=1)
+    qsym, qarg_params, qaux_params = quantization.quantize_model(
+        sym=sym, arg_params=arg_params, aux_params=aux_params, data_names=(data_name,), label_names=label_names,
+        ctx=ctx, excluded_sym_names=excluded_sym_names or [], calib_mode=calib_mode, calib_data=calib_iter,
+        num_calib_examples=len(calib_data) if calib_iter is not None else None, quantized_dtype=quantized_dtype,
+        logger=logging)
+    if fuse:
+        qsym = qsym.get_backend_symbol('MKLDNN_QUANTIZE')
+    return qsym, qarg_params, qaux_params
+
+
+def params_bytes(*param_dicts):
+    """
+    :return: total size in bytes of the arrays in the given parameter dicts
+    """
+    return sum(array.size * np.dtype(array.dtype).itemsize for params in param_dicts for array in params.values())
+
+
+class Int8Quantizer(object):
+    """
+    Callable MLModel applies to its checkpoint before binding it, calibrating an INT8 version of the model on the
+    images of a local directory. The quantized checkpoint is kept, so model replicas sharing a checkpoint only
+    calibrate it once.
+    """
+    def __init__(self, calib_dir=None, num_calib_images=10, calib_mode='naive', excluded_sym_names=None,
+                 quantized_dtype='auto'):
+        """
+        :param calib_dir: directory of sample images representative of the production input. None quantizes
+                          without calibration.
+        :param num_calib_images: maximum number of images from calib_dir to calibrate on
+        """
+        self.calib_dir = calib_dir
+        self.num_calib_images = num_calib_images
+        self.calib_mode = calib_mode
+        self.excluded_sym_names = excluded_sym_names
+        self.quantized_dtype = quantized_dtype
+        self._last = None
+
+    def __call__(self, sym, arg_params, aux_params, data_name, input_shape, label_names=()):
+        """
+        :param input_shape: (channels, height, width) of the network input
+        :return: the quantized (symbol, arg_params, aux_params)
+        """
+        if self._last is not None and self._last[0] is sym:
+            return self._last[1]
+
+        calib_data = None
+        if self.calib_dir:
+            filepaths = list_images(self.calib_dir, self.num_calib_images)
+            logging.info('Calibrating INT8 model on {} images from {}'.format(len(filepaths), self.calib_dir))
+            calib_data = mx.nd.array(calibration_batch(filepaths, input_shape))
+        quantized = quantize_checkpoint(sym, arg_params, aux_params, calib_data, self.calib_mode,
+                                        self.excluded_sym_names, self.quantized_dtype, data_name, tuple(label_names))
+        logging.info('Quantized model parameters take {} bytes instead of {}'.format(
+            params_bytes(quantized[1], quantized[2]), params_bytes(arg_params, aux_params)))
+        self._last = (sym, quantized)
+        return quantized
+
+
+def accuracy_drift(reference, candidate, filepaths, iou_threshold=0.5):
+    """
+    Compare the top detection of two models on sample images, e.g. an fp32 model and its INT8 version
+    :param reference: model whose predictions are taken as correct, with a predict_from_file method
+    :param candidate: model to compare with it
+    :return: a dict with the fraction of images where both agree on the class and their boxes overlap by at least
+             iou_threshold, the mean and max absolute score difference, the mean IoU, and a row per image
+    """
+    images = []
+    for filepath in filepaths:
+        expected = reference.predict_from_file(filepath)
+        actual = candidate.predict_from_file(filepath)
+        if not expected or not actual:
+            images.append({'filepath': filepath, 'agree': not expected and not actual})
+            continue
+        expected, actual = np.asarray(expected[0], dtype=np.float32), np.asarray(actual[0], dtype=np.float32)
+        iou = float(box_iou(expected[None, 2:], actual[None, 2:])[0, 0])
+        images.append({
+            'filepath': filepath,
+            'expected_class': float(expected[0]),
+            'actual_class': float(actual[0]),
+            'score_delta': float(actual[1] - expected[1]),
+            'iou': iou,
+            'agree': bool(expected[0] == actual[0] and iou >= iou_threshold)
+        })
+
+    compared = [image for image in images if 'score_delta' in image]
+    score_deltas = [abs(image['score_delta']) for image in compared]
+    return {
+        'images': images,
+        'agreement': float(sum(image['agree'] for image in images)) / len(images) if images else 0.0,
+        'mean_abs_score_delta': float(np.mean(score_deltas)) if score_deltas else 0.0,
+        'max_abs_score_delta': float(np.max(score_deltas)) if score_deltas else 0.0,
+        'mean_iou': float(np.mean([image['iou'] for image in compared])) if compared else 0.0
+    }
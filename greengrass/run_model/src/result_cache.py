@@ -0,0 +1,144 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def content_hash(data):
+    """
+    Fast hash of the encoded file bytes or of a decoded image array
+    """
+    if isinstance(data, np.ndarray):
+        data = np.ascontiguousarray(data)
+    return hashlib.sha1(data).hexdigest()
+
+
+def perceptual_hash(img, hash_size=8):
+    """
+    Difference hash (dHash) of a decoded image. Frames that only differ by compression noise or small lighting
+    changes get hashes that are a few bits apart.
+    :param img: decoded BGR image
+    :param hash_size: the hash has hash_size * hash_size bits
+    :return: the hash as an int
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def key_variant(key):
+    """
+    :return: what follows the content hash in a (content hash, ...) key, e.g. the input size the result was computed
+             at, or None for a plain content hash
+    """
+    return key[1:] if isinstance(key, tuple) else None
+
+
+class ResultCache(object):
+    """
+    Thread-safe LRU cache of predictions keyed by image content. Entries expire after ttl_seconds, and in perceptual
+    mode a lookup that misses the exact content hash falls back to the cached image with the closest perceptual
+    hash, as long as it is at most max_distance bits away. Keys can be (content hash, ...) tuples, in which case the
+    fallback only considers entries whose key has the same rest, e.g. results computed at the same input size.
+    """
+    def __init__(self, max_size=256, ttl_seconds=None, perceptual=False, max_distance=4):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.perceptual = perceptual
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        # Keys in the order they were stored, so the oldest entries are always at the front
+        self._stored = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._perceptual_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key, phash=None):
+        """
+        :param key: content hash of the image, or a tuple starting with it
+        :param phash: perceptual hash of the image, only used in perceptual mode
+        :return: the cached result, or None on a miss
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None and self.perceptual and phash is not None:
+                key, entry = self._nearest(phash, key_variant(key))
+                if entry is not None:
+                    self._perceptual_hits += 1
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.pop(key)
+            self._entries[key] = entry
+            return entry[0]
+
+    def put(self, key, result, phash=None):
+        with self._lock:
+            stored_at = time.time()
+            self._entries.pop(key, None)
+            self._entries[key] = (result, phash, stored_at)
+            self._stored.pop(key, None)
+            self._stored[key] = stored_at
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                del self._stored[evicted]
+                self._evictions += 1
+
+    def stats(self):
+        """
+        :return: a dict with the cache size and its hit, miss and eviction counters
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'perceptual_hits': self._perceptual_hits,
+                'misses': self._misses,
+                'hit_rate': float(self._hits) / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stored.clear()
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        oldest_allowed = time.time() - self.ttl_seconds
+        # Hits move entries to the back of the LRU order without refreshing their age, so look for expired entries
+        # in the order they were stored instead
+        while self._stored:
+            key, stored_at = next(iter(self._stored.items()))
+            if stored_at >= oldest_allowed:
+                break
+            del self._stored[key]
+            del self._entries[key]
+            self._expirations += 1
+
+    def _nearest(self, phash, variant=None):
+        best_key, best_entry, best_distance = None, None, self.max_distance + 1
+        for key, entry in self._entries.items():
+            if entry[1] is None or key_variant(key) != variant:
+                continue
+            distance = hamming_distance(phash, entry[1])
+            if distance < best_distance:
+                best_key, best_entry, best_distance = key, entry, distance
+        return best_key, best_entry
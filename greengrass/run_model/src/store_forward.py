@@ -0,0 +1,298 @@
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+
+MAGIC = b'GGSF'
+VERSION = 1
+# magic, format version, capacity of the record area, offset of the oldest record, offset the next record is written
+# at, number of records
+HEADER = struct.Struct('<4sHxxIIII')
+# Every record is its length followed by a flag byte (1 if the payload is text), the topic and the payload
+LENGTH = struct.Struct('<I')
+RECORD = struct.Struct('<BH')
+# Written where a record did not fit before the end of the record area, so the next record starts back at 0
+WRAP = 0xFFFFFFFF
+
+
+class RingBuffer(object):
+    """
+    Append-only ring buffer of byte records in a memory-mapped file, so records survive a restart of the function.
+    When a record does not fit, the oldest records are evicted to make room for it.
+    """
+    def __init__(self, path, capacity_bytes):
+        """
+        :param path: file holding the buffer. An existing buffer of the same capacity is reopened with its records,
+                     anything else is overwritten.
+        :param capacity_bytes: size of the record area. The file is HEADER.size bytes larger.
+        """
+        self.path = path
+        self.capacity = capacity_bytes
+        self.evicted = 0
+        self._lock = threading.Lock()
+        size = HEADER.size + capacity_bytes
+        exists = os.path.exists(path) and os.path.getsize(path) == size
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(size)
+        self._mm = mmap.mmap(self._file.fileno(), size)
+        magic, version, capacity, self._head, self._tail, self._count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or capacity != capacity_bytes:
+            if exists:
+                logging.warning('Discarding store and forward buffer {} of another format'.format(path))
+            self._head = self._tail = self._count = 0
+            self._write_header()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+
+    def flush(self):
+        """
+        Write the buffer to disk. Without it the OS writes it back on its own schedule, which still survives the
+        process dying but not the device losing power.
+        """
+        with self._lock:
+            self._mm.flush()
+
+    def append(self, record):
+        """
+        Add a record after the newest one, evicting the oldest records until it fits
+        """
+        size = LENGTH.size + len(record)
+        if size > self.capacity:
+            raise ValueError('record of {} bytes does not fit in a buffer of {} bytes'.format(len(record),
+                                                                                              self.capacity))
+        with self._lock:
+            while not self._fits(size):
+                self._pop()
+                self.evicted += 1
+            LENGTH.pack_into(self._mm, HEADER.size + self._tail, len(record))
+            start = HEADER.size + self._tail + LENGTH.size
+            self._mm[start:start + len(record)] = record
+            self._tail += size
+            self._count += 1
+            self._write_header()
+
+    def peek(self):
+        """
+        :return: the oldest record, or None if the buffer is empty
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            self._head = self._record_offset(self._head)
+            length, = LENGTH.unpack_from(self._mm, HEADER.size + self._head)
+            start = HEADER.size + self._head + LENGTH.size
+            return self._mm[start:start + length]
+
+    def pop(self):
+        """
+        Remove the oldest record, once it has been handled
+        """
+        with self._lock:
+            if self._count:
+                self._pop()
+                self._write_header()
+
+    def _fits(self, size):
+        if not self._count:
+            self._head = self._tail = 0
+            return True
+        if self._tail > self._head:
+            if self.capacity - self._tail >= size:
+                return True
+            # Not enough room before the end of the file, continue at the start, in front of the oldest record
+            if self.capacity - self._tail >= LENGTH.size:
+                LENGTH.pack_into(self._mm, HEADER.size + self._tail, WRAP)
+            self._tail = 0
+        return self._head - self._tail >= size
+
+    def _record_offset(self, offset):
+        if self.capacity - offset < LENGTH.size or LENGTH.unpack_from(self._mm, HEADER.size + offset)[0] == WRAP:
+            return 0
+        return offset
+
+    def _pop(self):
+        self._head = self._record_offset(self._head)
+        length, = LENGTH.unpack_from(self._mm, HEADER.size + self._head)
+        self._head += LENGTH.size + length
+        self._count -= 1
+        if not self._count:
+            self._head = self._tail = 0
+
+    def _write_header(self):
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, self.capacity, self._head, self._tail, self._count)
+
+
+def encode_message(topic, payload):
+    topic = topic.encode('utf-8')
+    text = not isinstance(payload, bytes)
+    if text:
+        payload = payload.encode('utf-8')
+    return RECORD.pack(1 if text else 0, len(topic)) + topic + payload
+
+
+def decode_message(record):
+    """
+    :return: the (topic, payload) pair stored by encode_message, with text payloads decoded back to str
+    """
+    text, topic_length = RECORD.unpack_from(record, 0)
+    start = RECORD.size + topic_length
+    topic = bytes(record[RECORD.size:start]).decode('utf-8')
+    payload = bytes(record[start:])
+    return topic, payload.decode('utf-8') if text else payload
+
+
+def tcp_probe(host, port, timeout=2.0):
+    """
+    :return: a function telling whether a TCP connection to host:port can be opened, e.g. to the AWS IoT endpoint
+    """
+    def probe():
+        try:
+            socket.create_connection((host, port), timeout).close()
+            return True
+        except (socket.error, socket.timeout):
+            return False
+    return probe
+
+
+class StoreAndForward(object):
+    """
+    Publishes messages right away while the uplink works and keeps them in a RingBuffer while it does not. A
+    background thread replays the buffered messages in order, at most replay_rate per second, once the uplink is back.
+    Messages published while older ones are still buffered are buffered behind them, so the order is kept.
+    """
+    def __init__(self, send, path, capacity_bytes=16 * 1024 * 1024, replay_rate=20.0, retry_seconds=5.0,
+                 is_connected=None, sync=False):
+        """
+        :param send: function called with (topic, payload) to publish a message. Any exception it raises counts as
+                     the uplink being down.
+        :param replay_rate: maximum number of buffered messages published per second. 0 does not limit it.
+        :param retry_seconds: how long to wait before trying the uplink again after a failure
+        :param is_connected: optional function telling whether the uplink is up, checked every retry_seconds. Needed
+                             when send does not fail while offline, e.g. because it queues messages itself.
+        :param sync: write the buffer to disk after every buffered message
+        """
+        self.send = send
+        self.buffer = RingBuffer(path, capacity_bytes)
+        self.replay_interval = 1.0 / replay_rate if replay_rate > 0 else 0
+        self.retry_seconds = retry_seconds
+        self.is_connected = is_connected
+        self.sync = sync
+        self.online = True
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._sent = 0
+        self._buffered = 0
+        self._replayed = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='StoreAndForward')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+            self._thread.join()
+            self._thread = None
+        self.buffer.flush()
+
+    def close(self):
+        self.stop()
+        self.buffer.close()
+
+    def publish(self, topic, payload):
+        """
+        :return: True if the message was published right away, False if it was buffered
+        """
+        with self._condition:
+            direct = self.online and not len(self.buffer)
+        if direct:
+            try:
+                self.send(topic, payload)
+                with self._condition:
+                    self._sent += 1
+                return True
+            except Exception as e:
+                logging.warning('Uplink failed, buffering messages until it is back: {}'.format(e))
+        with self._condition:
+            self.online = False
+            self.buffer.append(encode_message(topic, payload))
+            self._buffered += 1
+            self._condition.notify_all()
+        if self.sync:
+            self.buffer.flush()
+        return False
+
+    def metrics(self):
+        """
+        :return: a dict with the number of messages sent right away, buffered, replayed, evicted from a full buffer
+                 and still waiting, and whether the uplink is up
+        """
+        with self._condition:
+            return {
+                'sent': self._sent,
+                'buffered': self._buffered,
+                'replayed': self._replayed,
+                'evicted': self.buffer.evicted,
+                'pending': len(self.buffer),
+                'online': self.online
+            }
+
+    def _wait(self, seconds):
+        with self._condition:
+            if not self._stopped:
+                self._condition.wait(seconds)
+            return not self._stopped
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not len(self.buffer) and self.is_connected is None:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                pending = len(self.buffer)
+            if self.is_connected is not None:
+                connected = self.is_connected()
+                with self._condition:
+                    if not connected:
+                        self.online = False
+                    elif not len(self.buffer):
+                        self.online = True
+                if not connected or not pending:
+                    self._wait(self.retry_seconds)
+                    continue
+            with self._condition:
+                # The oldest record may be evicted by a new message while it is sent, it must not be popped then
+                evicted = self.buffer.evicted
+                record = self.buffer.peek()
+            try:
+                self.send(*decode_message(record))
+            except Exception as e:
+                logging.info('Uplink still down, retrying in {} seconds: {}'.format(self.retry_seconds, e))
+                self._wait(self.retry_seconds)
+                continue
+            with self._condition:
+                if self.buffer.evicted == evicted:
+                    self.buffer.pop()
+                self._replayed += 1
+                if not len(self.buffer):
+                    self.online = True
+                    logging.info('Replayed every buffered message')
+            if self.replay_interval:
+                self._wait(self.replay_interval)
@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+from metrics import Metrics
+
+# A captured frame. index counts every frame read from the source, timestamp is when it was read.
+Frame = namedtuple('Frame', ['index', 'timestamp', 'image'])
+
+DEFAULT_FPS = 30.0
+
+
+def parse_source(source):
+    """
+    :return: the camera index for a string of digits, otherwise the source unchanged (an RTSP URL or a file path)
+    """
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+class StreamRunner(object):
+    """
+    Runs inference on the frames of a cv2.VideoCapture source (a camera index, an RTSP URL or a video file) as they
+    arrive. A capture thread keeps reading frames and only holds on to the newest one, so when inference falls behind
+    real time the frames in between are skipped instead of building up a backlog. A frame that is already older than
+    max_latency_ms when inference could start on it is dropped as well. Results are published at most publish_rate
+    times per second.
+    """
+    def __init__(self, source, infer, publish, max_latency_ms=500, publish_rate=None, realtime=None,
+                 reconnect_seconds=5, open_capture=cv2.VideoCapture, metrics=None, gate=None):
+        """
+        :param source: anything cv2.VideoCapture opens
+        :param infer: function called with a list of decoded BGR images, returning one result per image, such as
+                      MLModel.predict_batch
+        :param publish: function called on the inference thread with each Frame and its result
+        :param max_latency_ms: frames older than this when inference is ready for them are skipped
+        :param publish_rate: maximum number of results published per second. None publishes every result.
+        :param realtime: read the source no faster than its frame rate. Defaults to True for video files, which
+                         would otherwise be read as fast as they decode. Cameras and streams pace themselves.
+        :param reconnect_seconds: how long to wait before reopening a live source that stopped returning frames
+        :param open_capture: function opening the source, returning an object with the cv2.VideoCapture interface
+        :param metrics: Metrics to record the latency of each frame in
+        :param gate: optional MotionGate. Frames it finds unchanged reuse the result of the last inferred frame.
+        """
+        self.source = parse_source(source)
+        self.infer = infer
+        self.publish = publish
+        self.max_latency = max_latency_ms / 1000.0
+        self.publish_interval = 1.0 / publish_rate if publish_rate else 0.0
+        # Anything but a camera index or a URL is read as a video file, which is not reopened once it ends
+        self.is_file = isinstance(self.source, str) and '://' not in self.source
+        self.realtime = self.is_file if realtime is None else realtime
+        self.reconnect_seconds = reconnect_seconds
+        self.open_capture = open_capture
+        self.metrics_registry = metrics if metrics is not None else Metrics()
+        self.gate = gate
+        self._condition = threading.Condition()
+        self._frame = None
+        self._capture_done = False
+        self._stopped = threading.Event()
+        self._threads = []
+        self._last_published = 0.0
+        self._counters = dict((name, 0) for name in ['read', 'skipped', 'stale', 'gated', 'inferred', 'late',
+                                                     'published', 'failed'])
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopped.clear()
+        self._capture_done = False
+        self._threads = [threading.Thread(target=self._capture_loop, name='StreamCapture'),
+                         threading.Thread(target=self._infer_loop, name='StreamInfer')]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """
+        Stop reading the source and wait for the frame being processed to be published
+        """
+        if not self._threads:
+            return
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def run(self):
+        """
+        Process the source until it runs out of frames, e.g. at the end of a video file
+        """
+        self.start()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def metrics(self):
+        """
+        :return: a dict with the number of frames read, skipped because inference was busy, dropped because they
+                 were older than max_latency_ms, answered with the last result because the gate found them unchanged,
+                 inferred, inferred later than max_latency_ms and published
+        """
+        with self._condition:
+            counters = dict(self._counters)
+        counters['skip_rate'] = (counters['skipped'] + counters['stale']) / float(max(counters['read'], 1))
+        return counters
+
+    def _open(self):
+        capture = self.open_capture(self.source)
+        if not capture.isOpened():
+            return None
+        # Live sources buffer frames in the driver, which would add latency on top of the frame kept here
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return capture
+
+    def _capture_loop(self):
+        try:
+            self._capture()
+        finally:
+            with self._condition:
+                self._capture_done = True
+                self._condition.notify_all()
+
+    def _capture(self):
+        index = 0
+        while not self._stopped.is_set():
+            capture = self._open()
+            if capture is None:
+                logging.warning('Could not open video source {}'.format(self.source))
+                if self.is_file or self._stopped.wait(self.reconnect_seconds):
+                    return
+                continue
+
+            fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+            started = time.time()
+            first_index = index
+            try:
+                while not self._stopped.is_set():
+                    ok, image = capture.read()
+                    if not ok:
+                        break
+                    if self.realtime:
+                        # Hand out frames at the rate they were recorded at
+                        delay = started + (index - first_index) / fps - time.time()
+                        if delay > 0 and self._stopped.wait(delay):
+                            break
+                    with self._condition:
+                        self._counters['read'] += 1
+                        if self._frame is not None:
+                            self._counters['skipped'] += 1
+                        self._frame = Frame(index, time.time(), image)
+                        self._condition.notify_all()
+                    index += 1
+            finally:
+                capture.release()
+
+            if self.is_file:
+                return
+            logging.warning('Video source {} stopped returning frames. reconnecting'.format(self.source))
+            if self._stopped.wait(self.reconnect_seconds):
+                return
+
+    def _next_frame(self):
+        """
+        Wait for a frame newer than the last one processed
+        :return: the frame, or None once the source is exhausted or the runner is stopped
+        """
+        with self._condition:
+            while self._frame is None and not self._capture_done and not self._stopped.is_set():
+                self._condition.wait()
+            frame, self._frame = self._frame, None
+            return frame
+
+    def _infer_loop(self):
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return
+            if time.time() - frame.timestamp > self.max_latency:
+                with self._condition:
+                    self._counters['stale'] += 1
+                continue
+
+            if self.gate is not None and not self.gate.should_infer(frame.image):
+                # Nothing moved since the last inferred frame, so its detections still apply
+                result = self.gate.last_result
+                with self._condition:
+                    self._counters['gated'] += 1
+            else:
+                try:
+                    result = self.infer([frame.image])[0]
+                except Exception:
+                    logging.exception('Failed to run inference on frame {}'.format(frame.index))
+                    with self._condition:
+                        self._counters['failed'] += 1
+                    continue
+                if self.gate is not None:
+                    self.gate.remember(result)
+                latency = time.time() - frame.timestamp
+                self.metrics_registry.record('frame_latency', latency)
+                with self._condition:
+                    self._counters['inferred'] += 1
+                    if latency > self.max_latency:
+                        self._counters['late'] += 1
+
+            now = time.time()
+            if now - self._last_published < self.publish_interval:
+                continue
+            self._last_published = now
+            try:
+                self.publish(frame, result)
+            except Exception:
+                logging.exception('Failed to publish result for frame {}'.format(frame.index))
+                continue
+            with self._condition:
+                self._counters['published'] += 1
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The lambda code imports its modules from the deployment package root, so make src importable the same way
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,45 @@
+import os
+import unittest
+import cv2
+import numpy as np
+from src import backends
+from src.model_loader import MLModel
+
+param_path = './resources/ml/od/deploy_model_algo_1'
+filepaths = ['./resources/img/blue_box_1_000133.jpg', './resources/img/yellow_box_1_000086.jpg']
+
+
+class TestBackends(unittest.TestCase):
+
+    def raw_outputs(self, backend):
+        model = MLModel(param_path, batch_sizes=[2], backend=backend)
+        host = model.get_input_buffer(2, model.resolution)
+        for i, filepath in enumerate(filepaths):
+            host.fill(i, cv2.imread(filepath))
+        return model.backend.fetch(model.backend.forward(host.data))
+
+    def test_gluon_matches_module(self):
+        np.testing.assert_allclose(self.raw_outputs('gluon'), self.raw_outputs('module'), rtol=1e-4, atol=1e-5)
+
+    @unittest.skipIf(backends.onnxruntime is None, 'onnxruntime is not installed')
+    def test_onnx_matches_module(self):
+        np.testing.assert_allclose(self.raw_outputs('onnx'), self.raw_outputs('module'), rtol=1e-4, atol=1e-5)
+
+    @unittest.skipIf(backends.onnxruntime is None, 'onnxruntime is not installed')
+    def test_onnx_exports_are_removed_on_close(self):
+        model = MLModel(param_path, backend='onnx')
+        onnx_dir = model.backend.onnx_dir
+        self.assertTrue(os.listdir(onnx_dir))
+        model.close()
+        self.assertFalse(os.path.exists(onnx_dir))
+
+    def test_backends_make_the_same_prediction(self):
+        expected = MLModel(param_path).predict_batch(filepaths)
+        self.assertEqual(MLModel(param_path, backend='gluon').predict_batch(filepaths), expected)
+
+    def test_unknown_backend_is_rejected(self):
+        self.assertRaises(ValueError, MLModel, param_path, backend='tensorrt')
+
+
+if __name__ == '__main__':
+    unittest.main()
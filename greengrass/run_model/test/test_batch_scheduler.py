@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+from src.batch_scheduler import MicroBatchScheduler
+
+
+class TestMicroBatchScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.done = threading.Event()
+
+    def record_batch(self, items):
+        self.batches.append(items)
+        if sum(len(batch) for batch in self.batches) >= self.expected_items:
+            self.done.set()
+
+    def test_flushes_when_batch_is_full(self):
+        self.expected_items = 4
+        scheduler = MicroBatchScheduler(self.record_batch, max_batch_size=2, max_wait_ms=10000)
+        for i in range(4):
+            self.assertTrue(scheduler.submit(i))
+        scheduler.start()
+        self.assertTrue(self.done.wait(5), 'full batches should not wait for max_wait_ms')
+        scheduler.stop()
+        self.assertEqual(self.batches, [[0, 1], [2, 3]])
+
+    def test_flushes_partial_batch_after_max_wait(self):
+        self.expected_items = 1
+        scheduler = MicroBatchScheduler(self.record_batch, max_batch_size=8, max_wait_ms=50)
+        scheduler.start()
+        start = time.time()
+        scheduler.submit('a')
+        self.assertTrue(self.done.wait(5))
+        self.assertGreaterEqual(time.time() - start, 0.04, 'should wait for more items before flushing')
+        scheduler.stop()
+        self.assertEqual(self.batches, [['a']])
+
+    def test_rejects_items_when_queue_is_full(self):
+        scheduler = MicroBatchScheduler(self.record_batch, max_queue_size=2)
+        self.assertTrue(scheduler.submit(1))
+        self.assertTrue(scheduler.submit(2))
+        self.assertFalse(scheduler.submit(3), 'should drop items once the queue is full')
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics['queue_depth'], 2)
+        self.assertEqual(metrics['dropped'], 1)
+
+    def test_metrics_report_batch_size_and_wait(self):
+        self.expected_items = 3
+        scheduler = MicroBatchScheduler(self.record_batch, max_batch_size=3, max_wait_ms=10000)
+        for i in range(3):
+            scheduler.submit(i)
+        scheduler.start()
+        self.assertTrue(self.done.wait(5))
+        scheduler.stop()
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics['batches'], 1)
+        self.assertEqual(metrics['last_batch_size'], 3)
+        self.assertEqual(metrics['avg_batch_size'], 3.0)
+        self.assertGreaterEqual(metrics['max_wait_ms'], metrics['avg_wait_ms'])
+
+    def test_failed_batch_is_reported(self):
+        failures = []
+
+        def process_batch(items):
+            raise RuntimeError('forward pass failed')
+
+        def on_error(items, error):
+            failures.append((items, str(error)))
+            self.done.set()
+
+        scheduler = MicroBatchScheduler(process_batch, max_batch_size=3, max_wait_ms=10000, on_error=on_error)
+        for i in range(3):
+            scheduler.submit(i)
+        scheduler.start()
+        self.assertTrue(self.done.wait(5))
+        scheduler.stop()
+        self.assertEqual(failures, [([0, 1, 2], 'forward pass failed')])
+        self.assertEqual(scheduler.metrics()['failed'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import unittest
+import numpy as np
+from src.encoding import decode_response, decode_responses, encode_response, encode_responses
+
+response = {
+    'prediction': [[1.0, 0.9876, 0.125, 0.25, 0.5, 0.75], [0.0, 0.51, 0.0, 0.1, 0.333333, 1.0]],
+    'timestamp': 1569512345.678,
+    'filepath': '/tmp/frame.jpg',
+    'model_version': '1569500000-123456'
+}
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_round_trip(self):
+        decoded = decode_response(encode_response(response))
+        self.assertEqual(decoded['timestamp'], response['timestamp'])
+        self.assertEqual(decoded['filepath'], response['filepath'])
+        self.assertEqual(decoded['model_version'], response['model_version'])
+        np.testing.assert_allclose(decoded['prediction'], response['prediction'], atol=1e-3)
+
+    def test_box_precision(self):
+        decoded = decode_response(encode_response(response))
+        boxes = np.array(decoded['prediction'])[:, 2:]
+        np.testing.assert_allclose(boxes, np.array(response['prediction'])[:, 2:], atol=1 / 65535.0)
+
+    def test_extra_fields_and_missing_values(self):
+        stream_response = dict(response, filepath=None, id=42, source='rtsp://camera', latency_ms=12.5)
+        decoded = decode_response(encode_response(stream_response))
+        self.assertIsNone(decoded['filepath'])
+        self.assertEqual(decoded['id'], 42)
+        self.assertEqual(decoded['source'], 'rtsp://camera')
+        self.assertEqual(decoded['latency_ms'], 12.5)
+
+    def test_empty_and_missing_detections(self):
+        self.assertEqual(decode_response(encode_response(dict(response, prediction=[])))['prediction'], [])
+        decoded = decode_response(encode_response(dict(response, prediction=[[-1, -1, -1, -1, -1, -1]])))
+        self.assertEqual(decoded['prediction'][0][0], -1)
+
+    def test_smaller_than_json(self):
+        many = dict(response, prediction=response['prediction'] * 50)
+        self.assertLess(len(encode_response(many)), len(json.dumps(many)) / 3)
+
+    def test_rejects_other_payloads(self):
+        self.assertRaises(ValueError, decode_response, json.dumps(response).encode('utf-8'))
+        self.assertRaises(ValueError, decode_response, encode_response(response)[:-1])
+
+    def test_batch_round_trip(self):
+        responses = [dict(response, source='camera-1'), dict(response, prediction=[], source='camera-2')]
+        decoded = decode_responses(encode_responses(responses))
+        self.assertEqual([r['source'] for r in decoded], ['camera-1', 'camera-2'])
+        np.testing.assert_allclose(decoded[0]['prediction'], response['prediction'], atol=1e-3)
+        self.assertEqual(decoded[1]['prediction'], [])
+        self.assertEqual(decode_responses(encode_response(response))[0]['filepath'], response['filepath'])
+        self.assertRaises(ValueError, decode_responses, json.dumps(responses).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
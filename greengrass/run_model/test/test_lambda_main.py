@@ -1,5 +1,12 @@
+import base64
+import os
+import shutil
+import tempfile
+import time
 import unittest
+import cv2
 import main
+from encoding import decode_response
 import json
 from mock import MagicMock
 
@@ -24,7 +31,237 @@ class TestModelLoader(unittest.TestCase):
         self.assertEqual(response['prediction'][0][0], 0.0)
         main.client.publish.assert_called_with(topic='blog/infer/output', payload=json.dumps(response))
 
+    def test_lambda_handler_predicts_on_base64_image(self):
+        main.initialize(param_path)
+        main.client.publish = MagicMock()
+
+        with open('./resources/img/yellow_box_1_000086.jpg', 'rb') as f:
+            event = {'image': base64.b64encode(f.read()).decode('ascii'), 'id': 'frame-1'}
+        response = main.lambda_handler(event, {})
+
+        self.assertEqual(response['prediction'][0][0], 1.0)
+        self.assertEqual(response['id'], 'frame-1')
+        self.assertIsNone(response['filepath'])
+
+    def test_lambda_handler_predicts_on_raw_bytes(self):
+        main.initialize(param_path)
+        main.client.publish = MagicMock()
+
+        with open('./resources/img/blue_box_1_000133.jpg', 'rb') as f:
+            response = main.lambda_handler(f.read(), {})
+        self.assertEqual(response['prediction'][0][0], 0.0)
+
+    def test_lambda_handler_publishes_binary_format(self):
+        main.initialize(param_path)
+        main.client.publish = MagicMock()
+        output_formats = main.OUTPUT_FORMATS
+        main.OUTPUT_FORMATS = ['json', 'binary']
+        try:
+            response = main.lambda_handler({'filepath': './resources/img/blue_box_1_000133.jpg'}, {})
+        finally:
+            main.OUTPUT_FORMATS = output_formats
+
+        main.client.publish.assert_any_call(topic='blog/infer/output', payload=json.dumps(response))
+        payload = main.client.publish.call_args[1]['payload']
+        self.assertEqual(main.client.publish.call_args[1]['topic'], 'blog/infer/output/bin')
+        self.assertEqual(decode_response(payload)['prediction'][0][0], response['prediction'][0][0])
+
+    def test_lambda_handler_batches_predictions(self):
+        main.initialize(param_path, inference_mode='batch')
+        main.client.publish = MagicMock()
+
+        event = {'filepath': './resources/img/blue_box_1_000133.jpg'}
+        self.assertIsNone(main.lambda_handler(event, {}), 'batched requests should be answered asynchronously')
+        main.scheduler.stop()
+
+        payload = json.loads(main.client.publish.call_args[1]['payload'])
+        self.assertEqual(payload['filepath'], event['filepath'])
+        self.assertEqual(payload['prediction'][0][0], 0.0)
+        main.initialize(param_path)
+
+    def test_lambda_handler_pipelines_predictions(self):
+        main.initialize(param_path, inference_mode='pipeline')
+        main.client.publish = MagicMock()
+
+        event = {'filepath': './resources/img/yellow_box_1_000086.jpg'}
+        self.assertIsNone(main.lambda_handler(event, {}), 'pipelined requests should be answered asynchronously')
+        main.scheduler.stop()
+
+        payload = json.loads(main.client.publish.call_args[1]['payload'])
+        self.assertEqual(payload['filepath'], event['filepath'])
+        self.assertEqual(payload['prediction'][0][0], 1.0)
+        main.initialize(param_path)
+
+    def test_requests_during_background_initialization_are_answered(self):
+        main.client.publish = MagicMock()
+        thread = main.initialize_in_background(param_path)
+
+        event = {'filepath': './resources/img/blue_box_1_000133.jpg'}
+        main.lambda_handler(event, {})
+        thread.join()
+
+        self.assertTrue(main.model_ready.is_set())
+        payload = json.loads(main.client.publish.call_args[1]['payload'])
+        self.assertEqual(payload['filepath'], event['filepath'])
+
+    def test_background_initialization_failure_is_reported(self):
+        main.client.publish = MagicMock()
+        main.initialize_in_background('./resources/ml/od/missing_model').join()
+
+        main.lambda_handler({'filepath': './resources/img/blue_box_1_000133.jpg'}, {})
+        self.assertFalse(main.model_ready.is_set())
+        payload = main.client.publish.call_args[1]['payload']
+        self.assertTrue(payload.startswith('model could not be loaded'), payload)
+        main.initialize(param_path)
+        self.assertIsNone(main.model_error)
+
+    def test_reloaded_model_version_is_published(self):
+        main.initialize(param_path)
+        main.client.publish = MagicMock()
+        main.reload_model('reloaded')
+
+        event = {'filepath': './resources/img/blue_box_1_000133.jpg'}
+        response = main.lambda_handler(event, {})
+        self.assertEqual(response['model_version'], 'reloaded')
+        self.assertEqual(response['prediction'][0][0], 0.0)
+        main.initialize(param_path)
+
+    def test_stream_frames_are_published(self):
+        directory = tempfile.mkdtemp()
+        video = os.path.join(directory, 'stream.avi')
+        writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*'MJPG'), 30, (512, 512))
+        image = cv2.resize(cv2.imread('./resources/img/blue_box_1_000133.jpg'), (512, 512))
+        for _ in range(10):
+            writer.write(image)
+        writer.release()
+
+        main.client.publish = MagicMock()
+        main.initialize(param_path, stream_source=video)
+        main.stream_runner.run()
+        shutil.rmtree(directory)
+
+        payload = json.loads(main.client.publish.call_args[1]['payload'])
+        self.assertEqual(payload['source'], video)
+        self.assertIn('latency_ms', payload)
+        self.assertEqual(main.stream_runner.metrics()['read'], 10)
+        main.initialize(param_path)
+
+    def test_motion_gate_reuses_prediction_per_source(self):
+        main.initialize(param_path)
+        main.client.publish = MagicMock()
+        gate_method = main.MOTION_GATE
+        main.MOTION_GATE = 'diff'
+        try:
+            event = {'filepath': './resources/img/blue_box_1_000133.jpg', 'source': 'camera-1'}
+            first = main.lambda_handler(event, {})
+            second = main.lambda_handler(event, {})
+            main.lambda_handler(dict(event, source='camera-2'), {})
+        finally:
+            main.MOTION_GATE = gate_method
+
+        self.assertEqual(second['prediction'], first['prediction'])
+        self.assertEqual(main.motion_gates['camera-1'].stats()['skipped'], 1)
+        self.assertEqual(main.motion_gates['camera-2'].stats()['skipped'], 0)
+        main.initialize(param_path)
+
+    def test_lambda_handler_coalesces_published_predictions(self):
+        settings = main.OUTPUT_BATCH_SIZE, main.OUTPUT_CHANGES_ONLY
+        main.OUTPUT_BATCH_SIZE, main.OUTPUT_CHANGES_ONLY = 2, True
+        try:
+            main.initialize(param_path)
+            main.client.publish = MagicMock()
+            event = {'filepath': './resources/img/blue_box_1_000133.jpg', 'source': 'camera-1'}
+            main.lambda_handler(event, {})
+            main.lambda_handler(event, {})
+            main.lambda_handler(dict(event, source='camera-2'), {})
+        finally:
+            main.OUTPUT_BATCH_SIZE, main.OUTPUT_CHANGES_ONLY = settings
+
+        self.assertEqual(main.client.publish.call_count, 1)
+        payload = json.loads(main.client.publish.call_args[1]['payload'])
+        self.assertEqual([result['source'] for result in payload['results']], ['camera-1', 'camera-2'])
+        self.assertEqual(main.output_aggregator.metrics()['unchanged'], 1)
+        main.initialize(param_path)
+
+    def test_results_are_buffered_while_offline(self):
+        directory = tempfile.mkdtemp()
+        store_forward_path = main.STORE_FORWARD_PATH
+        main.STORE_FORWARD_PATH = os.path.join(directory, 'results.buf')
+        try:
+            main.initialize(param_path)
+            main.client.publish = MagicMock(side_effect=IOError('offline'))
+            response = main.lambda_handler({'filepath': './resources/img/blue_box_1_000133.jpg'}, {})
+            self.assertEqual(main.store_forward.metrics()['pending'], 1)
+
+            main.client.publish = MagicMock()
+            main.store_forward.close()
+            main.store_forward = main.create_store_forward()
+            main.store_forward.start()
+            deadline = time.time() + 5
+            while main.store_forward.metrics()['pending'] and time.time() < deadline:
+                time.sleep(0.05)
+            main.client.publish.assert_called_with(topic='blog/infer/output', payload=json.dumps(response))
+        finally:
+            main.STORE_FORWARD_PATH = store_forward_path
+            main.initialize(param_path)
+            shutil.rmtree(directory)
+
+    def test_lambda_handler_dumps_metrics(self):
+        main.initialize(param_path)
+        main.client.publish = MagicMock()
+        main.lambda_handler({'filepath': './resources/img/blue_box_1_000133.jpg'}, {})
+
+        snapshot = main.lambda_handler({'command': 'dump_metrics'}, {})
+        for stage in ['read', 'decode', 'resize', 'forward', 'output_copy', 'publish']:
+            self.assertIn('p99_ms', snapshot['stages'][stage], 'should time the {} stage'.format(stage))
+        main.client.publish.assert_called_with(topic='blog/infer/metrics', payload=json.dumps(snapshot))
+
     def test_lambda_handler_noops_empty_filepath(self):
         event = {}
         response = main.lambda_handler(event, {})
         self.assertIsNone(response, 'Should return none if no filepath found')
+
+    def test_parse_request_reads_shared_memory(self):
+        filepath = './resources/img/blue_box_1_000133.jpg'
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        request, msg = main.parse_request({'shm': {'path': filepath, 'offset': 2, 'length': 10}})
+        self.assertIsNone(msg)
+        self.assertEqual(request.image.data.tobytes(), data[2:12])
+
+    def test_parse_request_rejects_invalid_base64(self):
+        request, msg = main.parse_request({'image': 'not base64!'})
+        self.assertIsNone(request)
+        self.assertIn('base64', msg)
+
+    def test_parse_request_rejects_events_that_are_not_objects_or_bytes(self):
+        for event in [u'hello', [1, 2], None, 5]:
+            request, msg = main.parse_request(event)
+            self.assertIsNone(request, 'should not make a request from {!r}'.format(event))
+            self.assertIn('nothing to do', msg)
+
+    def test_batched_requests_run_at_the_resolution_they_ask_for(self):
+        main.client.publish = MagicMock()
+        predict_images = main.predict_images
+        main.predict_images = MagicMock(side_effect=lambda images, resolution=None: [([], 'v1')] * len(images))
+        try:
+            filepath = './resources/img/blue_box_1_000133.jpg'
+            requests = [main.InferenceRequest(filepath, filepath, str(i), None, resolution)
+                        for i, resolution in enumerate([300, None, 300])]
+            main.predict_and_publish(requests)
+            calls = [(call[0][1], len(call[0][0])) for call in main.predict_images.call_args_list]
+        finally:
+            main.predict_images = predict_images
+        self.assertEqual(calls, [(300, 2), (None, 1)])
+        self.assertEqual(main.client.publish.call_count, 3)
+
+    def test_pipeline_rejects_requests_for_a_resolution(self):
+        main.initialize(param_path, inference_mode='pipeline')
+        main.client.publish = MagicMock()
+        event = {'filepath': './resources/img/blue_box_1_000133.jpg', 'resolution': main.INPUT_RESOLUTION}
+        self.assertIsNone(main.lambda_handler(event, {}))
+        main.scheduler.stop()
+
+        payload = main.client.publish.call_args[1]['payload']
+        self.assertTrue(payload.startswith('resolution is not supported in pipeline mode'), payload)
+        main.initialize(param_path)
@@ -0,0 +1,54 @@
+import json
+import time
+import unittest
+from mock import MagicMock
+from src.metrics import LatencyHistogram, Metrics, MetricsPublisher
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_percentiles(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.record(ms / 1000.0)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['p50_ms'], 50.5, places=3)
+        self.assertAlmostEqual(summary['p99_ms'], 99.01, places=3)
+        self.assertAlmostEqual(summary['max_ms'], 100.0, places=3)
+
+    def test_histogram_window_keeps_recent_samples(self):
+        histogram = LatencyHistogram(window=10)
+        for _ in range(100):
+            histogram.record(1.0)
+        for _ in range(10):
+            histogram.record(0.001)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 110)
+        self.assertAlmostEqual(summary['p99_ms'], 1.0, places=3)
+
+    def test_stage_timer_and_counters(self):
+        metrics = Metrics()
+        with metrics.time('forward'):
+            time.sleep(0.01)
+        metrics.count('images', 4)
+        snapshot = metrics.snapshot()
+        self.assertGreaterEqual(snapshot['stages']['forward']['p50_ms'], 10)
+        self.assertEqual(snapshot['counters']['images']['total'], 4)
+        self.assertGreater(snapshot['counters']['images']['recent_per_second'], 0)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['images']['recent_per_second'], 0, 'rate since the last snapshot')
+
+    def test_publisher_publishes_json_snapshot(self):
+        publish = MagicMock()
+        publisher = MetricsPublisher(lambda: {'stages': {}}, publish, interval=0.01)
+        publisher.start()
+        time.sleep(0.1)
+        publisher.stop()
+        self.assertTrue(publish.called)
+        self.assertEqual(json.loads(publish.call_args[0][0]), {'stages': {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,9 @@
+import threading
 import unittest
-from src.model_loader import MLModel
+import cv2
+from src.model_loader import MLModel, load_checkpoint, shared_checkpoints
+from src.result_cache import ResultCache
+from src.postprocess import DetectionPostprocessor
 
 param_path = './resources/ml/od/deploy_model_algo_1'
 
@@ -21,6 +25,104 @@ class TestModelLoader(unittest.TestCase):
         results = model.predict_from_file(filepath)
         self.assert_on_inference(results, 1.0, .70)
 
+    def test_predict_batch_matches_single_image(self):
+        model = MLModel(param_path)
+        filepaths = ['./resources/img/blue_box_1_000133.jpg', './resources/img/yellow_box_1_000086.jpg']
+        results = model.predict_batch(filepaths)
+        self.assertEqual(len(results), 2, 'should return one result per image')
+        for filepath, result in zip(filepaths, results):
+            expected = model.predict_from_file(filepath)
+            self.assertEqual(result[0][0], expected[0][0], 'batched prediction differs from single prediction')
+            self.assertAlmostEqual(result[0][1], expected[0][1], places=4)
+
+    def test_predict_batch_mixed_inputs(self):
+        model = MLModel(param_path)
+        image = cv2.imread('./resources/img/yellow_box_1_000086.jpg')
+        results = model.predict_batch(['./resources/img/blue_box_1_000133.jpg', image, './resources/img/missing.jpg'])
+        self.assert_on_inference(results[0], 0.0, .70)
+        self.assert_on_inference(results[1], 1.0, .70)
+        self.assertEqual(results[2], [], 'should return an empty result for an unreadable image')
+
+    def test_predict_batch_larger_than_bound_sizes(self):
+        model = MLModel(param_path, batch_sizes=[1, 2])
+        results = model.predict_batch(['./resources/img/blue_box_1_000133.jpg'] * 5)
+        self.assertEqual(len(results), 5, 'should split the request into several forward passes')
+        for result in results:
+            self.assert_on_inference(result, 0.0, .70)
+
+    def test_repeated_image_is_served_from_cache(self):
+        model = MLModel(param_path, cache=ResultCache(max_size=4))
+        filepath = './resources/img/blue_box_1_000133.jpg'
+        first = model.predict_from_file(filepath)
+        second = model.predict_from_file(filepath)
+        self.assertEqual(first, second)
+        stats = model.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1), 'second prediction should come from the cache')
+
+    def test_predict_from_bytes_matches_file(self):
+        model = MLModel(param_path)
+        filepath = './resources/img/yellow_box_1_000086.jpg'
+        with open(filepath, 'rb') as f:
+            results = model.predict_from_bytes(f.read())
+        self.assert_on_inference(results, 1.0, .70)
+        self.assertAlmostEqual(results[0][1], model.predict_from_file(filepath)[0][1], places=4)
+
+    def test_postprocessor_returns_all_detections(self):
+        model = MLModel(param_path, postprocessor=DetectionPostprocessor(threshold=0.1, nms_threshold=0.45, top_k=10))
+        results = model.predict_from_file('./resources/img/yellow_box_1_000086.jpg')
+        self.assertTrue(1 <= len(results) <= 10, 'should return the detections above the threshold')
+        self.assertEqual(results[0][0], 1.0, 'top detection should come first')
+        self.assertTrue(all(result[1] >= 0.1 for result in results))
+
+    def test_lower_resolution_finds_the_same_box(self):
+        model = MLModel(param_path, resolutions=[300, 384])
+        filepath = './resources/img/yellow_box_1_000086.jpg'
+        expected = model.predict_from_file(filepath)
+        for resolution in [300, 384]:
+            results = model.predict_batch([filepath], resolution)[0]
+            self.assertEqual(results[0][0], expected[0][0])
+            self.assertIn((1, 3, resolution, resolution), model.backend._modules)
+        self.assertRaises(ValueError, model.predict_batch, [filepath], 256)
+
+    def test_letterboxed_boxes_are_in_original_coordinates(self):
+        image = cv2.imread('./resources/img/blue_box_1_000133.jpg')
+        expected = MLModel(param_path).predict_batch([image])[0]
+        # Padding the image to twice its height moves the box, but it should map back to the same place
+        padded = cv2.copyMakeBorder(image, 0, image.shape[0], 0, 0, cv2.BORDER_CONSTANT, value=(127, 127, 127))
+        results = MLModel(param_path, letterbox=True).predict_batch([padded])[0]
+        self.assertEqual(results[0][0], expected[0][0])
+        self.assertAlmostEqual(results[0][3] * 2, expected[0][3], places=1)
+        self.assertAlmostEqual(results[0][2], expected[0][2], places=1)
+
+    def test_warm_up_binds_executors(self):
+        model = MLModel(param_path)
+        model.warm_up([1, 4])
+        self.assertIn((4, 3, 512, 512), model.backend._modules, 'warm up should bind the executor for each batch size')
+
+    def test_concurrent_callers_do_not_mix_batches(self):
+        model = MLModel(param_path)
+        images = {0.0: cv2.imread('./resources/img/blue_box_1_000133.jpg'),
+                  1.0: cv2.imread('./resources/img/yellow_box_1_000086.jpg')}
+        wrong = []
+
+        def predict(sku):
+            for _ in range(5):
+                if model.predict_batch([images[sku]])[0][0][0] != sku:
+                    wrong.append(sku)
+
+        threads = [threading.Thread(target=predict, args=(sku,)) for sku in [0.0, 1.0, 0.0, 1.0]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(wrong, [])
+
+    def test_checkpoint_is_parsed_once_while_shared(self):
+        with shared_checkpoints():
+            checkpoint = load_checkpoint(param_path)
+            self.assertIs(load_checkpoint(param_path), checkpoint)
+        self.assertIsNot(load_checkpoint(param_path), checkpoint, 'should not keep the checkpoint after the block')
+
     def assert_on_inference(self, results, sku, pred_threshold):
         self.assertEqual(results[0][0], sku, 'model made an incorrect prediction')
         self.assertTrue(results[0][1] > pred_threshold, 'model accuracy is below acceptable threshold')
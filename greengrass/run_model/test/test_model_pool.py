@@ -0,0 +1,32 @@
+import unittest
+import mxnet as mx
+from src.model_pool import MLModelPool
+
+param_path = './resources/ml/od/deploy_model_algo_1'
+blue_box = './resources/img/blue_box_1_000133.jpg'
+yellow_box = './resources/img/yellow_box_1_000086.jpg'
+
+
+class TestMLModelPool(unittest.TestCase):
+
+    def test_single_context_behaves_like_model(self):
+        pool = MLModelPool(param_path, contexts=[mx.cpu()])
+        results = pool.predict_from_file(yellow_box)
+        self.assertEqual(results[0][0], 1.0, 'model made an incorrect prediction')
+        self.assertEqual(len(pool.utilization()), 1)
+        pool.close()
+
+    def test_batch_is_split_across_replicas_in_order(self):
+        pool = MLModelPool(param_path, contexts=[mx.cpu(0), mx.cpu(1)])
+        results = pool.predict_batch([blue_box, yellow_box, blue_box])
+        self.assertEqual([result[0][0] for result in results], [0.0, 1.0, 0.0])
+
+        utilization = pool.utilization()
+        self.assertEqual([replica['requests'] for replica in utilization], [1, 1], 'should use both replicas')
+        self.assertTrue(all(replica['in_flight'] == 0 for replica in utilization))
+        self.assertTrue(all(0 < replica['utilization'] <= 1 for replica in utilization))
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from src.model_watcher import ModelHolder, ModelWatcher, checkpoint_version
+
+
+class FakeModel(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestModelHolder(unittest.TestCase):
+
+    def test_swap_waits_for_requests_on_previous_model(self):
+        holder = ModelHolder()
+        holder.swap('old', 'v1')
+        entered = threading.Event()
+        release = threading.Event()
+
+        def request():
+            with holder.acquire() as (model, version):
+                self.assertEqual((model, version), ('old', 'v1'))
+                entered.set()
+                release.wait()
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        entered.wait()
+
+        swapped = []
+        swapper = threading.Thread(target=lambda: swapped.append(holder.swap('new', 'v2')))
+        swapper.start()
+        time.sleep(0.05)
+        self.assertEqual(swapped, [], 'swap should wait for the request on the old model')
+        with holder.acquire() as (model, version):
+            self.assertEqual((model, version), ('new', 'v2'), 'new requests should use the new model right away')
+
+        release.set()
+        thread.join()
+        swapper.join()
+        self.assertEqual(swapped, [('old', True)])
+        self.assertEqual(holder.in_flight(), 0)
+
+    def test_swap_gives_up_after_drain_timeout(self):
+        holder = ModelHolder()
+        holder.swap('old', 'v1')
+        with holder.acquire():
+            self.assertEqual(holder.swap('new', 'v2', drain_timeout=0.01), ('old', False))
+
+    def test_close_waits_for_requests_on_previous_model(self):
+        holder = ModelHolder()
+        old = FakeModel()
+        holder.swap(old, 'v1')
+        with holder.acquire():
+            old_model, drained = holder.swap(FakeModel(), 'v2', drain_timeout=0.01)
+            self.assertFalse(drained)
+            holder.close_when_drained(old_model)
+            self.assertFalse(old.closed, 'should not close the model while a request is running on it')
+        self.assertTrue(old.closed, 'should close the model once its last request finishes')
+
+    def test_drained_model_is_closed_right_away(self):
+        holder = ModelHolder()
+        old = FakeModel()
+        holder.swap(old, 'v1')
+        holder.close_when_drained(holder.swap(FakeModel(), 'v2')[0])
+        self.assertTrue(old.closed)
+
+
+class TestModelWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.param_path = os.path.join(self.directory, 'deploy_model_algo_1')
+        self.write_checkpoint(b'v1', 1000)
+        self.changes = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_checkpoint(self, content, mtime):
+        for filename in ['deploy_model_algo_1-symbol.json', 'deploy_model_algo_1-0000.params']:
+            path = os.path.join(self.directory, filename)
+            with open(path, 'wb') as f:
+                f.write(content)
+            os.utime(path, (mtime, mtime))
+
+    def test_checkpoint_version(self):
+        self.assertEqual(checkpoint_version(self.param_path), '1000-2')
+        self.assertIsNone(checkpoint_version(os.path.join(self.directory, 'missing')))
+
+    def test_reports_change_once_files_are_stable(self):
+        watcher = ModelWatcher(self.param_path, self.changes.append)
+        self.assertFalse(watcher.check())
+
+        self.write_checkpoint(b'version2', 2000)
+        self.assertFalse(watcher.check(), 'should wait for the files to stop changing')
+        self.assertTrue(watcher.check())
+        self.assertEqual(self.changes, ['2000-8'])
+        self.assertFalse(watcher.check(), 'should only report a version once')
+
+    def test_failed_reload_is_not_retried(self):
+        def fail(version):
+            self.changes.append(version)
+            raise ValueError('broken checkpoint')
+
+        watcher = ModelWatcher(self.param_path, fail)
+        self.write_checkpoint(b'broken', 3000)
+        watcher.check()
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+        self.assertEqual(self.changes, ['3000-6'])
+
+
+if __name__ == '__main__':
+    unittest.main()
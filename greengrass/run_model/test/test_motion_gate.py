@@ -0,0 +1,72 @@
+import unittest
+
+import cv2
+import numpy as np
+from src.motion_gate import MotionGate
+
+
+def conveyor_frame(box_x=None, noise_seed=None):
+    frame = np.full((240, 320, 3), 90, dtype=np.uint8)
+    if noise_seed is not None:
+        noise = np.random.RandomState(noise_seed).randint(-3, 4, frame.shape)
+        frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    if box_x is not None:
+        cv2.rectangle(frame, (box_x, 80), (box_x + 60, 160), (255, 0, 0), -1)
+    return frame
+
+
+class TestMotionGate(unittest.TestCase):
+
+    def test_first_frame_is_inferred(self):
+        gate = MotionGate()
+        self.assertTrue(gate.should_infer(conveyor_frame()))
+
+    def test_static_frames_reuse_last_result(self):
+        gate = MotionGate()
+        gate.should_infer(conveyor_frame())
+        gate.remember('result')
+        for seed in range(5):
+            self.assertFalse(gate.should_infer(conveyor_frame(noise_seed=seed)), 'noise should not count as motion')
+        self.assertEqual(gate.last_result, 'result')
+
+        stats = gate.stats()
+        self.assertEqual(stats['frames'], 6)
+        self.assertEqual(stats['skipped'], 5)
+        self.assertAlmostEqual(stats['skip_rate'], 5 / 6.0)
+
+    def test_new_object_is_inferred(self):
+        gate = MotionGate()
+        gate.should_infer(conveyor_frame())
+        gate.remember('empty belt')
+        self.assertTrue(gate.should_infer(conveyor_frame(box_x=100)))
+
+    def test_slow_drift_adds_up(self):
+        gate = MotionGate(threshold=0.05)
+        gate.should_infer(conveyor_frame(box_x=100))
+        gate.remember('box')
+        # Each step moves the box a little, but compared with the last inferred frame the change keeps growing
+        results = [gate.should_infer(conveyor_frame(box_x=100 + 2 * step)) for step in range(1, 20)]
+        self.assertFalse(results[0])
+        self.assertTrue(any(results))
+
+    def test_max_skip_frames_forces_inference(self):
+        gate = MotionGate(max_skip_frames=3)
+        gate.should_infer(conveyor_frame())
+        gate.remember('result')
+        results = [gate.should_infer(conveyor_frame()) for _ in range(4)]
+        self.assertEqual(results, [False, False, False, True])
+
+    def test_mog2_detects_motion(self):
+        gate = MotionGate(method='mog2')
+        for _ in range(20):
+            gate.should_infer(conveyor_frame())
+            gate.remember('empty belt')
+        self.assertFalse(gate.should_infer(conveyor_frame()))
+        self.assertTrue(gate.should_infer(conveyor_frame(box_x=100)))
+
+    def test_unknown_method_is_rejected(self):
+        self.assertRaises(ValueError, MotionGate, 'optical_flow')
+
+
+if __name__ == '__main__':
+    unittest.main()
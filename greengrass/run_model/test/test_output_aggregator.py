@@ -0,0 +1,132 @@
+import threading
+import time
+import unittest
+
+from src.output_aggregator import OutputAggregator, detections_changed
+
+box = [1.0, 0.9, 0.1, 0.1, 0.4, 0.4]
+
+
+def response(source='camera-1', prediction=None):
+    return {'prediction': [box] if prediction is None else prediction, 'timestamp': time.time(), 'source': source}
+
+
+class TestOutputAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.published = threading.Event()
+
+    def publish(self, batch):
+        self.batches.append(batch)
+        self.published.set()
+
+    def test_publishes_when_batch_is_full(self):
+        aggregator = OutputAggregator(self.publish, max_count=3, max_delay_ms=60000)
+        for _ in range(7):
+            aggregator.add(response())
+        self.assertEqual([len(batch) for batch in self.batches], [3, 3])
+        self.assertEqual(aggregator.metrics()['pending'], 1)
+        aggregator.stop()
+        self.assertEqual([len(batch) for batch in self.batches], [3, 3, 1])
+
+    def test_publishes_after_max_delay(self):
+        aggregator = OutputAggregator(self.publish, max_count=100, max_delay_ms=50)
+        aggregator.start()
+        try:
+            start = time.time()
+            aggregator.add(response())
+            aggregator.add(response())
+            self.assertTrue(self.published.wait(2))
+            self.assertGreaterEqual(time.time() - start, 0.04)
+            self.assertEqual([len(batch) for batch in self.batches], [2])
+        finally:
+            aggregator.stop()
+        self.assertEqual(aggregator.metrics()['batches'], 1)
+
+    def test_changes_only_per_source(self):
+        aggregator = OutputAggregator(self.publish, max_count=100, changes_only=True)
+        self.assertTrue(aggregator.add(response('camera-1')))
+        self.assertTrue(aggregator.add(response('camera-2')))
+        self.assertFalse(aggregator.add(response('camera-1')))
+        self.assertTrue(aggregator.add(response('camera-1', [])))
+        self.assertFalse(aggregator.add(response('camera-1', [])))
+        aggregator.flush()
+        self.assertEqual([r['source'] for r in self.batches[0]], ['camera-1', 'camera-2', 'camera-1'])
+        self.assertEqual(aggregator.metrics()['unchanged'], 2)
+
+    def test_slow_drift_is_published_once_it_adds_up(self):
+        aggregator = OutputAggregator(self.publish, max_count=100, changes_only=True)
+        kept = []
+        for step in range(10):
+            # Every frame is above 0.8 IoU of the one before it, but not of the frame published 4 steps earlier
+            offset = 0.01 * step
+            moved = [1.0, 0.9, 0.1 + offset, 0.1, 0.4 + offset, 0.4]
+            if aggregator.add(response('camera-1', [moved])):
+                kept.append(step)
+        self.assertEqual(kept[0], 0)
+        self.assertGreater(len(kept), 1, 'drift past the IoU threshold should be published')
+
+    def test_batches_are_published_in_order(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        def publish(batch):
+            if batch[0]['id'] == 1:
+                entered.set()
+                release.wait()
+            self.batches.append(batch)
+
+        aggregator = OutputAggregator(publish, max_count=1)
+        first = threading.Thread(target=aggregator.add, args=(dict(response(), id=1),))
+        first.start()
+        self.assertTrue(entered.wait(5))
+        second = threading.Thread(target=aggregator.add, args=(dict(response(), id=2),))
+        second.start()
+        second.join(0.1)
+        try:
+            self.assertEqual(self.batches, [], 'the second batch should wait for the first to be published')
+        finally:
+            release.set()
+            first.join(5)
+            second.join(5)
+        self.assertEqual([[r['id'] for r in batch] for batch in self.batches], [[1], [2]])
+
+    def test_publish_failure_is_not_raised(self):
+        def fail(batch):
+            raise IOError('connection lost')
+        aggregator = OutputAggregator(fail, max_count=1)
+        self.assertTrue(aggregator.add(response()))
+
+
+class TestDetectionsChanged(unittest.TestCase):
+
+    def test_changes(self):
+        self.assertTrue(detections_changed(None, []))
+        self.assertFalse(detections_changed([box], [list(box)]))
+        self.assertTrue(detections_changed([box], [box, box]))
+        self.assertTrue(detections_changed([box], [[2.0] + box[1:]]))
+        moved = [1.0, 0.9, 0.3, 0.3, 0.6, 0.6]
+        self.assertTrue(detections_changed([box], [moved]))
+        jitter = [1.0, 0.9, 0.101, 0.1, 0.401, 0.4]
+        self.assertFalse(detections_changed([box], [jitter]))
+
+    def test_order_and_scores(self):
+        other = [0.0, 0.5, 0.5, 0.5, 0.9, 0.9]
+        self.assertFalse(detections_changed([box, other], [other, box]))
+        lower = [1.0, 0.5] + box[2:]
+        self.assertFalse(detections_changed([box], [lower]))
+        self.assertTrue(detections_changed([box], [lower], max_score_delta=0.1))
+
+    def test_boxes_are_matched_by_overlap(self):
+        top = [1.0, 0.9, 0.100, 0.10, 0.300, 0.30]
+        bottom = [1.0, 0.9, 0.105, 0.60, 0.305, 0.80]
+        # Both boxes shift so that their order on xmin swaps, yet each still overlaps its previous position
+        top_moved = [1.0, 0.9, 0.110, 0.10, 0.310, 0.30]
+        bottom_moved = [1.0, 0.9, 0.100, 0.60, 0.300, 0.80]
+        self.assertFalse(detections_changed([top, bottom], [bottom_moved, top_moved]))
+        self.assertTrue(detections_changed([top, bottom], [top_moved, top_moved]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import threading
+import unittest
+from src.pipeline import InferencePipeline
+
+
+class TestInferencePipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.published = []
+        self.batch_sizes = []
+
+    def infer(self, decoded):
+        self.batch_sizes.append(len(decoded))
+        return [value * 10 for value in decoded]
+
+    def publish(self, item, result):
+        self.published.append((item, result))
+
+    def test_runs_requests_through_all_stages(self):
+        pipeline = InferencePipeline(lambda item: item + 1, self.infer, self.publish, decode_workers=3, max_batch_size=4)
+        pipeline.start()
+        for i in range(20):
+            self.assertTrue(pipeline.submit(i))
+        pipeline.stop()
+
+        self.assertEqual(sorted(self.published), [(i, (i + 1) * 10) for i in range(20)])
+        self.assertTrue(all(size <= 4 for size in self.batch_sizes), 'should respect max_batch_size')
+        metrics = pipeline.metrics()
+        self.assertEqual(metrics['submitted'], 20)
+        self.assertEqual(metrics['published'], 20)
+
+    def test_decode_failure_still_publishes(self):
+        def decode(item):
+            if item == 'bad':
+                raise ValueError('cannot decode')
+            return 1
+
+        pipeline = InferencePipeline(decode, lambda decoded: [value is not None for value in decoded], self.publish)
+        pipeline.start()
+        pipeline.submit('good')
+        pipeline.submit('bad')
+        pipeline.stop()
+        self.assertEqual(sorted(self.published), [('bad', False), ('good', True)])
+
+    def test_inference_failure_reports_every_request(self):
+        failures = []
+
+        def infer(decoded):
+            raise RuntimeError('forward pass failed')
+
+        pipeline = InferencePipeline(lambda item: item, infer, self.publish, max_batch_size=4,
+                                     on_error=lambda item, error: failures.append((item, str(error))))
+        pipeline.start()
+        for i in range(3):
+            pipeline.submit(i)
+        pipeline.stop()
+        self.assertEqual(sorted(failures), [(i, 'forward pass failed') for i in range(3)])
+        self.assertEqual(self.published, [])
+        metrics = pipeline.metrics()
+        self.assertEqual((metrics['failed'], metrics['published']), (3, 0))
+
+    def test_slow_publisher_applies_back_pressure(self):
+        release = threading.Event()
+
+        def publish(item, result):
+            release.wait()
+
+        pipeline = InferencePipeline(lambda item: item, lambda decoded: decoded, publish, decode_workers=1,
+                                     queue_size=1, submit_timeout=0.05)
+        pipeline.start()
+        accepted = 0
+        for i in range(20):
+            if pipeline.submit(i):
+                accepted += 1
+        self.assertLess(accepted, 20, 'should reject requests once every queue is full')
+        self.assertGreater(pipeline.metrics()['rejected'], 0)
+        release.set()
+        pipeline.stop()
+        self.assertEqual(pipeline.metrics()['published'], accepted)
+
+
+if __name__ == '__main__':
+    unittest.main()
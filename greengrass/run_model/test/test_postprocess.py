@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+from src.postprocess import DetectionPostprocessor, box_iou, filter_detections, map_boxes, nms_keep
+
+detections = np.array([
+    [0, 0.90, 0.10, 0.10, 0.40, 0.40],
+    [0, 0.80, 0.12, 0.12, 0.42, 0.42],  # overlaps the first blue box
+    [1, 0.85, 0.11, 0.11, 0.41, 0.41],  # same place as the blue boxes but a different class
+    [1, 0.40, 0.60, 0.60, 0.90, 0.90],
+    [0, 0.60, 0.60, 0.10, 0.90, 0.40],
+    [-1, -1, -1, -1, -1, -1],
+    [-1, -1, -1, -1, -1, -1],
+], dtype=np.float32)
+
+
+class TestPostprocess(unittest.TestCase):
+
+    def test_box_iou(self):
+        boxes = np.array([[0, 0, 2, 2], [1, 1, 3, 3], [5, 5, 6, 6]], dtype=np.float32)
+        iou = box_iou(boxes, boxes)
+        np.testing.assert_allclose(np.diag(iou), 1.0)
+        self.assertAlmostEqual(iou[0, 1], 1.0 / 7, places=5)
+        self.assertEqual(iou[0, 2], 0.0)
+
+    def test_drops_padding_and_low_scores(self):
+        result = filter_detections(detections, threshold=0.5)
+        self.assertEqual(len(result), 4)
+        self.assertTrue((result[:, 0] >= 0).all(), 'should drop padded rows')
+        self.assertTrue((np.diff(result[:, 1]) <= 0).all(), 'should be sorted by descending score')
+
+    def test_per_class_thresholds(self):
+        result = filter_detections(detections, threshold=0.5, class_thresholds={1: 0.3, 0: 0.85})
+        np.testing.assert_allclose(result[:, 1], [0.90, 0.85, 0.40])
+
+    def test_nms_is_class_aware(self):
+        result = filter_detections(detections, threshold=0.5, nms_threshold=0.5)
+        np.testing.assert_allclose(result[:, 1], [0.90, 0.85, 0.60])
+
+    def test_nms_keep_on_empty_input(self):
+        self.assertEqual(len(nms_keep(np.zeros((0, 6), dtype=np.float32), 0.5)), 0)
+        self.assertEqual(len(filter_detections(detections[5:], threshold=0.5, nms_threshold=0.5)), 0)
+
+    def test_top_k(self):
+        result = filter_detections(detections, threshold=0.0, top_k=2)
+        np.testing.assert_allclose(result[:, 1], [0.90, 0.85])
+
+    def test_postprocessor_returns_lists(self):
+        postprocessor = DetectionPostprocessor(threshold=0.5, nms_threshold=0.5, top_k=1)
+        result = postprocessor(detections)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(len(result[0]), 6)
+        self.assertIsInstance(result[0][1], float)
+
+    def test_map_boxes_undoes_letterbox(self):
+        # A 200x100 image letterboxed into a square input takes rows 0.25 to 0.75
+        mapped = map_boxes(np.array([[0, 0.9, 0.5, 0.25, 1.0, 0.5],
+                                     [1, 0.8, 0.0, 0.2, 0.5, 0.8],
+                                     [-1, -1, -1, -1, -1, -1]], dtype=np.float32), (0.0, 0.25, 1.0, 2.0))
+        np.testing.assert_allclose(mapped[0], [0, 0.9, 0.5, 0.0, 1.0, 0.5])
+        np.testing.assert_allclose(mapped[1], [1, 0.8, 0.0, 0.0, 0.5, 1.0], err_msg='should clip to the image')
+        np.testing.assert_array_equal(mapped[2], [-1] * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import cv2
+import numpy as np
+from src.preprocess import IDENTITY_TRANSFORM, LETTERBOX_FILL, InputBuffer
+
+image_path = './resources/img/blue_box_1_000133.jpg'
+
+
+class TestInputBuffer(unittest.TestCase):
+
+    def test_fill_matches_reference_preprocessing(self):
+        img = cv2.imread(image_path)
+        buf = InputBuffer(2, 512, 512)
+        buf.fill(1, img)
+
+        expected = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), (512, 512))
+        expected = np.swapaxes(np.swapaxes(expected, 0, 2), 1, 2).astype(np.float32)
+        np.testing.assert_array_equal(buf.data[1], expected)
+
+    def test_fill_reuses_buffer(self):
+        img = cv2.imread(image_path)
+        buf = InputBuffer(1, 300, 300)
+        data = buf.data
+        buf.fill(0, img)
+        self.assertIs(buf.data, data, 'should write into the preallocated buffer')
+        self.assertTrue(buf.data.flags['C_CONTIGUOUS'])
+        self.assertEqual(buf.data.dtype, np.float32)
+
+    def test_fill_image_already_at_input_size(self):
+        img = np.random.randint(0, 255, (64, 32, 3)).astype(np.uint8)
+        buf = InputBuffer(1, 64, 32)
+        buf.fill(0, img)
+        np.testing.assert_array_equal(buf.data[0], img[:, :, ::-1].transpose(2, 0, 1))
+
+    def test_letterbox_keeps_aspect_ratio(self):
+        img = np.full((100, 200, 3), (255, 0, 0), dtype=np.uint8)
+        buf = InputBuffer(1, 100, 100)
+        transform = buf.fill(0, img, letterbox=True)
+
+        self.assertEqual(transform, (0.0, 0.25, 1.0, 2.0))
+        # The image takes the middle 50 rows, the rows above and below are padding
+        np.testing.assert_array_equal(buf.data[0][:, 25:75], np.broadcast_to([[[0]], [[0]], [[255]]], (3, 50, 100)))
+        self.assertTrue((buf.data[0][:, :25] == LETTERBOX_FILL).all())
+        self.assertTrue((buf.data[0][:, 75:] == LETTERBOX_FILL).all())
+
+    def test_letterbox_pads_previous_image(self):
+        buf = InputBuffer(1, 100, 100)
+        buf.fill(0, np.zeros((100, 100, 3), dtype=np.uint8))
+        transform = buf.fill(0, np.zeros((200, 100, 3), dtype=np.uint8), letterbox=True)
+        self.assertEqual(transform, (0.25, 0.0, 2.0, 1.0))
+        self.assertTrue((buf.data[0][:, :, :25] == LETTERBOX_FILL).all(), 'padding should overwrite the old image')
+
+    def test_letterbox_same_aspect_ratio_is_stretched(self):
+        buf = InputBuffer(1, 50, 50)
+        self.assertEqual(buf.fill(0, np.zeros((100, 100, 3), dtype=np.uint8), letterbox=True), IDENTITY_TRANSFORM)
+
+
+if __name__ == '__main__':
+    unittest.main()
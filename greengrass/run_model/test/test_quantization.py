@@ -0,0 +1,45 @@
+import unittest
+from src.model_loader import MLModel
+from src.quantization import Int8Quantizer, accuracy_drift, calibration_batch, list_images
+
+param_path = './resources/ml/od/deploy_model_algo_1'
+image_dir = './resources/img'
+
+
+class FixedModel(object):
+    def __init__(self, results):
+        self.results = results
+
+    def predict_from_file(self, filepath):
+        return self.results[filepath]
+
+
+class TestQuantization(unittest.TestCase):
+
+    def test_list_images(self):
+        filepaths = list_images(image_dir, limit=2)
+        self.assertEqual(len(filepaths), 2)
+        self.assertEqual(filepaths, sorted(filepaths))
+
+    def test_calibration_batch_matches_network_input(self):
+        batch = calibration_batch(list_images(image_dir), (3, 128, 128))
+        self.assertEqual(batch.shape, (2, 3, 128, 128))
+
+    def test_accuracy_drift(self):
+        reference = FixedModel({'a': [[0.0, 0.9, 0.1, 0.1, 0.5, 0.5]], 'b': [[1.0, 0.8, 0.2, 0.2, 0.6, 0.6]]})
+        candidate = FixedModel({'a': [[0.0, 0.85, 0.1, 0.1, 0.5, 0.5]], 'b': [[0.0, 0.7, 0.2, 0.2, 0.6, 0.6]]})
+        drift = accuracy_drift(reference, candidate, ['a', 'b'])
+        self.assertEqual(drift['agreement'], 0.5)
+        self.assertAlmostEqual(drift['max_abs_score_delta'], 0.1, places=5)
+        self.assertAlmostEqual(drift['mean_iou'], 1.0, places=5)
+        self.assertFalse(drift['images'][1]['agree'])
+
+    def test_int8_model_agrees_with_fp32(self):
+        quantizer = Int8Quantizer(image_dir, num_calib_images=5)
+        int8 = MLModel(param_path, batch_sizes=[1], quantizer=quantizer)
+        drift = accuracy_drift(MLModel(param_path, batch_sizes=[1]), int8, list_images(image_dir, limit=5))
+        self.assertGreaterEqual(drift['agreement'], 0.8, 'INT8 model should mostly agree with the fp32 model')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import time
+import unittest
+import cv2
+import numpy as np
+from src.result_cache import ResultCache, content_hash, perceptual_hash, hamming_distance
+
+image_path = './resources/img/blue_box_1_000133.jpg'
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_hit_and_miss_counters(self):
+        cache = ResultCache(max_size=2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', [[0.0, 0.9]])
+        self.assertEqual(cache.get('a'), [[0.0, 0.9]])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'), 'least recently used entry should be evicted')
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = ResultCache(ttl_seconds=0.05)
+        cache.put('a', 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_hits_do_not_keep_entries_from_expiring(self):
+        cache = ResultCache(ttl_seconds=0.1)
+        cache.put('a', 1)
+        time.sleep(0.06)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'), 'should expire even though it was used after b was stored')
+        self.assertEqual(cache.get('b'), 2)
+        cache.put('a', 3)
+        self.assertEqual(cache.get('a'), 3)
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_content_hash_of_bytes_and_arrays(self):
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(content_hash(data), content_hash(data))
+        img = cv2.imread(image_path)
+        self.assertNotEqual(content_hash(img), content_hash(img[:, ::-1]))
+
+    def test_perceptual_mode_matches_near_duplicates(self):
+        img = cv2.imread(image_path)
+        noisy = cv2.imdecode(cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 70])[1], cv2.IMREAD_COLOR)
+        self.assertLessEqual(hamming_distance(perceptual_hash(img), perceptual_hash(noisy)), 4)
+
+        cache = ResultCache(perceptual=True)
+        cache.put(content_hash(img), 'cached', perceptual_hash(img))
+        self.assertEqual(cache.get(content_hash(noisy), perceptual_hash(noisy)), 'cached')
+        self.assertEqual(cache.stats()['perceptual_hits'], 1)
+
+        different = np.ascontiguousarray(img[::-1])
+        self.assertIsNone(cache.get(content_hash(different), perceptual_hash(different)))
+
+    def test_perceptual_match_keeps_to_the_same_input_size(self):
+        img = cv2.imread(image_path)
+        noisy = cv2.imdecode(cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 70])[1], cv2.IMREAD_COLOR)
+        cache = ResultCache(perceptual=True)
+        cache.put((content_hash(img), (512, 512)), 'at 512', perceptual_hash(img))
+        self.assertIsNone(cache.get((content_hash(noisy), (300, 300)), perceptual_hash(noisy)))
+        self.assertEqual(cache.get((content_hash(noisy), (512, 512)), perceptual_hash(noisy)), 'at 512')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from src.store_forward import RingBuffer, StoreAndForward
+
+
+class SimulatedUplink(object):
+    """
+    Stands in for the cloud connection: records what it publishes while up and fails while down
+    """
+    def __init__(self):
+        self.up = True
+        self.messages = []
+        self.times = []
+        self.received = threading.Condition()
+
+    def send(self, topic, payload):
+        if not self.up:
+            raise IOError('uplink is down')
+        with self.received:
+            self.messages.append((topic, payload))
+            self.times.append(time.time())
+            self.received.notify_all()
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.time() + timeout
+        with self.received:
+            while len(self.messages) < count and time.time() < deadline:
+                self.received.wait(deadline - time.time())
+        return len(self.messages) >= count
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'buffer')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def drain(self, buffer):
+        records = []
+        while len(buffer):
+            records.append(buffer.peek())
+            buffer.pop()
+        return records
+
+    def test_records_come_out_in_order(self):
+        buffer = RingBuffer(self.path, 1024)
+        for i in range(5):
+            buffer.append('record-{}'.format(i).encode('utf-8'))
+        self.assertEqual(self.drain(buffer), ['record-{}'.format(i).encode('utf-8') for i in range(5)])
+        self.assertIsNone(buffer.peek())
+
+    def test_full_buffer_evicts_oldest_records(self):
+        buffer = RingBuffer(self.path, 100)
+        # Records take 4 + 16 bytes, so 5 fit and every later one wraps around and evicts the oldest
+        for i in range(12):
+            buffer.append('record-{:09d}'.format(i).encode('utf-8'))
+        self.assertEqual(buffer.evicted, 7)
+        self.assertEqual(self.drain(buffer), ['record-{:09d}'.format(i).encode('utf-8') for i in range(7, 12)])
+
+    def test_records_of_different_sizes_wrap_around(self):
+        buffer = RingBuffer(self.path, 64)
+        expected = []
+        for i in range(40):
+            record = b'x' * (i % 7 + 1) + str(i).encode('utf-8')
+            buffer.append(record)
+            expected.append(record)
+        records = self.drain(buffer)
+        self.assertEqual(records, expected[-len(records):])
+        self.assertRaises(ValueError, buffer.append, b'x' * 64)
+
+    def test_records_survive_reopening(self):
+        buffer = RingBuffer(self.path, 100)
+        for i in range(8):
+            buffer.append('record-{:09d}'.format(i).encode('utf-8'))
+        buffer.pop()
+        buffer.close()
+
+        reopened = RingBuffer(self.path, 100)
+        self.assertEqual(self.drain(reopened), ['record-{:09d}'.format(i).encode('utf-8') for i in range(4, 8)])
+        reopened.close()
+        self.assertEqual(len(RingBuffer(self.path, 200)), 0, 'a buffer of another size should start empty')
+
+
+class TestStoreAndForward(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'buffer')
+        self.uplink = SimulatedUplink()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_publishes_directly_while_online(self):
+        forwarder = StoreAndForward(self.uplink.send, self.path, capacity_bytes=4096)
+        self.assertTrue(forwarder.publish('blog/infer/output', '{"id": 1}'))
+        self.assertEqual(self.uplink.messages, [('blog/infer/output', '{"id": 1}')])
+        self.assertEqual(forwarder.metrics()['sent'], 1)
+        forwarder.close()
+
+    def test_replays_in_order_with_rate_limit(self):
+        forwarder = StoreAndForward(self.uplink.send, self.path, capacity_bytes=4096, replay_rate=50,
+                                    retry_seconds=0.05)
+        forwarder.start()
+        try:
+            self.uplink.up = False
+            for i in range(5):
+                self.assertFalse(forwarder.publish('blog/infer/output', '{{"id": {}}}'.format(i)))
+            forwarder.publish('blog/infer/output/bin', b'\x00\x01')
+            self.assertFalse(forwarder.metrics()['online'])
+
+            self.uplink.up = True
+            self.assertFalse(forwarder.publish('blog/infer/output', '{"id": 5}'), 'should queue behind older messages')
+            self.assertTrue(self.uplink.wait_for(7))
+        finally:
+            forwarder.close()
+
+        self.assertEqual([payload for _, payload in self.uplink.messages],
+                         ['{{"id": {}}}'.format(i) for i in range(5)] + [b'\x00\x01', '{"id": 5}'])
+        self.assertEqual(self.uplink.messages[5][0], 'blog/infer/output/bin')
+        self.assertGreaterEqual(self.uplink.times[-1] - self.uplink.times[0], 6 / 50.0 * 0.9)
+        metrics = forwarder.metrics()
+        self.assertEqual((metrics['buffered'], metrics['replayed'], metrics['pending']), (7, 7, 0))
+        self.assertTrue(metrics['online'])
+
+    def test_buffered_messages_are_replayed_after_restart(self):
+        self.uplink.up = False
+        forwarder = StoreAndForward(self.uplink.send, self.path, capacity_bytes=4096)
+        forwarder.publish('blog/infer/output', 'before restart')
+        forwarder.close()
+
+        self.uplink.up = True
+        forwarder = StoreAndForward(self.uplink.send, self.path, capacity_bytes=4096, replay_rate=0)
+        forwarder.start()
+        try:
+            self.assertTrue(self.uplink.wait_for(1))
+        finally:
+            forwarder.close()
+        self.assertEqual(self.uplink.messages, [('blog/infer/output', 'before restart')])
+
+    def test_connectivity_check_holds_messages(self):
+        connected = [False]
+        forwarder = StoreAndForward(self.uplink.send, self.path, capacity_bytes=4096, retry_seconds=0.02,
+                                    is_connected=lambda: connected[0])
+        forwarder.start()
+        try:
+            deadline = time.time() + 2
+            while forwarder.metrics()['online'] and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(forwarder.publish('blog/infer/output', 'offline'))
+            time.sleep(0.1)
+            self.assertEqual(self.uplink.messages, [])
+            connected[0] = True
+            self.assertTrue(self.uplink.wait_for(1))
+        finally:
+            forwarder.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cv2
+import numpy as np
+from src.motion_gate import MotionGate
+from src.stream_runner import StreamRunner, parse_source
+
+
+class FakeModel(object):
+    """
+    Stands in for MLModel.predict_batch, returning the mean pixel value of each image after inference_seconds
+    """
+    def __init__(self, inference_seconds=0.0):
+        self.inference_seconds = inference_seconds
+        self.calls = 0
+
+    def predict_batch(self, images):
+        self.calls += 1
+        time.sleep(self.inference_seconds)
+        return [[[float(image.mean())]] for image in images]
+
+
+class TestStreamRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'stream.avi')
+        self.num_frames = 30
+        writer = cv2.VideoWriter(self.video, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48))
+        for i in range(self.num_frames):
+            writer.write(np.full((48, 64, 3), i * 8, dtype=np.uint8))
+        writer.release()
+        self.published = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def publish(self, frame, result):
+        self.published.append((frame.index, result))
+
+    def test_processes_every_frame_when_inference_keeps_up(self):
+        runner = StreamRunner(self.video, FakeModel().predict_batch, self.publish)
+        runner.run()
+
+        metrics = runner.metrics()
+        self.assertEqual(metrics['read'], self.num_frames)
+        self.assertEqual(metrics['inferred'], self.num_frames)
+        self.assertEqual([index for index, _ in self.published], list(range(self.num_frames)))
+
+    def test_skips_frames_when_inference_falls_behind(self):
+        model = FakeModel(inference_seconds=0.1)
+        runner = StreamRunner(self.video, model.predict_batch, self.publish, max_latency_ms=200)
+        start = time.time()
+        runner.run()
+
+        metrics = runner.metrics()
+        self.assertEqual(metrics['read'], self.num_frames, 'should still read every frame')
+        self.assertGreater(metrics['skipped'], 0)
+        self.assertLess(model.calls, self.num_frames / 2)
+        self.assertEqual(metrics['late'], 0, 'every frame should be answered within the latency target')
+        self.assertLess(time.time() - start, 1.5, 'should keep up with the 1 second video instead of lagging')
+
+    def test_publish_rate_is_limited(self):
+        runner = StreamRunner(self.video, FakeModel().predict_batch, self.publish, publish_rate=5)
+        runner.run()
+
+        self.assertEqual(runner.metrics()['inferred'], self.num_frames)
+        self.assertTrue(1 <= len(self.published) <= 6, 'should publish about 5 results over 1 second of video')
+
+    def test_gate_reuses_result_of_static_frames(self):
+        video = os.path.join(self.directory, 'static.avi')
+        writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48))
+        for i in range(self.num_frames):
+            writer.write(np.full((48, 64, 3), 0 if i < 15 else 200, dtype=np.uint8))
+        writer.release()
+
+        model = FakeModel()
+        runner = StreamRunner(video, model.predict_batch, self.publish, gate=MotionGate(width=32))
+        runner.run()
+
+        self.assertEqual(model.calls, 2, 'should only infer the first frame and the one where the scene changed')
+        self.assertEqual(runner.metrics()['gated'], self.num_frames - 2)
+        self.assertEqual(len(self.published), self.num_frames, 'gated frames should still be published')
+        self.assertEqual(self.published[14][1], self.published[0][1])
+
+    def test_missing_file_stops_right_away(self):
+        runner = StreamRunner(os.path.join(self.directory, 'missing.avi'), FakeModel().predict_batch, self.publish)
+        runner.run()
+        self.assertEqual(runner.metrics()['read'], 0)
+
+    def test_parse_source(self):
+        self.assertEqual(parse_source('0'), 0)
+        self.assertEqual(parse_source('rtsp://camera/stream'), 'rtsp://camera/stream')
+
+
+if __name__ == '__main__':
+    unittest.main()